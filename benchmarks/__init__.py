@@ -0,0 +1,61 @@
+"""Benchmarks of splango's hot paths, run by ``runbenchmarks.py``.
+
+Each scenario is a function registered with :func:`scenario`, which takes
+the run's options and returns the results of its :func:`measure` calls.
+
+"""
+import collections
+import time
+
+
+SCENARIOS = collections.OrderedDict()
+
+
+def scenario(func):
+    """Register ``func`` as the scenario named after it, without its
+    ``bench_`` prefix."""
+    SCENARIOS[func.__name__[len("bench_"):]] = func
+    return func
+
+
+def measure(scenario, params, func, number, repeat=3, setup=None,
+            unit="call"):
+    """Time ``func``, called ``number`` times in each of ``repeat`` runs.
+
+    :param scenario: the name of the scenario
+    :param params: a dictionary describing the case, e.g. its data size
+    :param setup: optional callable, called before each call of ``func``
+      and not timed, returning the arguments to call ``func`` with
+    :param unit: what a call of ``func`` stands for, e.g. ``"request"``
+    :return: the seconds per call of the fastest, median and mean runs
+    :rtype: dict
+
+    """
+    timings = []
+    for i in range(repeat):
+        elapsed = 0.0
+        for j in range(number):
+            args = setup() if setup is not None else ()
+            start = time.time()
+            func(*args)
+            elapsed += time.time() - start
+        timings.append(elapsed / number)
+
+    timings.sort()
+    median = timings[len(timings) // 2]
+    return {
+        "scenario": scenario,
+        "params": params,
+        "unit": unit,
+        "number": number,
+        "repeat": repeat,
+        "min": timings[0],
+        "median": median,
+        "mean": sum(timings) / len(timings),
+        "per_second": 1 / median if median else None,
+    }
+
+
+def get_key(result):
+    """Return what identifies ``result`` across runs."""
+    return (result["scenario"], tuple(sorted(result["params"].items())))
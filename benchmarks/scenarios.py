@@ -0,0 +1,108 @@
+from django.contrib.auth.models import AnonymousUser, User
+from django.template import RequestContext, Template
+from django.test.client import Client, RequestFactory
+
+from splango import RequestExperimentManager
+from splango.models import Experiment, ExperimentReport, GoalRecord, Subject
+from splango.synthetic import TrafficGenerator
+
+from . import measure, scenario
+
+
+@scenario
+def bench_middleware(options):
+    """Requests through the middleware stack, for new and returning
+    visitors, on pages declaring 0, 1 or 10 experiments."""
+    results = []
+    for count in (0, 1, 10):
+        path = "/experiments/%d/" % count
+        returning = Client()
+        returning.get(path)
+        results.append(measure(
+            "middleware", {"experiments": count, "visitor": "returning"},
+            lambda: returning.get(path),
+            number=options.number, unit="request"))
+        results.append(measure(
+            "middleware", {"experiments": count, "visitor": "new"},
+            lambda client: client.get(path),
+            setup=lambda: (Client(),),
+            number=options.number, unit="request"))
+    return results
+
+
+TAGS_TEMPLATE = """{% load splangotags %}
+{% for name in experiments %}
+{% experiment name variants "a,b" %}
+{% hyp name "a" %}<p>Variant A of {{ name }}</p>{% endhyp %}
+{% hyp name "b" %}<p>Variant B of {{ name }}</p>{% endhyp %}
+{% endfor %}"""
+
+
+@scenario
+def bench_template_tags(options):
+    """Rendering of ``{% experiment %}`` and ``{% hyp %}`` tags, for a
+    subject already enrolled."""
+    template = Template(TAGS_TEMPLATE)
+    request = RequestFactory().get("/")
+    request.session = {}
+    request.user = AnonymousUser()
+    request.experiments_manager = RequestExperimentManager(request)
+
+    results = []
+    for count in (1, 10):
+        context = {"experiments": ["bench_tag_%d" % i for i in range(count)]}
+        template.render(RequestContext(request, context))
+        results.append(measure(
+            "template_tags", {"experiments": count},
+            lambda: template.render(RequestContext(request, context)),
+            number=options.number, unit="render"))
+    return results
+
+
+@scenario
+def bench_report(options):
+    """Generation of an experiment report with a three goals funnel."""
+    sizes = [10000]
+    if options.scale == "full":
+        sizes.append(1000000)
+
+    funnel = ["bench_visit", "bench_signup", "bench_purchase"]
+    results = []
+    for size in sizes:
+        exp_name = "bench_report_%d" % size
+        TrafficGenerator(exp_name, {"a": 0.3, "b": 0.3, "c": 0.3}, funnel,
+                         drop_off=0.7, seed=0).generate(size)
+        report = ExperimentReport.objects.create(experiment_id=exp_name,
+                                                 funnel="\n".join(funnel))
+        results.append(measure(
+            "report", {"enrollments": size}, report.generate,
+            number=1, repeat=3, unit="report"))
+    return results
+
+
+@scenario
+def bench_login_merge(options):
+    """Merge of an anonymous subject, enrolled in 5 experiments with 3 goals
+    reached, into the subject of a user enrolled in 2 of them."""
+    exp_names = ["bench_merge_%d" % i for i in range(5)]
+    exps = [Experiment.declare(name, ["a", "b"]) for name in exp_names]
+    goals = ["bench_merge_goal_%d" % i for i in range(3)]
+    users = iter(User.objects.create(username="bench%d" % i)
+                 for i in xrange(options.number * 3))
+
+    def setup():
+        anonymous = Subject.objects.create()
+        registered = Subject.objects.create(registered_as=next(users))
+        for exp in exps:
+            exp.get_or_create_enrollment(anonymous)
+        for exp in exps[:2]:
+            exp.get_or_create_enrollment(registered)
+        for goal in goals:
+            GoalRecord.record(anonymous, goal, {"req_REMOTE_ADDR": ""})
+        GoalRecord.record(registered, goals[0], {"req_REMOTE_ADDR": ""})
+        return anonymous, registered
+
+    return [measure("login_merge", {"experiments": 5, "goals": 3},
+                    lambda anonymous, registered:
+                        anonymous.merge_into(registered),
+                    setup=setup, number=options.number, unit="merge")]
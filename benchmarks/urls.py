@@ -0,0 +1,17 @@
+from django.conf.urls import patterns, url
+from django.http import HttpResponse
+
+
+def experiments_page(request, count):
+    """Declare ``count`` experiments, as a page using them would."""
+    exp_manager = request.experiments_manager
+    variants = [exp_manager.declare_and_enroll("bench_exp_%d" % i, ["a", "b"])
+                for i in range(int(count))]
+    return HttpResponse("<html><body>%s</body></html>" %
+                        " ".join(v.name for v in variants))
+
+
+urlpatterns = patterns(
+    '',
+    url(r'^experiments/(\d+)/$', experiments_page),
+)
@@ -0,0 +1,182 @@
+"""Concurrent load test of the example project, run in-process.
+
+Simulated visitors, each with its own test client, are run by a pool of
+threads. A visitor views the sample page (which declares an experiment),
+reaches a goal, and some of them log in as one of a few shared users and
+view the page again, which merges their subject into the user's.
+
+Every request goes through the full middleware stack. Latencies include
+waiting for the GIL and for database locks: they show how splango behaves
+under contention, not how fast a real server would be.
+
+"""
+import collections
+import random
+import re
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.contrib.auth.models import User
+from django.core.signals import got_request_exception
+from django.db import DatabaseError, IntegrityError, connection
+from django.test.client import Client
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+
+PASSWORD = "loadtest"
+
+
+def percentile(values, p):
+    """Return the ``p`` percentile of the sorted ``values`` (nearest
+    rank)."""
+    if not values:
+        return None
+    rank = max(int(round(p / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+def classify(error):
+    """Name the kind of failure ``error`` (an exception or a message) is.
+
+    Only the first sentence of exception messages is kept, so that errors
+    differing by the values looked up are counted together.
+
+    """
+    if isinstance(error, basestring):
+        return error
+    message = re.split(r"[.!]\s", str(error), 1)[0]
+    if isinstance(error, IntegrityError):
+        return "unique constraint race (%s)" % message
+    if isinstance(error, DatabaseError) and "locked" in message:
+        return "lock contention (%s)" % message
+    return "%s: %s" % (type(error).__name__, message)
+
+
+class LoadTest(object):
+
+    """Replays ``visitors`` visitors with ``threads`` threads.
+
+    :param users: the number of users visitors log in as; the fewer, the
+      more concurrent merges into the same subject
+    :param login_rate: the share of visitors that log in
+    :param goal_rate: the share of visitors that reach the goal
+
+    """
+
+    def __init__(self, visitors=200, threads=8, users=10, login_rate=0.3,
+                 goal_rate=0.5, seed=None):
+        self.visitors = visitors
+        self.threads = threads
+        self.users = users
+        self.login_rate = login_rate
+        self.goal_rate = goal_rate
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+
+    def _store_exception(self, **kwargs):
+        # test clients share a single receiver: concurrent ones lose their
+        # exceptions, so keep each thread's here
+        self._local.error = sys.exc_info()[1]
+
+    def create_users(self):
+        for i in range(self.users):
+            user, created = User.objects.get_or_create(
+                username="loadtest%d" % i)
+            if created:
+                user.set_password(PASSWORD)
+                user.save()
+
+    def plan(self):
+        """Return the steps of each visitor, drawn beforehand so that a
+        seeded run does the same requests whatever the threads do."""
+        plans = []
+        for i in range(self.visitors):
+            steps = [("view", "get", "/example/sample/", None)]
+            if self.random.random() < self.goal_rate:
+                steps.append(("goal", "get", "/example/goal/signup/", None))
+            if self.random.random() < self.login_rate:
+                username = "loadtest%d" % self.random.randrange(self.users)
+                steps.append(("login", "post", "/example/login/",
+                              {"username": username, "password": PASSWORD}))
+                steps.append(("merge", "get", "/example/sample/", None))
+            plans.append(steps)
+        return plans
+
+    def visit(self, steps):
+        client = Client()
+        try:
+            for name, method, path, data in steps:
+                self._local.error = None
+                start = time.time()
+                try:
+                    response = getattr(client, method)(path, data or {})
+                except Exception as e:
+                    error = e
+                else:
+                    error = self._local.error
+                    if error is None and response.status_code >= 400:
+                        error = "HTTP %d" % response.status_code
+                elapsed = time.time() - start
+                with self._lock:
+                    self.latencies[name].append(elapsed)
+                    if error is not None:
+                        self.errors[(name, classify(error))] += 1
+                if error is not None:
+                    # the visitor gives up, as a user shown an error would
+                    return
+        finally:
+            connection.close()
+
+    def run(self):
+        """Run the visitors.
+
+        :return: the latency percentiles and throughput of each step, the
+          overall throughput and the errors
+        :rtype: dict
+
+        """
+        self.create_users()
+        plans = self.plan()
+        setup_test_environment()
+        got_request_exception.connect(self._store_exception,
+                                      dispatch_uid="splango-loadtest")
+        pool = ThreadPool(self.threads)
+        start = time.time()
+        try:
+            pool.map(self.visit, plans, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+            got_request_exception.disconnect(dispatch_uid="splango-loadtest")
+            teardown_test_environment()
+        elapsed = time.time() - start
+
+        steps = {}
+        total = 0
+        for name, values in self.latencies.items():
+            values.sort()
+            total += len(values)
+            steps[name] = {
+                "requests": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": values[-1],
+            }
+        return {
+            "visitors": self.visitors,
+            "threads": self.threads,
+            "seconds": elapsed,
+            "requests": total,
+            "per_second": total / elapsed if elapsed else None,
+            "steps": steps,
+            "errors": [{"step": step, "error": error, "count": count}
+                       for (step, error), count in
+                       sorted(self.errors.items())],
+        }
@@ -0,0 +1,65 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from myapp.loadtest import LoadTest
+
+
+class Command(BaseCommand):
+
+    help = ("Replay simulated visitors concurrently through the full "
+            "middleware stack, and report latency percentiles, throughput "
+            "and errors (lock contention, unique constraint races).")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--visitors', action='store', type='int',
+                    dest='visitors', default=200,
+                    help='Number of simulated visitors.'),
+        make_option('--threads', action='store', type='int',
+                    dest='threads', default=8,
+                    help='Number of concurrent visitors.'),
+        make_option('--users', action='store', type='int', dest='users',
+                    default=10,
+                    help='Number of users the visitors log in as.'),
+        make_option('--login-rate', action='store', type='float',
+                    dest='login_rate', default=0.3,
+                    help='Share of the visitors that log in.'),
+        make_option('--goal-rate', action='store', type='float',
+                    dest='goal_rate', default=0.5,
+                    help='Share of the visitors that reach the goal.'),
+        make_option('--seed', action='store', type='int', dest='seed',
+                    help='Seed of the random generator.'),
+        make_option('--json', action='store_true', dest='json',
+                    default=False,
+                    help='Write the results as JSON.'),
+    )
+
+    def handle(self, *args, **options):
+        results = LoadTest(
+            visitors=options['visitors'], threads=options['threads'],
+            users=options['users'], login_rate=options['login_rate'],
+            goal_rate=options['goal_rate'], seed=options['seed']).run()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2) + "\n")
+            return
+
+        self.stdout.write(
+            "%(requests)d requests by %(visitors)d visitors on %(threads)d "
+            "threads in %(seconds).1f s: %(per_second).1f requests/s\n\n"
+            % results)
+        self.stdout.write("%-8s %8s %9s %9s %9s %9s\n" % (
+            "step", "requests", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+        for name in ("view", "goal", "login", "merge"):
+            step = results["steps"].get(name)
+            if step is None:
+                continue
+            self.stdout.write("%-8s %8d %9.1f %9.1f %9.1f %9.1f\n" % (
+                name, step["requests"], step["p50"] * 1000,
+                step["p95"] * 1000, step["p99"] * 1000, step["max"] * 1000))
+
+        if results["errors"]:
+            self.stdout.write("\nerrors:\n")
+            for error in results["errors"]:
+                self.stdout.write("%(count)6d  %(step)s: %(error)s\n" % error)
@@ -3,4 +3,7 @@ from django.conf.urls import patterns, include, url
 urlpatterns = patterns(
     '',
     url(r'^sample/$', 'myapp.views.sample', name='myapp_sample'),
+    url(r'^goal/(?P<goal_name>[\w.-]+)/$', 'myapp.views.goal',
+        name='myapp_goal'),
+    url(r'^login/$', 'myapp.views.sign_in', name='myapp_login'),
 )
@@ -1,5 +1,8 @@
+from django.contrib.auth import authenticate, login
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.views.decorators.http import require_POST
 
 
 def sample(request):
@@ -12,3 +15,20 @@ def sample(request):
     ]
 
     return render_to_response("sample.html", {"cities":cities}, RequestContext(request))
+
+
+def goal(request, goal_name):
+    request.experiments_manager.log_goal(goal_name)
+    return HttpResponse("ok")
+
+
+@require_POST
+def sign_in(request):
+    """Log the user in, keeping the session, so that splango merges the
+    anonymous subject into the user's on the next request."""
+    user = authenticate(username=request.POST.get("username"),
+                        password=request.POST.get("password"))
+    if user is None:
+        return HttpResponseForbidden()
+    login(request, user)
+    return HttpResponse("ok")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""Run splango's benchmarks on an SQLite database.
+
+    ./runbenchmarks.py [options] [scenario ...]
+
+The scenarios are those of ``benchmarks/scenarios.py`` (all of them by
+default). Results are written as JSON, to compare them with the results of
+another run with ``--compare``.
+
+"""
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+from os.path import dirname, abspath
+from optparse import OptionParser
+
+from django.conf import settings, global_settings
+
+if not settings.configured and not os.environ.get('DJANGO_SETTINGS_MODULE'):
+    settings.configure(
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+            }
+        },
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'django.contrib.sessions',
+            'django.contrib.sites',
+
+            'splango',
+        ],
+        MIDDLEWARE_CLASSES=global_settings.MIDDLEWARE_CLASSES + (
+            'splango.middleware.ExperimentsMiddleware',
+        ),
+        TEMPLATE_CONTEXT_PROCESSORS=(
+            global_settings.TEMPLATE_CONTEXT_PROCESSORS +
+            ('django.core.context_processors.request',)),
+        ROOT_URLCONF='benchmarks.urls',
+        DEBUG=False,
+        SITE_ID=1,
+    )
+
+import django
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.simple import DjangoTestSuiteRunner
+
+
+def reset():
+    """Empty the database and the caches, between scenarios."""
+    from splango.models import goal_name_cache
+    from splango.registry import registry
+
+    call_command('flush', interactive=False, verbosity=0)
+    cache.clear()
+    goal_name_cache.clear()
+    registry.clear()
+
+
+def runbenchmarks(names, options):
+    sys.path.insert(0, dirname(abspath(__file__)))
+    from benchmarks import SCENARIOS
+    import benchmarks.scenarios  # registers the scenarios
+
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        sys.exit("Unknown scenarios: %s" % ", ".join(sorted(unknown)))
+
+    runner = DjangoTestSuiteRunner(verbosity=0, interactive=False)
+    runner.setup_test_environment()
+    old_config = runner.setup_databases()
+    results = []
+    try:
+        for name, func in SCENARIOS.items():
+            if names and name not in names:
+                continue
+            reset()
+            for result in func(options):
+                results.append(result)
+                sys.stderr.write(format_result(result) + "\n")
+    finally:
+        runner.teardown_databases(old_config)
+        runner.teardown_test_environment()
+
+    return {
+        "date": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "scale": options.scale,
+        "results": results,
+    }
+
+
+def format_result(result, baseline=None):
+    params = ", ".join("%s=%s" % item for item in
+                       sorted(result["params"].items()))
+    line = "%-14s %-34s %10.3f ms/%s" % (result["scenario"], params,
+                                         result["median"] * 1000,
+                                         result["unit"])
+    if baseline is not None:
+        line += "  (%+.1f%%)" % (
+            (result["median"] / baseline["median"] - 1) * 100)
+    return line
+
+
+def compare(run, baseline):
+    """Print the results of ``run`` along with their change since
+    ``baseline``."""
+    from benchmarks import get_key
+
+    previous = dict((get_key(r), r) for r in baseline["results"])
+    for result in run["results"]:
+        sys.stdout.write(
+            format_result(result, previous.get(get_key(result))) + "\n")
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] [scenario ...]")
+    parser.add_option(
+        '-o', '--output', dest='output',
+        help="write the results to this file, rather than to stdout")
+    parser.add_option(
+        '-n', '--number', type='int', default=100, dest='number',
+        help="calls per timing run (default: %default)")
+    parser.add_option(
+        '--scale', choices=['quick', 'full'], default='quick', dest='scale',
+        help="'full' adds the slow, large data cases, such as reports on "
+             "1M enrollments (default: %default)")
+    parser.add_option(
+        '--compare', dest='compare', metavar='FILE',
+        help="compare the results with those of an earlier run")
+
+    (options, args) = parser.parse_args()
+
+    # keep the warnings of every goal recorded out of the output
+    logging.basicConfig(level=logging.ERROR)
+
+    run = runbenchmarks(args, options)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(run, f, indent=2)
+    elif not options.compare:
+        json.dump(run, sys.stdout, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            compare(run, json.load(f))
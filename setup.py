@@ -13,7 +13,7 @@ setup(
     author='Shimon Rura',
     author_email='shimon@rura.org',
     url='http://github.com/shimon/Splango',
-    packages=find_packages(exclude=('tests', 'example')),
+    packages=find_packages(exclude=('tests', 'example', 'benchmarks')),
     package_data={'splango': ['templates/*.html', 'templates/*/*.html']},
     tests_require=[
         'django>=1.3,<1.5',
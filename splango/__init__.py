@@ -1,39 +1,156 @@
+import json
 import logging
 
-from .models import Subject, Experiment, Enrollment, GoalRecord, Variant
-from .utils import is_first_visit, replace_insensitive
+from django.conf import settings
+from django.core import signing
+from django.core.urlresolvers import reverse
+from django.utils.encoding import smart_str
+
+from . import background, budget, eventlog
+from . import metrics
+from .models import Subject, Experiment, GoalRecord, Variant
+from .registry import registry
+from .utils import insert_before_last, insert_into_chunks
 
 
 logger = logging.getLogger(__name__)
 
 SPLANGO_SUBJECT = "SPLANGO_SUBJECT"
 SPLANGO_QUEUED_UPDATES = "SPLANGO_QUEUED_UPDATES"
+SPLANGO_VERIFIED = "SPLANGO_VERIFIED"
+SPLANGO_VISITED = "SPLANGO_VISITED"
+SPLANGO_ENROLLMENTS = "SPLANGO_ENROLLMENTS"
+SPLANGO_GOALS = "SPLANGO_GOALS"
 
 # borrowed from debug_toolbar
 _HTML_TYPES = ('text/html', 'application/xhtml+xml')
 
+# how far from the end of HTML responses the closing body tag is looked for
+_INJECTION_WINDOW = 4096
+
+_CONFIRM_SALT = "splango.confirm"
+_CONFIRM_MAX_AGE = 24 * 60 * 60
+
+# Keeps the variants shown to a client until it is verified: in a signed
+# cookie rather than the session, which would be saved for every bot.
+_PENDING_COOKIE = "splango_pending"
+_PENDING_SALT = "splango.pending"
+
+# Keeps the tokens of the pages seen in the browser session until they are
+# all confirmed, with a single POST, to the beacon view.
+_BEACON_SNIPPET = """<script type="text/javascript">(function () {
+  var key = "splango.pending", pending = [], sent;
+  try { pending = JSON.parse(sessionStorage.getItem(key)) || []; } catch (e) {}
+  pending.push(%(token)s);
+  try { sessionStorage.setItem(key, JSON.stringify(pending)); } catch (e) {}
+  sent = pending.slice();
+  var xhr = new XMLHttpRequest();
+  xhr.open("POST", %(url)s, true);
+  xhr.setRequestHeader("Content-Type", "application/x-www-form-urlencoded");
+  xhr.onload = function () {
+    if (xhr.status >= 300) { return; }
+    try {
+      pending = JSON.parse(sessionStorage.getItem(key)) || [];
+      pending = pending.filter(function (t) { return sent.indexOf(t) < 0; });
+      sessionStorage.setItem(key, JSON.stringify(pending));
+    } catch (e) {}
+  };
+  xhr.send(sent.map(function (t) {
+    return "t=" + encodeURIComponent(t);
+  }).join("&"));
+})();</script>"""
+
+
+def _inject_before_body(response, snippet):
+    """Insert ``snippet`` before the closing body tag of ``response``.
+
+    Only the end of the page is searched for the tag. Streamed responses
+    are not buffered: their content is wrapped so that the snippet goes in
+    the final chunk.
+
+    """
+    if getattr(response, "streaming", False):
+        response.streaming_content = insert_into_chunks(
+            response.streaming_content, b"</body>", snippet,
+            _INJECTION_WINDOW)
+    elif getattr(response, "_base_content_is_iter", False):
+        # an iterator given to HttpResponse: setting an iterator as content
+        # keeps the response lazy
+        chunks = (smart_str(chunk, response._charset)
+                  for chunk in response._container)
+        response.content = insert_into_chunks(chunks, "</body>", snippet,
+                                              _INJECTION_WINDOW)
+    else:
+        response.content = insert_before_last(
+            response.content, "</body>", snippet, _INJECTION_WINDOW)
+        if response.has_header("Content-Length"):
+            response["Content-Length"] = str(len(response.content))
+            return
+
+    if response.has_header("Content-Length"):
+        del response["Content-Length"]
+
+
+class NullExperimentManager(object):
+
+    """Experiment manager for the requests that are not tracked: those of
+    bots, and those of paths excluded from splango.
+
+    Every experiment shows its first (control) variant and nothing is ever
+    queued, so these requests cost no subject nor any query.
+
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    def declare_and_enroll(self, exp_name, variants, selected_variant=None):
+        return Variant(experiment_id=exp_name, name=variants[0])
+
+    def log_goal(self, goal_name, extra=None):
+        pass
+
+    def confirm_human(self, tokens):
+        pass
+
+    def finish(self, response):
+        return response
+
 
 class RequestExperimentManager:
 
     def __init__(self, request):
         #logger.debug("REM init")
         self.request = request
-        self.user_at_init = request.user
         self.queued_actions = []
+        self.pending_variants = None
+        self.pending_changed = False
+        self.query_budget = budget.QueryBudget(budget.get_budget())
 
     def enqueue(self, action, params):
         self.queued_actions.append((action, params))
 
-    def process_from_queue(self, action, params):
+    def process_from_queue(self, action, params, subject=None):
         logger.info("dequeued: %s (%s)" % (str(action), repr(params)))
+        if subject is None:
+            subject = self.get_subject()
 
-        if action == "enroll":
+        if action == "enroll" and eventlog.is_enabled():
+            eventlog.get_writer().append_enrollment(
+                subject.pk, params["exp_name"],
+                params["variant"].pk)
+
+        elif action == "enroll":
             exp = Experiment.objects.get(name=params["exp_name"])
             variant = params["variant"]
-            exp.get_or_create_enrollment(self.get_subject(), variant)
+            exp.get_or_create_enrollment(subject, variant)
+
+        elif action == "log_goal" and eventlog.is_enabled():
+            eventlog.get_writer().append_goal(subject.pk,
+                                              params["goal_name"])
 
         elif action == "log_goal":
-            goal_record = GoalRecord.record(self.get_subject(),
+            goal_record = GoalRecord.record(subject,
                                             params["goal_name"],
                                             params["request_info"],
                                             extra=params.get("extra"))
@@ -44,48 +161,250 @@ class RequestExperimentManager:
 
     def finish(self, response):
         """Decide what to do if subject is human or not."""
+        if metrics.is_enabled():
+            metrics.collector.observe("splango_queued_actions",
+                                      len(self.queued_actions),
+                                      buckets=(0, 1, 2, 5, 10, 20, 50))
+        with metrics.timed("splango_finish"), \
+                self.query_budget.track("finish"):
+            response = self._finish(response)
+        self.query_budget.check("%s %s" % (self.request.method,
+                                           self.request.path))
+        return response
 
+    def _finish(self, response):
         current_user = self.request.user
 
-        if self.user_at_init != current_user:
-            logger.info("user status changed over request: %s --> %s"
-                        % (str(self.user_at_init), str(current_user)))
+        if current_user.is_authenticated():
+            subject = self.request.session.get(SPLANGO_SUBJECT)
+            if subject is None or subject.registered_as_id != current_user.id:
+                # The user has logged in (or registered), during this request
+                # or one that did not use splango.
+                logger.info("subject %s is not registered as user %s" %
+                            (str(subject), str(current_user)))
+                self.register_subject(current_user, subject)
 
-            if not(current_user.is_authenticated()):
-                # User logged out. It's a new session, nothing special.
-                pass
-            else:
-                # User has just logged in (or registered).
-                # We'll merge the session's current Subject with
-                # an existing Subject for this user, if exists,
-                # or simply set the subject.registered_as field.
-
-                old_subject = self.request.session.get(SPLANGO_SUBJECT)
-
-                try:
-                    existing_subject = Subject.objects.get(
-                        registered_as=current_user)
-                    # there is an existing registered subject!
-                    if old_subject and old_subject.id != existing_subject.id:
-                        # merge old subject's activity into new
-                        old_subject.merge_into(existing_subject)
-
-                    # whether we had an old_subject or not, we must
-                    # set session to use our existing_subject
-                    self.request.session[SPLANGO_SUBJECT] = existing_subject
-
-                except Subject.DoesNotExist:
-                    # promote current subject to registered!
-                    subject = self.get_subject()
-                    subject.registered_as = current_user
-                    subject.save()
-
-        for (action, params) in self.queued_actions:
-            self.process_from_queue(action, params)
-        self.queued_actions = []
+        if not self.is_verified():
+            # nothing is written until the client runs the beacon
+            self.hold_pending(response)
+            self.queued_actions = []
+            if self.pending_changed:
+                response.set_signed_cookie(
+                    _PENDING_COOKIE, json.dumps(self.pending_variants),
+                    salt=_PENDING_SALT, max_age=_CONFIRM_MAX_AGE,
+                    httponly=True)
+            return response
 
+        self.flush()
+        if _PENDING_COOKIE in self.request.COOKIES:
+            response.delete_cookie(_PENDING_COOKIE)
         return response
 
+    def flush(self):
+        """Write the queued actions, and empty the queue.
+
+        With ``settings.SPLANGO_BACKGROUND_WRITES``, the actions are handed
+        to the :mod:`splango.background` writer instead.
+
+        :return: the background job, or None if the actions were written
+        :rtype: :class:`splango.background.PendingWrite`
+
+        """
+        actions, self.queued_actions = self.queued_actions, []
+        if not actions:
+            return None
+        # the session is only safe to use in the request's thread
+        subject = self.get_subject()
+        actions = self.drop_recorded_goals(subject, actions)
+        if not actions:
+            return None
+        if background.is_enabled():
+            # the goals are not remembered: the write may still fail, and
+            # GoalRecord.record ignores the ones already recorded
+            return background.get_writer().submit(self.process_queue_later,
+                                                  subject, actions)
+        self.process_queue(subject, actions)
+        self.remember_recorded_goals(subject, actions)
+        return None
+
+    def _get_recorded_goals(self, subject):
+        recorded = self.request.session.get(SPLANGO_GOALS)
+        if recorded is None or recorded[0] != subject.pk:
+            return set()
+        return recorded[1]
+
+    def drop_recorded_goals(self, subject, actions):
+        """Drop from ``actions`` the goals ``subject`` already reached on
+        earlier requests, as remembered by :meth:`remember_recorded_goals`,
+        and the goals logged more than once.
+
+        Goals logged with ``extra`` are kept, as :meth:`GoalRecord.record`
+        may add it to the existing record. (Enrollments need no such
+        filter: :meth:`declare_and_enroll` queues none for the experiments
+        kept by :meth:`remember_enrollment`.)
+
+        """
+        goal_names = set(self._get_recorded_goals(subject))
+        kept = []
+        for (action, params) in actions:
+            if action == "log_goal":
+                if params["goal_name"] in goal_names:
+                    if not params.get("extra"):
+                        continue
+                else:
+                    goal_names.add(params["goal_name"])
+            kept.append((action, params))
+        return kept
+
+    def remember_recorded_goals(self, subject, actions):
+        """Remember in the session the goals of ``actions``, once they are
+        written, so that :meth:`drop_recorded_goals` skips them on the next
+        requests.
+
+        """
+        recorded = self._get_recorded_goals(subject)
+        goal_names = set(params["goal_name"] for (action, params) in actions
+                         if action == "log_goal")
+        if not goal_names <= recorded:
+            self.request.session[SPLANGO_GOALS] = (subject.pk,
+                                                   recorded | goal_names)
+
+    def process_queue(self, subject, actions):
+        for (action, params) in actions:
+            if action == "enroll":
+                label = "experiment:%s" % params["exp_name"]
+            else:
+                label = "goal:%s" % params["goal_name"]
+            with metrics.timed("splango_process_action", action=action), \
+                    self.query_budget.track(label):
+                self.process_from_queue(action, params, subject)
+        if eventlog.is_enabled():
+            eventlog.get_writer().flush()
+
+    def process_queue_later(self, subject, actions):
+        """Like :meth:`process_queue`, in the background writer: the
+        subject may have been merged into another meanwhile, by a login
+        served by any process."""
+        self.process_queue(Subject.resolve(subject), actions)
+
+    def register_subject(self, user, old_subject):
+        """Associate the session to the Subject of ``user``.
+
+        We'll merge the session's current Subject with an existing Subject
+        for this user, if exists, or simply set the subject.registered_as
+        field.
+
+        """
+        if old_subject is not None and old_subject.registered_as_id:
+            # another user's subject (no logout in between): leave it alone
+            old_subject = None
+            del self.request.session[SPLANGO_SUBJECT]
+
+        existing_id = Subject.get_id_for_user(user.pk)
+        if existing_id is not None:
+            # there is an existing registered subject!
+            existing_subject = Subject(id=existing_id,
+                                       registered_as_id=user.pk)
+            if old_subject and old_subject.id != existing_subject.id:
+                if background.is_enabled():
+                    # the writes queued by earlier requests use old_subject:
+                    # those of other processes resolve it when they run
+                    background.get_writer().wait_pending()
+                # merge old subject's activity into new
+                old_subject_id = old_subject.id
+                old_subject.merge_into(existing_subject)
+                if eventlog.is_enabled():
+                    # the logged events of the old subject cannot be moved
+                    writer = eventlog.get_writer()
+                    writer.append_merge(old_subject_id, existing_subject.id)
+                    writer.flush()
+
+            # whether we had an old_subject or not, we must
+            # set session to use our existing_subject
+            self.request.session[SPLANGO_SUBJECT] = existing_subject
+
+        else:
+            # promote current subject to registered!
+            subject = self.get_subject()
+            subject.registered_as = user
+            subject.save()
+            self.request.session[SPLANGO_SUBJECT] = subject
+
+    def is_verified(self):
+        """Tell whether the client is known to be a human.
+
+        Unless ``settings.SPLANGO_VERIFY_HUMANS`` is set, every client is.
+        Otherwise, clients are verified once they run the beacon injected by
+        :meth:`hold_pending`, or when they are logged in.
+
+        """
+        if not getattr(settings, "SPLANGO_VERIFY_HUMANS", False):
+            return True
+        if self.request.user.is_authenticated():
+            return True
+        return bool(self.request.session.get(SPLANGO_VERIFIED))
+
+    def hold_pending(self, response):
+        """Inject in ``response`` the beacon that will confirm the queued
+        actions, signed so that they cannot be tampered with.
+
+        Only HTML responses can run the beacon: the actions queued during
+        other responses are dropped.
+
+        """
+        if not self.queued_actions:
+            return
+        content_type = response.get("Content-Type", "").split(";")[0]
+        if content_type not in _HTML_TYPES:
+            return
+
+        actions = [self._dump_action(action, params)
+                   for action, params in self.queued_actions]
+        token = signing.dumps(actions, salt=_CONFIRM_SALT, compress=True)
+        snippet = _BEACON_SNIPPET % {
+            "token": json.dumps(token),
+            "url": json.dumps(reverse("splango_confirm")),
+        }
+        _inject_before_body(response, snippet)
+
+    def confirm_human(self, tokens):
+        """Mark the client as verified and queue the actions held in
+        ``tokens`` by :meth:`hold_pending`, to be processed by
+        :meth:`finish`.
+
+        """
+        self.request.session[SPLANGO_VERIFIED] = True
+        for token in tokens:
+            try:
+                actions = signing.loads(token, salt=_CONFIRM_SALT,
+                                        max_age=_CONFIRM_MAX_AGE)
+            except signing.BadSignature:
+                logger.warning("invalid or expired confirmation token")
+                continue
+            for action in actions:
+                loaded = self._load_action(action)
+                if loaded is not None:
+                    self.enqueue(*loaded)
+
+    @staticmethod
+    def _dump_action(action, params):
+        if action == "enroll":
+            return [action, params["exp_name"], params["variant"].pk]
+        return [action, params["goal_name"], params["request_info"],
+                params.get("extra")]
+
+    @staticmethod
+    def _load_action(action):
+        if action[0] == "enroll":
+            try:
+                variant = Variant.objects.get(pk=action[2])
+            except Variant.DoesNotExist:
+                return None
+            return "enroll", {"exp_name": action[1], "variant": variant}
+        return "log_goal", {"goal_name": action[1],
+                            "request_info": action[2],
+                            "extra": action[3]}
+
     def get_subject(self):
         sezzion = self.request.session
         subject = sezzion.get(SPLANGO_SUBJECT)
@@ -103,20 +422,148 @@ class RequestExperimentManager:
 
         the variant is chosen randomly from variants,
         or if selected_variant is supplied, from selected_variant.
+
+        experiments that are not running are not declared again nor enrolled
+        in: their fixed variant comes from the registry, without DB access.
         '''
+        with metrics.timed("splango_declare_and_enroll",
+                           experiment=exp_name), \
+                self.query_budget.track("experiment:%s" % exp_name):
+            return self._declare_and_enroll(exp_name, variants,
+                                            selected_variant)
+
+    def _declare_and_enroll(self, exp_name, variants, selected_variant):
+        variant = registry.get_fixed_variant(exp_name)
+        if variant is not None:
+            return variant
+
+        variant = self.get_enrolled_variant(exp_name)
+        if variant is not None:
+            return variant
+
         exp = Experiment.declare(exp_name, variants)
+        if not exp.is_running():
+            variant = exp.get_fixed_variant()
+            if variant is not None:
+                return variant
 
-        subject = self.get_subject()
         selected_variant_obj = None
         if selected_variant:
             selected_variant_obj, created = Variant.objects.get_or_create(
                     name=selected_variant,
                     experiment=exp)
-        subject_variant = exp.get_or_create_enrollment(subject, variant=selected_variant_obj)
-        variant = subject_variant.variant
+
+        if not self.is_verified():
+            # no subject yet: the enrollment waits for the beacon, and the
+            # variant is kept until then
+            variant = (selected_variant_obj or
+                       self.get_pending_variant(exp.name) or
+                       exp.get_random_variant())
+            self.remember_pending_variant(variant)
+            self.enqueue("enroll", {"exp_name": exp.name, "variant": variant})
+            return variant
+
+        if selected_variant_obj is None:
+            # the variant shown before the client was verified
+            selected_variant_obj = self.get_pending_variant(exp.name)
+        subject = self.get_subject()
+        if eventlog.is_enabled() or background.is_enabled():
+            variant = self._enroll_deferred(exp, subject, selected_variant_obj)
+        else:
+            subject_variant = exp.get_or_create_enrollment(
+                subject, variant=selected_variant_obj)
+            variant = subject_variant.variant
         logger.info("got variant %s for subject %s" %
                     (str(variant), str(subject)))
+        self.remember_enrollment(variant)
+
+        return variant
+
+    def get_enrolled_variant(self, exp_name):
+        """Return the variant the subject was enrolled in for ``exp_name``
+        on an earlier request, from the session, or None.
+
+        Only the variant's id and name are loaded: no query is made. The
+        enrollments are kept along with the id of their subject, so that
+        they are ignored once the session's subject changes.
+
+        """
+        subject = self.request.session.get(SPLANGO_SUBJECT)
+        enrollments = self.request.session.get(SPLANGO_ENROLLMENTS)
+        if subject is None or enrollments is None:
+            return None
+        subject_id, variants = enrollments
+        if subject_id != subject.pk or exp_name not in variants:
+            return None
+        variant_id, name = variants[exp_name]
+        return Variant(id=variant_id, experiment_id=exp_name, name=name)
+
+    def remember_enrollment(self, variant):
+        """Keep the subject's ``variant`` in the session, for
+        :meth:`get_enrolled_variant`."""
+        subject_id = self.get_subject().pk
+        enrollments = self.request.session.get(SPLANGO_ENROLLMENTS)
+        if enrollments is None or enrollments[0] != subject_id:
+            enrollments = (subject_id, {})
+        enrollments[1][variant.experiment_id] = (variant.pk, variant.name)
+        self.request.session[SPLANGO_ENROLLMENTS] = enrollments
+
+    def _get_pending_variants(self):
+        if self.pending_variants is None:
+            self.pending_variants = {}
+            if _PENDING_COOKIE not in self.request.COOKIES:
+                return self.pending_variants
+            try:
+                self.pending_variants = json.loads(
+                    self.request.get_signed_cookie(
+                        _PENDING_COOKIE, salt=_PENDING_SALT,
+                        max_age=_CONFIRM_MAX_AGE))
+            except (signing.BadSignature, ValueError):
+                logger.warning("invalid or expired pending variants cookie")
+        return self.pending_variants
+
+    def get_pending_variant(self, exp_name):
+        """Return the variant shown for ``exp_name`` to the client before it
+        was verified (see :meth:`is_verified`), from a signed cookie, or
+        None.
+
+        """
+        variants = self._get_pending_variants()
+        if exp_name not in variants:
+            return None
+        variant_id, name = variants[exp_name]
+        return Variant(id=variant_id, experiment_id=exp_name, name=name)
+
+    def remember_pending_variant(self, variant):
+        """Keep ``variant`` for :meth:`get_pending_variant`, in the cookie
+        set by :meth:`finish`.
+
+        Unlike the session, the cookie costs no write: clients that never
+        run the beacon, bots among them, write nothing.
+
+        """
+        variants = self._get_pending_variants()
+        if variants.get(variant.experiment_id) != [variant.pk, variant.name]:
+            variants[variant.experiment_id] = [variant.pk, variant.name]
+            self.pending_changed = True
+
+    def _enroll_deferred(self, exp, subject, variant=None):
+        """Return the variant of ``subject`` and queue its enrollment, to be
+        appended to the event log or written in the background.
+
+        Subjects already enrolled keep their variant; the others get a
+        stable one (see :meth:`Experiment.get_stable_variant`) so that they
+        see the same variant on their next requests, even before the
+        enrollment is written.
+
+        """
+        assigned = exp.get_assigned_variant(subject)
+        if assigned is not None:
+            return assigned
 
+        if variant is None:
+            variant = exp.get_stable_variant(subject)
+        self.enqueue("enroll", {"exp_name": exp.name, "variant": variant})
         return variant
 
     def log_goal(self, goal_name, extra=None):
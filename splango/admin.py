@@ -1,15 +1,118 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
 
 from .models import (Subject, Goal, GoalRecord, Enrollment, Experiment,
-                     ExperimentReport, Variant)
+                     ExperimentReport, Variant, ConversionRollup,
+                     ExperimentArchive)
+from .utils import estimate_count
 
 
-class SubjectAdmin(admin.ModelAdmin):
+CURSOR_VAR = "before"
+
+
+class CursorChangeList(ChangeList):
+
+    """A change list paged by primary key instead of offset, for tables with
+    too many rows to count or to skip through.
+
+    Rows are listed newest first, and each page holds the rows with a
+    primary key below the last one of the previous page (the ``before``
+    parameter), which is an index range scan whatever the page. The total
+    is estimated from the database statistics once above
+    ``SPLANGO_ADMIN_EXACT_COUNT_LIMIT`` rows, and filtered lists are only
+    counted when the table is small. Sorting by column is not supported.
+
+    Rows are read from the ``SPLANGO_ADMIN_DATABASE`` database (e.g. a
+    replica) if set.
+
+    """
+
+    def get_query_set(self, request):
+        self.cursor = self.params.pop(CURSOR_VAR, None)
+        self.params.pop(ORDER_VAR, None)
+        using = getattr(settings, "SPLANGO_ADMIN_DATABASE", None)
+        if using:
+            self.root_query_set = self.root_query_set.using(using)
+        return super(CursorChangeList, self).get_query_set(request)
+
+    def get_ordering(self, request, queryset):
+        return ["-pk"]
+
+    def get_ordering_field_columns(self):
+        return {}
+
+    def get_results(self, request):
+        qs = self.query_set
+        if self.cursor is not None:
+            try:
+                qs = qs.filter(pk__lt=int(self.cursor))
+            except ValueError:
+                raise IncorrectLookupParameters
+        rows = list(qs[:self.list_per_page + 1])
+        self.has_next = len(rows) > self.list_per_page
+        self.result_list = rows[:self.list_per_page]
+        self.next_cursor = (self.result_list[-1].pk if self.has_next
+                            else None)
+
+        limit = getattr(settings, "SPLANGO_ADMIN_EXACT_COUNT_LIMIT", 10000)
+        estimate = estimate_count(self.model, self.root_query_set.db)
+        self.count_is_estimate = estimate is not None and estimate > limit
+        if self.count_is_estimate:
+            self.full_result_count = estimate
+        else:
+            self.full_result_count = self.root_query_set.count()
+        if not self.query_set.query.where:
+            self.result_count = self.full_result_count
+        elif not self.count_is_estimate:
+            self.result_count = self.query_set.count()
+        else:
+            self.result_count = None
+
+        self.can_show_all = False
+        self.multi_page = self.has_next or self.cursor is not None
+        self.paginator = None
+
+    def get_next_page_url(self):
+        if self.next_cursor is None:
+            return None
+        return self.get_query_string({CURSOR_VAR: self.next_cursor})
+
+    def get_first_page_url(self):
+        if self.cursor is None:
+            return None
+        return self.get_query_string()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+
+    """Admin of a table of tens of millions of rows, listed with a
+    :class:`CursorChangeList`.
+
+    Subclasses should select the related rows they display in
+    :meth:`queryset`, as the change list would otherwise follow every
+    foreign key. There is no date hierarchy (which scans the table for the
+    distinct dates) nor actions (which count the selection).
+
+    """
+
+    actions = None
+    change_list_template = "splango/cursor_change_list.html"
+
+    def get_changelist(self, request, **kwargs):
+        return CursorChangeList
+
+
+class SubjectAdmin(LargeTableAdmin):
 
     list_display = (
         '__unicode__', 'registered_as', 'is_registered_user', 'created')
     list_filter = ('created',)
-    date_hierarchy = 'created'
+
+    def queryset(self, request):
+        return (super(SubjectAdmin, self).queryset(request)
+                .select_related("registered_as"))
 
 
 admin.site.register(Subject, SubjectAdmin)
@@ -24,27 +127,41 @@ class GoalAdmin(admin.ModelAdmin):
 admin.site.register(Goal, GoalAdmin)
 
 
-class GoalRecordAdmin(admin.ModelAdmin):
-    list_display = ("goal", "subject", "created", "req_HTTP_REFERER")
+class GoalRecordAdmin(LargeTableAdmin):
+    list_display = ("goal_name", "subject", "created", "req_HTTP_REFERER")
     list_filter = ('goal', 'created')
-    date_hierarchy = 'created'
+
+    def queryset(self, request):
+        return (super(GoalRecordAdmin, self).queryset(request)
+                .select_related("subject"))
+
+    def goal_name(self, obj):
+        return obj.goal_id
+    goal_name.short_description = "goal"
 
 
 admin.site.register(GoalRecord, GoalRecordAdmin)
 
 
-class EnrollmentAdmin(admin.ModelAdmin):
-    list_display = ("subject", "experiment", "variant", "created")
+class EnrollmentAdmin(LargeTableAdmin):
+    list_display = ("subject", "experiment_name", "variant", "created")
     list_filter = ('variant', 'created')
-    date_hierarchy = 'created'
+
+    def queryset(self, request):
+        return (super(EnrollmentAdmin, self).queryset(request)
+                .select_related("subject", "variant"))
+
+    def experiment_name(self, obj):
+        return obj.experiment_id
+    experiment_name.short_description = "experiment"
 
 
 admin.site.register(Enrollment, EnrollmentAdmin)
 
 
 class ExperimentAdmin(admin.ModelAdmin):
-    list_display = ("name", "variants_commasep", "created")
-    list_filter = ('created',)
+    list_display = ("name", "variants_commasep", "state", "winner", "created")
+    list_filter = ('state', 'created')
     date_hierarchy = 'created'
 
 
@@ -67,3 +184,21 @@ class VariantAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Variant, VariantAdmin)
+
+
+class ConversionRollupAdmin(admin.ModelAdmin):
+    list_display = ("experiment", "variant", "goal", "period", "start",
+                    "count")
+    list_filter = ('experiment', 'period')
+
+
+admin.site.register(ConversionRollup, ConversionRollupAdmin)
+
+
+class ExperimentArchiveAdmin(admin.ModelAdmin):
+    list_display = ("experiment", "created", "enrollments", "goal_records",
+                    "location")
+    readonly_fields = ("summary",)
+
+
+admin.site.register(ExperimentArchive, ExperimentArchiveAdmin)
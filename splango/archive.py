@@ -0,0 +1,99 @@
+"""Archival of the raw rows of concluded experiments.
+
+:func:`archive_experiment` freezes the numbers of an experiment in an
+:class:`ExperimentArchive`, then moves its enrollments, in batches, to
+gzipped CSV files. Goal records are not tied to an experiment, and the
+goals may still be logged and used by other experiments, so they stay in
+place unless ``move_goal_records`` is given: the goal records of subjects
+left without any enrollment are then moved along. Each batch is written to
+the files before it is deleted in its own transaction, so an interrupted
+archival can simply be run again.
+
+"""
+import csv
+import gzip
+import json
+import os
+
+from django.db import transaction
+
+from .models import Enrollment, ExperimentArchive, GoalRecord
+from .utils import chunked
+
+
+ENROLLMENT_FIELDS = ("id", "subject_id", "experiment_id", "variant_id",
+                     "created")
+GOAL_RECORD_FIELDS = ("id", "subject_id", "goal_id", "created",
+                      "req_HTTP_REFERER", "req_REMOTE_ADDR", "req_path",
+                      "extra")
+
+
+def get_archive_paths(directory, experiment):
+    """Return the paths of the enrollments and goal records files."""
+    prefix = os.path.join(directory, experiment.name.replace(os.sep, "_"))
+    return (prefix + "-enrollments.csv.gz", prefix + "-goalrecords.csv.gz")
+
+
+def _write_rows(path, rows):
+    # gzip members can be concatenated, so batches are simply appended
+    with gzip.open(path, "ab") as f:
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow([unicode(value).encode("utf-8") for value in row])
+
+
+def _move_batch(enrollment_ids, enrollments_path, goal_records_path,
+                move_goal_records):
+    with transaction.commit_on_success():
+        enrollments = list(Enrollment.objects.filter(pk__in=enrollment_ids)
+                           .values_list(*ENROLLMENT_FIELDS))
+        _write_rows(enrollments_path, enrollments)
+        Enrollment.objects.filter(pk__in=enrollment_ids).delete()
+        if not move_goal_records:
+            return len(enrollments), 0
+
+        subject_ids = set(row[1] for row in enrollments)
+        subject_ids -= set(Enrollment.objects.filter(subject__in=subject_ids)
+                           .values_list("subject_id", flat=True))
+        goal_records = GoalRecord.objects.filter(subject__in=subject_ids)
+        rows = list(goal_records.values_list(*GOAL_RECORD_FIELDS))
+        _write_rows(goal_records_path, rows)
+        goal_records.delete()
+
+    return len(enrollments), len(rows)
+
+
+def archive_experiment(experiment, directory, batch_size=1000,
+                       move_goal_records=False):
+    """Archive ``experiment``, moving its raw rows to ``directory``.
+
+    :param move_goal_records: also move the goal records of the subjects
+      left without any enrollment
+
+    :return: the experiment's archive
+    :rtype: :class:`ExperimentArchive`
+
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    enrollments_path, goal_records_path = get_archive_paths(directory,
+                                                            experiment)
+
+    archive, created = ExperimentArchive.objects.get_or_create(
+        experiment=experiment,
+        defaults={
+            "location": directory,
+            "summary": json.dumps(ExperimentArchive.summarize(experiment)),
+        })
+
+    enrollment_ids = (Enrollment.objects.filter(experiment=experiment)
+                      .order_by("pk").values_list("pk", flat=True))
+    for ids in chunked(list(enrollment_ids), batch_size):
+        enrollments, goal_records = _move_batch(ids, enrollments_path,
+                                                goal_records_path,
+                                                move_goal_records)
+        archive.enrollments += enrollments
+        archive.goal_records += goal_records
+        archive.save()
+
+    return archive
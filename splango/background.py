@@ -0,0 +1,164 @@
+"""Background persistence of the actions queued during requests.
+
+When ``settings.SPLANGO_BACKGROUND_WRITES`` is set, the enrollments and goal
+records queued by :class:`splango.RequestExperimentManager` are not written
+while the response waits: they are handed to a per-process worker thread,
+which writes them (to the database or to the event log) once the response
+has been returned.
+
+The queue is bounded by ``settings.SPLANGO_BACKGROUND_QUEUE_SIZE`` (1000 jobs
+by default); when it is full, jobs are run in the request's thread rather
+than dropped. Jobs queued when the process exits are lost, so long running
+scripts should call :meth:`BackgroundWriter.join` before exiting.
+
+The jobs hold the subject of the request. A subject merged into the one of
+a user logging in is deleted, so the login waits for the jobs of the
+process to run first. That only holds within one process: the jobs queued
+by other processes look the subject up when they run, and write to the
+subject it was merged into (see :meth:`splango.models.Subject.resolve`).
+
+"""
+import logging
+import os
+import Queue
+import threading
+
+from django.conf import settings
+from django.db import close_connection
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 1000
+
+
+def is_enabled():
+    return getattr(settings, "SPLANGO_BACKGROUND_WRITES", False)
+
+
+class PendingWrite(object):
+
+    """Handle on a job submitted to a :class:`BackgroundWriter`."""
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.exception = None
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            self.func(*self.args)
+        except Exception as e:
+            self.exception = e
+            logger.exception("background write failed")
+        finally:
+            self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the job has run, or ``timeout`` seconds.
+
+        :return: whether the job has run
+        :rtype: bool
+
+        """
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+
+class BackgroundWriter(object):
+
+    """Runs jobs, in order, in a daemon thread.
+
+    The thread is started on the first job, and started again in the
+    children of forking servers, which do not inherit it.
+
+    """
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        self._queue = Queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                if self._pid is not None:
+                    # forked: the parent's jobs are not ours to run
+                    self._queue = Queue.Queue(self._queue.maxsize)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run,
+                                                name="splango-writer")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                job.run()
+            finally:
+                self._queue.task_done()
+                if self._queue.empty():
+                    # like a request would: do not hold an idle connection
+                    close_connection()
+
+    def submit(self, func, *args):
+        """Schedule ``func(*args)``.
+
+        :rtype: :class:`PendingWrite`
+
+        """
+        job = PendingWrite(func, args)
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(job)
+        except Queue.Full:
+            logger.warning("background queue full: writing synchronously")
+            job.run()
+        return job
+
+    def wait_pending(self, timeout=None):
+        """Block until the jobs submitted so far to this process's writer
+        have run, or ``timeout`` seconds. Unlike :meth:`join`, the jobs
+        submitted meanwhile by other threads are not waited for.
+
+        :return: whether the jobs have run
+        :rtype: bool
+
+        """
+        if self._thread is None or self._pid != os.getpid():
+            return True
+        marker = PendingWrite(lambda: None, ())
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except Queue.Full:
+            return False
+        return marker.wait(timeout)
+
+    def join(self):
+        """Block until every submitted job has run."""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.join()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Return the process-wide :class:`BackgroundWriter`."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = BackgroundWriter(
+                    getattr(settings, "SPLANGO_BACKGROUND_QUEUE_SIZE",
+                            DEFAULT_QUEUE_SIZE))
+    return _writer
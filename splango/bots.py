@@ -0,0 +1,77 @@
+"""User agent based detection of crawlers and other bots.
+
+The patterns of ``settings.SPLANGO_BOT_PATTERNS`` (case insensitive
+substrings, :data:`DEFAULT_BOT_PATTERNS` by default) are compiled once into a
+single regular expression, and the verdicts for the most recently seen user
+agents are kept in a small LRU cache, so that most requests are classified
+with a dictionary lookup.
+
+"""
+import collections
+import re
+import threading
+
+from django.conf import settings
+
+
+DEFAULT_BOT_PATTERNS = (
+    "bot", "crawl", "spider", "slurp", "archiver", "feedfetcher",
+    "facebookexternalhit", "mediapartners-google", "bingpreview",
+    "headless", "phantomjs", "pingdom", "uptime", "monitor",
+    "curl/", "wget/", "libwww", "python-requests", "python-urllib",
+    "httpclient", "java/", "go-http-client",
+)
+
+
+class BotClassifier(object):
+
+    def __init__(self, patterns=DEFAULT_BOT_PATTERNS, cache_size=1024):
+        self.regex = re.compile("|".join(re.escape(p) for p in patterns),
+                                re.IGNORECASE)
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_bot(self, user_agent):
+        """Tell whether ``user_agent`` is a bot's.
+
+        An empty user agent is not taken for a bot's: it is left to the
+        human verification to filter out.
+
+        """
+        if not user_agent:
+            return False
+
+        with self._lock:
+            verdict = self._cache.pop(user_agent, None)
+            if verdict is None:
+                verdict = self.regex.search(user_agent) is not None
+                if len(self._cache) >= self.cache_size:
+                    self._cache.popitem(last=False)
+            self._cache[user_agent] = verdict
+        return verdict
+
+
+_classifier = None
+
+
+def get_classifier():
+    """Return the process-wide :class:`BotClassifier`, or None if bot
+    detection is disabled by ``settings.SPLANGO_DETECT_BOTS``.
+
+    """
+    global _classifier
+    if not getattr(settings, "SPLANGO_DETECT_BOTS", True):
+        return None
+    if _classifier is None:
+        _classifier = BotClassifier(
+            getattr(settings, "SPLANGO_BOT_PATTERNS", DEFAULT_BOT_PATTERNS),
+            getattr(settings, "SPLANGO_BOT_CACHE_SIZE", 1024))
+    return _classifier
+
+
+def is_bot(request):
+    classifier = get_classifier()
+    if classifier is None:
+        return False
+    return classifier.is_bot(request.META.get("HTTP_USER_AGENT", ""))
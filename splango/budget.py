@@ -0,0 +1,109 @@
+"""Per-request budget of the queries splango issues.
+
+When ``settings.SPLANGO_QUERY_BUDGET`` is set, the queries issued by each
+request's :class:`splango.RequestExperimentManager` are counted and
+attributed to the experiment being declared and enrolled in, to the goal
+being recorded, or to the rest of the work done when the response is
+finished. Requests that issue more than the budget log a warning listing
+the counts, or raise :class:`QueryBudgetExceeded` if
+``settings.SPLANGO_QUERY_BUDGET_RAISE`` is set: an ``{% experiment %}`` tag
+used in a loop shows up before it reaches production.
+
+This is meant for development and staging: the queries of splango's code
+paths are recorded as with ``settings.DEBUG``. Only the request's thread is
+counted, not the writes of :mod:`splango.background`.
+
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def get_budget():
+    return getattr(settings, "SPLANGO_QUERY_BUDGET", None)
+
+
+class QueryBudget(object):
+
+    """Counts the queries of the blocks run under :meth:`track`.
+
+    Nested blocks are not counted twice: each query goes to the innermost
+    block that issued it. Does nothing if ``limit`` is None.
+
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.counts = {}
+        self._stack = []
+        self._thread = threading.current_thread()
+        self._use_debug_cursor = None
+
+    def track(self, label):
+        """Return a context manager attributing the queries of its block to
+        ``label``."""
+        return _Tracked(self, label)
+
+    def _enter(self, label):
+        if not self._stack:
+            self._use_debug_cursor = connection.use_debug_cursor
+            connection.use_debug_cursor = True
+        self._stack.append([label, len(connection.queries), 0])
+
+    def _exit(self):
+        label, start, nested = self._stack.pop()
+        count = len(connection.queries) - start
+        if count - nested:
+            self.counts[label] = self.counts.get(label, 0) + count - nested
+        if self._stack:
+            self._stack[-1][2] += count
+        else:
+            connection.use_debug_cursor = self._use_debug_cursor
+
+    def get_total(self):
+        return sum(self.counts.values())
+
+    def check(self, description="request"):
+        """Warn, or raise :class:`QueryBudgetExceeded`, if more queries than
+        the budget were counted."""
+        if self.limit is None:
+            return
+        total = self.get_total()
+        if total <= self.limit:
+            return
+        counts = ", ".join(
+            "%s=%d" % (label, count) for label, count in
+            sorted(self.counts.items(), key=lambda i: -i[1]))
+        msg = ("splango issued %d queries during %s, over its budget of %d: "
+               "%s" % (total, description, self.limit, counts))
+        if getattr(settings, "SPLANGO_QUERY_BUDGET_RAISE", False):
+            raise QueryBudgetExceeded(msg)
+        logger.warning(msg)
+
+
+class _Tracked(object):
+
+    def __init__(self, budget, label):
+        self.budget = budget
+        self.label = label
+        self.enabled = False
+
+    def __enter__(self):
+        self.enabled = (self.budget.limit is not None and
+                        threading.current_thread() is self.budget._thread)
+        if self.enabled:
+            self.budget._enter(self.label)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.enabled:
+            self.budget._exit()
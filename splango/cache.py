@@ -0,0 +1,106 @@
+"""Versioned caching of experiment definitions and subject assignments.
+
+Each cached value is stored along with a version number, kept under a key of
+its own. Reading a value fetches both keys in a single round trip, and the
+value is only used if its version is the current one. Changing the data
+behind a value increments its version: stale values are never served, even
+if a concurrent request stores one after the change.
+
+Only real changes bump versions: enrolling a subject invalidates that
+subject's assignments, not every cached query that involves enrollments.
+
+Values are kept ``settings.SPLANGO_CACHE_TIMEOUT`` seconds (the cache
+backend's default timeout if unset).
+
+"""
+import hashlib
+import random
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class VersionedCache(object):
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _get_keys(self, name):
+        # names may hold spaces, non-ASCII characters or be too long for
+        # memcached: hash them
+        digest = hashlib.md5((u"%s" % name).encode("utf-8")).hexdigest()
+        key = "splango:%s:%s" % (self.prefix, digest)
+        return key, key + ":version"
+
+    def get(self, name):
+        """Return the value cached for ``name`` (None if there is none), and
+        the version to give to :meth:`set` along with a fresh value.
+
+        :rtype: tuple
+
+        """
+        key, version_key = self._get_keys(name)
+        values = cache.get_many([key, version_key])
+        version = values.get(version_key)
+        entry = values.get(key)
+        hit = version is not None and entry is not None and entry[0] == version
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return (entry[1] if hit else None), version
+
+    def get_version(self, name):
+        """Return the current version of ``name``, to :meth:`set` a value
+        computed after a change that bumped it."""
+        return cache.get(self._get_keys(name)[1])
+
+    def set(self, name, value, version):
+        """Cache ``value`` for ``name``, as of ``version`` (as returned by
+        :meth:`get` before ``value`` was computed).
+
+        """
+        key, version_key = self._get_keys(name)
+        if version is None:
+            version = self._new_version()
+            if not cache.add(version_key, version):
+                # bumped in the meantime: ``value`` may be stale already
+                return
+        cache.set(key, (version, value),
+                  getattr(settings, "SPLANGO_CACHE_TIMEOUT", None))
+
+    def bump(self, name):
+        """Invalidate the value cached for ``name``."""
+        key, version_key = self._get_keys(name)
+        try:
+            cache.incr(version_key)
+        except ValueError:
+            # no version yet: make sure a concurrent set() is discarded
+            cache.set(version_key, self._new_version())
+
+    @staticmethod
+    def _new_version():
+        # versions start anywhere, so that a value that outlived an evicted
+        # version key cannot match the next one
+        return random.randint(1, 2 ** 31)
+
+    def get_hit_ratio(self):
+        """Return the share of :meth:`get` calls that were hits, or None."""
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else None
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+#: :class:`splango.models.Experiment` objects with their variants, by name
+experiment_cache = VersionedCache("experiment")
+
+#: experiment name to variant id dictionaries, by subject id
+assignment_cache = VersionedCache("assignments")
@@ -0,0 +1,478 @@
+"""Append-only segmented event log for Splango.
+
+When ``settings.SPLANGO_STORAGE`` is ``"eventlog"``, enrollments and goals
+are not inserted in the database one row at a time. Instead they are
+appended as fixed-width binary records to local segment files in
+``settings.SPLANGO_EVENTLOG_DIR``:
+
+* every process writes to its own ``*.open`` segment, which is renamed to
+  ``*.seg`` once it reaches ``settings.SPLANGO_EVENTLOG_SEGMENT_SIZE`` bytes,
+  has been open ``settings.SPLANGO_EVENTLOG_SEGMENT_AGE`` seconds, or the
+  process exits
+* :class:`EventLogReader` memory-maps the segments and computes the same
+  funnel counts as :meth:`splango.models.ExperimentReport.generate`
+* the ``splango_compact_eventlog`` management command loads the closed
+  segments into the :class:`Enrollment` and :class:`GoalRecord` tables and
+  moves them to the ``compacted`` subdirectory, where the reader still
+  finds them; the segments left open by processes that died are closed
+  first
+
+Records only keep what fits in a fixed width: the request info and
+``extra`` of goal records are not stored.
+
+Subjects merged into a registered one when logging in are recorded in the
+log as well, since their logged events cannot be moved: the reader and the
+compaction count these events for the registered subject.
+
+"""
+import atexit
+import collections
+import errno
+import glob
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .models import (_NAME_LENGTH, ConversionRollup, Enrollment, Goal,
+                     GoalRecord, Subject, goal_name_cache)
+from .metrics import timed
+from .utils import bulk_insert, chunked, from_timestamp
+
+
+logger = logging.getLogger(__name__)
+
+KIND_ENROLLMENT = 1
+KIND_GOAL = 2
+KIND_MERGE = 3
+
+# a name of ``_NAME_LENGTH`` characters takes at most 4 bytes per character
+# in UTF-8, so names never need to be truncated
+_NAME_BYTES = 4 * _NAME_LENGTH
+
+#: kind, timestamp, subject id, experiment or goal name, variant id (or
+#: the id of the subject merged into)
+RECORD = struct.Struct("<BdQ%dsQ" % _NAME_BYTES)
+
+OPEN_SUFFIX = ".open"
+SEGMENT_SUFFIX = ".seg"
+COMPACTED_DIR = "compacted"
+#: where the merges of the deleted segments are kept
+MERGES_SEGMENT = "merges" + SEGMENT_SUFFIX
+
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+DEFAULT_SEGMENT_AGE = 300
+
+
+def is_enabled():
+    """Tell whether events are stored in the event log instead of the DB."""
+    return getattr(settings, "SPLANGO_STORAGE", "db") == "eventlog"
+
+
+def get_directory():
+    directory = getattr(settings, "SPLANGO_EVENTLOG_DIR", None)
+    if not directory:
+        raise ImproperlyConfigured(
+            "SPLANGO_EVENTLOG_DIR must be set to use the splango event log.")
+    return directory
+
+
+class EventLogWriter(object):
+
+    """Append event records to the current segment of this process.
+
+    Records are written to a buffered file; :meth:`flush` hands them to the
+    OS and rotates the segment once it is big enough. A timer rotates it
+    once it is ``segment_age`` seconds old, so that the events of idle
+    processes get compacted too.
+
+    """
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE,
+                 segment_age=DEFAULT_SEGMENT_AGE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segment_age = segment_age
+        self._lock = threading.Lock()
+        self._file = None
+        self._timer = None
+        self._pid = None
+        self._seq = 0
+
+    def _open(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self._pid = os.getpid()
+        self._seq += 1
+        name = "%013d-%07d-%05d%s" % (int(time.time() * 1000), self._pid,
+                                      self._seq, OPEN_SUFFIX)
+        self._file = open(os.path.join(self.directory, name), "ab")
+        if self.segment_age:
+            self._timer = threading.Timer(self.segment_age, self._expire,
+                                          [self._file])
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _expire(self, segment):
+        with self._lock:
+            if self._file is segment and self._pid == os.getpid():
+                self._rotate()
+
+    def _get_file(self):
+        if self._file is not None and self._pid != os.getpid():
+            # forked: the segment (and its timer) belong to the parent
+            self._file.close()
+            self._file = None
+            self._timer = None
+        if self._file is None:
+            self._open()
+        return self._file
+
+    def _append(self, kind, subject_id, name, variant_id, timestamp):
+        if timestamp is None:
+            timestamp = time.time()
+        record = RECORD.pack(kind, timestamp, subject_id,
+                             name.encode("utf-8"), variant_id)
+        with self._lock:
+            self._get_file().write(record)
+
+    def append_enrollment(self, subject_id, exp_name, variant_id,
+                          timestamp=None):
+        self._append(KIND_ENROLLMENT, subject_id, exp_name, variant_id,
+                     timestamp)
+
+    def append_goal(self, subject_id, goal_name, timestamp=None):
+        self._append(KIND_GOAL, subject_id, goal_name, 0, timestamp)
+
+    def append_merge(self, subject_id, other_subject_id, timestamp=None):
+        self._append(KIND_MERGE, subject_id, u"", other_subject_id,
+                     timestamp)
+
+    def flush(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.flush()
+            if self._file.tell() >= self.segment_size:
+                self._rotate()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._rotate()
+
+    def _rotate(self):
+        """Close the current segment so that it can be compacted."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        path = self._file.name
+        self._file.close()
+        self._file = None
+        os.rename(path, path[:-len(OPEN_SUFFIX)] + SEGMENT_SUFFIX)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Return the process-wide :class:`EventLogWriter`."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = EventLogWriter(
+                    get_directory(),
+                    getattr(settings, "SPLANGO_EVENTLOG_SEGMENT_SIZE",
+                            DEFAULT_SEGMENT_SIZE),
+                    getattr(settings, "SPLANGO_EVENTLOG_SEGMENT_AGE",
+                            DEFAULT_SEGMENT_AGE))
+                atexit.register(_writer.close)
+    return _writer
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM: alive, but someone else's
+        return e.errno == errno.EPERM
+    return True
+
+
+def close_orphaned_segments(directory):
+    """Close the open segments of the processes that are gone (killed, or
+    recycled without running their exit handlers), so that they can be
+    compacted.
+
+    The directory must be local: the process ids of the segment names are
+    only checked on this host.
+
+    :return: the paths of the closed segments
+    :rtype: list
+
+    """
+    closed = []
+    for path in glob.glob(os.path.join(directory, "*" + OPEN_SUFFIX)):
+        try:
+            pid = int(os.path.basename(path).split("-")[1])
+        except (IndexError, ValueError):
+            continue
+        if pid != os.getpid() and not is_process_alive(pid):
+            new_path = path[:-len(OPEN_SUFFIX)] + SEGMENT_SUFFIX
+            os.rename(path, new_path)
+            closed.append(new_path)
+    return closed
+
+
+def get_segment_paths(directory, include_open=True, include_compacted=True):
+    """Return the segment files in ``directory``, oldest first."""
+    patterns = ["*" + SEGMENT_SUFFIX]
+    if include_open:
+        patterns.append("*" + OPEN_SUFFIX)
+    directories = [directory]
+    if include_compacted:
+        directories.append(os.path.join(directory, COMPACTED_DIR))
+
+    paths = []
+    for d in directories:
+        for pattern in patterns:
+            paths.extend(glob.glob(os.path.join(d, pattern)))
+    return sorted(paths, key=os.path.basename)
+
+
+def iter_records(path):
+    """Yield ``(kind, timestamp, subject_id, name, variant_id)`` tuples
+    from the segment at ``path``.
+
+    A partially written trailing record (the segment may still be open)
+    is ignored.
+
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        size -= size % RECORD.size
+        if not size:
+            return
+        mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        try:
+            for offset in range(0, size, RECORD.size):
+                kind, timestamp, subject_id, name, variant_id = \
+                    RECORD.unpack_from(mm, offset)
+                yield (kind, timestamp, subject_id,
+                       name.rstrip(b"\0").decode("utf-8"), variant_id)
+        finally:
+            mm.close()
+
+
+def resolve_merges(merges):
+    """Map each subject of ``merges`` (subject id to the id of the subject
+    it was merged into) to the subject it ended up in."""
+    resolved = {}
+    for subject_id, other_id in merges.items():
+        seen = set([subject_id])
+        while other_id in merges and other_id not in seen:
+            seen.add(other_id)
+            other_id = merges[other_id]
+        resolved[subject_id] = other_id
+    return resolved
+
+
+def get_merges(directory):
+    """Return the subjects merged into others according to the segments of
+    ``directory``, resolved with :func:`resolve_merges`."""
+    merges = {}
+    for path in get_segment_paths(directory):
+        for kind, _, subject_id, _, other_id in iter_records(path):
+            if kind == KIND_MERGE:
+                merges[subject_id] = other_id
+    return resolve_merges(merges)
+
+
+def keep_merges(path, directory):
+    """Copy the merges of the segment at ``path`` to the
+    :data:`MERGES_SEGMENT` of the ``compacted`` subdirectory of
+    ``directory``, before the segment is deleted."""
+    records = [RECORD.pack(kind, timestamp, subject_id,
+                           name.encode("utf-8"), other_id)
+               for kind, timestamp, subject_id, name, other_id
+               in iter_records(path) if kind == KIND_MERGE]
+    if records:
+        with open(os.path.join(directory, COMPACTED_DIR, MERGES_SEGMENT),
+                  "ab") as f:
+            f.write(b"".join(records))
+
+
+def _resolve_subjects(events, merged_into):
+    """Re-key ``events`` (by subject id and name) by the subject each one
+    ended up in.
+
+    As with :meth:`splango.models.Subject.merge_into`, the events of the
+    subject merged into win over those of the subjects merged into it.
+
+    """
+    resolved = {}
+    for (subject_id, name), value in sorted(
+            events.items(), key=lambda item: item[0][0] in merged_into):
+        resolved.setdefault((merged_into.get(subject_id, subject_id), name),
+                            value)
+    return resolved
+
+
+class EventLogReader(object):
+
+    """Compute experiment reports by scanning the event log segments."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or get_directory()
+
+    def collect(self, exp_name, goal_names):
+        """Scan the segments for ``exp_name`` and the goals ``goal_names``.
+
+        As with the ``unique_together`` constraints of the tables, only the
+        first enrollment of a subject in the experiment counts. The events
+        of merged subjects count for the subject they were merged into.
+
+        :return: a dict mapping subject ids to variant ids, and a dict mapping
+          subject ids to the set of goal names they reached
+        :rtype: tuple
+
+        """
+        goal_names = set(goal_names)
+        variant_of = {}
+        goals_of = collections.defaultdict(set)
+        merges = {}
+
+        for path in get_segment_paths(self.directory):
+            for kind, _, subject_id, name, variant_id in iter_records(path):
+                if kind == KIND_ENROLLMENT:
+                    if name == exp_name and subject_id not in variant_of:
+                        variant_of[subject_id] = variant_id
+                elif kind == KIND_GOAL and name in goal_names:
+                    goals_of[subject_id].add(name)
+                elif kind == KIND_MERGE:
+                    merges[subject_id] = variant_id
+
+        if merges:
+            merged_into = resolve_merges(merges)
+            # as with Subject.merge_into, the enrollment of the subject
+            # merged into wins
+            resolved = {}
+            for subject_id, variant_id in sorted(
+                    variant_of.items(),
+                    key=lambda item: item[0] in merged_into):
+                resolved.setdefault(merged_into.get(subject_id, subject_id),
+                                    variant_id)
+            variant_of = resolved
+            for subject_id in set(goals_of) & set(merged_into):
+                goals_of[merged_into[subject_id]] |= goals_of.pop(subject_id)
+        return variant_of, goals_of
+
+    def generate(self, report):
+        """Return the rows of ``report``, as
+        :meth:`splango.models.ExperimentReport.generate` does.
+
+        :param report: the report to generate
+        :type report: :class:`splango.models.ExperimentReport`
+        :rtype: list
+
+        """
+        with timed("splango_report", experiment=report.experiment_id):
+            return self._generate(report)
+
+    def _generate(self, report):
+        goal_names = report.get_funnel_goals()
+        variant_of, goals_of = self.collect(report.experiment_id, goal_names)
+
+        enrolled = collections.Counter(variant_of.values())
+        reached = collections.Counter()
+        for subject_id, variant_id in variant_of.items():
+            for goal_name in goals_of.get(subject_id, ()):
+                reached[(variant_id, goal_name)] += 1
+
+        seen_goals = set()
+        for names in goals_of.values():
+            seen_goals.update(names)
+        goals = [Goal(name=name) if name in seen_goals else None
+                 for name in goal_names]
+
+        return report.build_rows(
+            report.experiment.get_variants(), goals,
+            lambda variant: enrolled[variant.pk],
+            lambda variant, goal: reached[(variant.pk, goal.name)])
+
+
+def load_segment(path, batch_size=500, merged_into=None):
+    """Insert the events of the segment at ``path`` in the database.
+
+    The events of merged subjects are inserted for the subject they were
+    merged into. Events that are already in the tables are skipped, as well
+    as those of subjects that no longer exist.
+
+    :param merged_into: the merged subjects, as returned by
+      :func:`get_merges`
+    :return: the number of enrollments and goal records created
+    :rtype: tuple
+
+    """
+    merged_into = merged_into or {}
+    enrollments = {}
+    goal_records = {}
+    for kind, timestamp, subject_id, name, variant_id in iter_records(path):
+        if kind == KIND_ENROLLMENT:
+            enrollments.setdefault((subject_id, name), (variant_id, timestamp))
+        elif kind == KIND_GOAL:
+            goal_records.setdefault((subject_id, name), timestamp)
+    if merged_into:
+        enrollments = _resolve_subjects(enrollments, merged_into)
+        goal_records = _resolve_subjects(goal_records, merged_into)
+
+    subject_ids = (set(k[0] for k in enrollments) |
+                   set(k[0] for k in goal_records))
+    existing_subjects = set()
+    existing_enrollments = set()
+    existing_goal_records = set()
+    for ids in chunked(subject_ids, batch_size):
+        existing_subjects.update(
+            Subject.objects.filter(pk__in=ids).values_list("pk", flat=True))
+        existing_enrollments.update(
+            Enrollment.objects.filter(subject__in=ids)
+            .values_list("subject_id", "experiment_id"))
+        existing_goal_records.update(
+            GoalRecord.objects.filter(subject__in=ids)
+            .values_list("subject_id", "goal_id"))
+
+    new_enrollments = [
+        Enrollment(subject_id=subject_id, experiment_id=exp_name,
+                   variant_id=variant_id, created=from_timestamp(timestamp))
+        for (subject_id, exp_name), (variant_id, timestamp)
+        in enrollments.items()
+        if subject_id in existing_subjects and
+        (subject_id, exp_name) not in existing_enrollments]
+
+    bulk_insert(Enrollment, new_enrollments, batch_size)
+    if ConversionRollup.is_enabled():
+        for enrollment in new_enrollments:
+            ConversionRollup.record_enrollment(enrollment)
+
+    for goal_name in set(k[1] for k in goal_records):
+        goal_name_cache.ensure(goal_name)
+    new_goal_records = [
+        GoalRecord(subject_id=subject_id, goal_id=goal_name,
+                   req_REMOTE_ADDR="", created=from_timestamp(timestamp))
+        for (subject_id, goal_name), timestamp in goal_records.items()
+        if subject_id in existing_subjects and
+        (subject_id, goal_name) not in existing_goal_records]
+
+    # goal records are inserted after the enrollments have been rolled up,
+    # so that each (enrollment, goal record) pair is only counted once
+    bulk_insert(GoalRecord, new_goal_records, batch_size)
+    if ConversionRollup.is_enabled():
+        ConversionRollup.record_goals(new_goal_records, batch_size)
+    return len(new_enrollments), len(new_goal_records)
@@ -0,0 +1,51 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from splango.archive import archive_experiment
+from splango.models import Experiment
+
+
+class Command(BaseCommand):
+
+    args = "<experiment name>"
+    help = ("Freeze an experiment's results and move its enrollments (and "
+            "optionally goal records) out of the live tables, to gzipped "
+            "CSV files.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dir', action='store', dest='directory',
+                    default=getattr(settings, 'SPLANGO_ARCHIVE_DIR', None),
+                    help='Where to write the archive files (defaults to '
+                         'settings.SPLANGO_ARCHIVE_DIR).'),
+        make_option('--batch-size', action='store', type='int',
+                    dest='batch_size', default=1000,
+                    help='Enrollments moved per transaction.'),
+        make_option('--goal-records', action='store_true',
+                    dest='move_goal_records', default=False,
+                    help='Also move the goal records of the subjects left '
+                         'without any enrollment.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError(
+                "Usage: splango_archive_experiment %s" % self.args)
+        if not options['directory']:
+            raise CommandError("No archive directory: use --dir or set "
+                               "settings.SPLANGO_ARCHIVE_DIR.")
+
+        try:
+            experiment = Experiment.objects.get(name=args[0])
+        except Experiment.DoesNotExist:
+            raise CommandError("No such experiment: %s" % args[0])
+        if experiment.state != Experiment.CONCLUDED:
+            raise CommandError("Only concluded experiments can be archived.")
+
+        archive = archive_experiment(experiment, options['directory'],
+                                     options['batch_size'],
+                                     options['move_goal_records'])
+        self.stdout.write("%s: %d enrollments and %d goal records archived "
+                          "to %s\n" % (experiment.name, archive.enrollments,
+                                       archive.goal_records, archive.location))
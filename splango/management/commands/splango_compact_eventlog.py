@@ -0,0 +1,47 @@
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from splango import eventlog
+
+
+class Command(BaseCommand):
+
+    help = ("Load the closed segments of the splango event log, and those "
+            "left open by processes that are gone, into the Enrollment and "
+            "GoalRecord tables.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', action='store', type='int',
+                    dest='batch_size', default=500,
+                    help='Rows inserted per query.'),
+        make_option('--delete', action='store_true', dest='delete',
+                    default=False,
+                    help='Delete the compacted segments instead of moving '
+                         'them to the "compacted" subdirectory (reports read '
+                         'from the event log will no longer count them).'),
+    )
+
+    def handle(self, *args, **options):
+        directory = eventlog.get_directory()
+        compacted_dir = os.path.join(directory, eventlog.COMPACTED_DIR)
+        if not os.path.isdir(compacted_dir):
+            os.makedirs(compacted_dir)
+
+        eventlog.close_orphaned_segments(directory)
+        paths = eventlog.get_segment_paths(
+            directory, include_open=False, include_compacted=False)
+        merged_into = eventlog.get_merges(directory)
+        for path in paths:
+            enrollments, goal_records = eventlog.load_segment(
+                path, options['batch_size'], merged_into)
+            if options['delete']:
+                eventlog.keep_merges(path, directory)
+                os.remove(path)
+            else:
+                os.rename(path, os.path.join(compacted_dir,
+                                             os.path.basename(path)))
+            self.stdout.write("%s: %d enrollments, %d goal records\n" %
+                              (os.path.basename(path), enrollments,
+                               goal_records))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from splango.models import Experiment
+from splango.snapshot import write_snapshot
+
+
+class Command(BaseCommand):
+
+    args = "<experiment name> <path>"
+    help = ("Write a columnar snapshot of an experiment's enrollments and "
+            "goal records, to be loaded with splango.snapshot.load_snapshot.")
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Usage: splango_export_snapshot %s" % self.args)
+        exp_name, path = args
+
+        try:
+            experiment = Experiment.objects.get(name=exp_name)
+        except Experiment.DoesNotExist:
+            raise CommandError("No such experiment: %s" % exp_name)
+
+        rows = write_snapshot(experiment, path)
+        self.stdout.write("%s: %d rows written to %s\n" %
+                          (exp_name, rows, path))
@@ -0,0 +1,90 @@
+import collections
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from splango.synthetic import TrafficGenerator
+
+
+def parse_rates(value):
+    """Parse ``"a:0.1,b:0.12"`` into an ordered ``{"a": 0.1, "b": 0.12}``."""
+    rates = collections.OrderedDict()
+    for item in value.split(","):
+        name, sep, rate = item.partition(":")
+        if not sep:
+            raise CommandError("Invalid variant %r: use name:rate." % item)
+        rates[name.strip()] = parse_rate(rate)
+    return rates
+
+
+def parse_rate(value):
+    try:
+        rate = float(value)
+    except ValueError:
+        raise CommandError("Invalid rate: %r" % value)
+    if not 0 <= rate <= 1:
+        raise CommandError("Rates are between 0 and 1: %r" % value)
+    return rate
+
+
+class Command(BaseCommand):
+
+    args = "<experiment>"
+    help = ("Generate synthetic subjects, enrolled in an experiment and "
+            "reaching the goals of a funnel, for load testing and report "
+            "benchmarks.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--subjects', action='store', type='int',
+                    dest='subjects', default=10000,
+                    help='Number of subjects to create.'),
+        make_option('--variants', action='store', dest='variants',
+                    default='control:0.1,test:0.1',
+                    help='Variants and the rate at which their subjects '
+                         'reach the first goal, as name:rate,...'),
+        make_option('--funnel', action='store', dest='funnel',
+                    default='signup',
+                    help='Goals of the funnel, in order, comma separated.'),
+        make_option('--drop-off', action='store', dest='drop_off',
+                    default='0.5',
+                    help='Share of the subjects that stop before each goal '
+                         'after the first: one rate, or one per goal.'),
+        make_option('--days', action='store', type='float', dest='days',
+                    default=30,
+                    help='Spread the subjects over that many past days.'),
+        make_option('--registered', action='store', dest='registered',
+                    default='0',
+                    help='Share of the subjects registered as (new) users.'),
+        make_option('--seed', action='store', type='int', dest='seed',
+                    help='Seed of the random generator.'),
+        make_option('--batch-size', action='store', type='int',
+                    dest='batch_size', default=1000,
+                    help='Rows inserted per query.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: splango_generate_traffic %s" %
+                               self.args)
+
+        funnel = [g.strip() for g in options['funnel'].split(",")]
+        drop_off = [parse_rate(r) for r in options['drop_off'].split(",")]
+        if len(drop_off) == 1:
+            drop_off = drop_off[0]
+        try:
+            generator = TrafficGenerator(
+                args[0], parse_rates(options['variants']), funnel,
+                drop_off=drop_off, days=options['days'],
+                registered=parse_rate(options['registered']),
+                seed=options['seed'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        start = time.time()
+        counts = generator.generate(options['subjects'],
+                                    options['batch_size'])
+        self.stdout.write(
+            "%(subjects)d subjects (%(registered)d registered), "
+            "%(enrollments)d enrollments and %(goal_records)d goal records "
+            "created" % counts + " in %.1f seconds\n" % (time.time() - start))
@@ -0,0 +1,52 @@
+import csv
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from splango.models import GoalRecord
+from splango.utils import from_timestamp
+
+
+class Command(BaseCommand):
+
+    args = "<file.csv> ..."
+    help = ("Record goals reached by registered users, read from CSV files "
+            "(or the standard input, with '-') of 'user id,goal name,POSIX "
+            "timestamp' lines. An empty timestamp means now.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', action='store', type='int',
+                    dest='batch_size', default=500,
+                    help='Rows inserted per query.'),
+    )
+
+    def read_records(self, f, name):
+        now = timezone.now()
+        for line, row in enumerate(csv.reader(f), 1):
+            if not row:
+                continue
+            try:
+                user_id, goal_name, timestamp = row
+                yield (int(user_id), goal_name.decode("utf-8"),
+                       from_timestamp(float(timestamp)) if timestamp else now)
+            except ValueError:
+                raise CommandError("%s, line %d: invalid record %r" %
+                                   (name, line, row))
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError("Give at least one file, or '-'.")
+
+        records = []
+        for name in args:
+            if name == "-":
+                records.extend(self.read_records(sys.stdin, name))
+            else:
+                with open(name, "rb") as f:
+                    records.extend(self.read_records(f, name))
+
+        created = GoalRecord.record_user_goals(records, options['batch_size'])
+        self.stdout.write("%d records read, %d goal records created\n" %
+                          (len(records), created))
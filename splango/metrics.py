@@ -0,0 +1,183 @@
+"""Instrumentation of splango's hot paths.
+
+When ``settings.SPLANGO_METRICS`` is set, splango times
+:meth:`~splango.RequestExperimentManager.declare_and_enroll` (per
+experiment), :meth:`~splango.RequestExperimentManager.finish`, the processing
+of each queued action, :meth:`~splango.models.Subject.merge_into` and report
+generation, and records the number of actions queued per request.
+
+Each observation is kept in the process-wide :data:`collector`,
+rendered in the Prometheus text format by the ``splango_metrics`` view, and
+passed to the sinks listed in ``settings.SPLANGO_METRICS_SINKS``: dotted
+paths to callables taking ``(kind, name, labels, value)``, such as
+:func:`signal_sink` and :func:`logging_sink`.
+
+Queries are only counted when Django records them, that is with
+``settings.DEBUG``.
+
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.dispatch import Signal
+from django.utils.importlib import import_module
+
+from .cache import assignment_cache, experiment_cache
+
+
+logger = logging.getLogger(__name__)
+
+#: sent by :func:`signal_sink` for every observation
+metric_recorded = Signal(providing_args=["kind", "name", "labels", "value"])
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50)
+
+
+def is_enabled():
+    return getattr(settings, "SPLANGO_METRICS", False)
+
+
+def signal_sink(kind, name, labels, value):
+    metric_recorded.send(sender=None, kind=kind, name=name, labels=labels,
+                         value=value)
+
+
+def logging_sink(kind, name, labels, value):
+    logger.info("%s %s%s %s", kind, name, _format_labels(labels), value)
+
+
+_sinks = None
+
+
+def get_sinks():
+    global _sinks
+    if _sinks is None:
+        sinks = []
+        for path in getattr(settings, "SPLANGO_METRICS_SINKS", ()):
+            module, attr = path.rsplit(".", 1)
+            sinks.append(getattr(import_module(module), attr))
+        _sinks = sinks
+    return _sinks
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (k, unicode(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+        for sink in get_sinks():
+            sink("counter", name, labels, value)
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            key = (name, labels)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+        for sink in get_sinks():
+            sink("histogram", name, labels, value)
+
+    def render(self):
+        """Return the metrics in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append("%s%s %s" % (name, _format_labels(labels),
+                                          value))
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append("%s_bucket%s %d" % (
+                        name, _format_labels(labels + (("le", bound),)),
+                        count))
+                lines.append("%s_bucket%s %d" % (
+                    name, _format_labels(labels + (("le", "+Inf"),)),
+                    histogram.count))
+                lines.append("%s_sum%s %s" % (name, _format_labels(labels),
+                                              histogram.sum))
+                lines.append("%s_count%s %d" % (name, _format_labels(labels),
+                                                histogram.count))
+        for cache in (experiment_cache, assignment_cache):
+            labels = (("cache", cache.prefix),)
+            lines.append("splango_cache_hits%s %d" % (
+                _format_labels(labels), cache.hits))
+            lines.append("splango_cache_misses%s %d" % (
+                _format_labels(labels), cache.misses))
+        return "\n".join(lines) + "\n"
+
+
+collector = MetricsRegistry()
+
+
+class timed(object):
+
+    """Context manager recording the latency of its block, as the
+    ``<name>_seconds`` histogram, and its queries, as ``<name>_queries``.
+
+    Does nothing unless ``settings.SPLANGO_METRICS`` is set.
+
+    """
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self.enabled = False
+
+    def __enter__(self):
+        self.enabled = is_enabled()
+        if self.enabled:
+            self.queries = (len(connection.queries)
+                            if settings.DEBUG else None)
+            self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.enabled:
+            return
+        collector.observe(self.name + "_seconds", time.time() - self.start,
+                          **self.labels)
+        if self.queries is not None:
+            collector.observe(self.name + "_queries",
+                              len(connection.queries) - self.queries,
+                              buckets=QUERY_BUCKETS, **self.labels)
@@ -1,16 +1,92 @@
-from splango import RequestExperimentManager
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject, empty
+
+from splango import (_HTML_TYPES, SPLANGO_VISITED, NullExperimentManager,
+                     RequestExperimentManager)
+from splango.bots import is_bot
+from splango.utils import PrefixTrie, is_first_visit
+
+
+def get_excluded_paths():
+    """Return ``settings.SPLANGO_EXCLUDE_PATHS``, which defaults to the
+    static and media files URLs."""
+    paths = getattr(settings, "SPLANGO_EXCLUDE_PATHS", None)
+    if paths is None:
+        paths = [url for url in (getattr(settings, "STATIC_URL", None),
+                                 getattr(settings, "MEDIA_URL", None))
+                 if url and url.startswith("/")]
+    return paths
 
 
 class ExperimentsMiddleware:
 
+    def __init__(self):
+        """Compile the included and excluded path prefixes into a trie.
+
+        The longest prefix of a path decides whether it is tracked. If
+        ``settings.SPLANGO_INCLUDE_PATHS`` is set, only the paths under its
+        prefixes are; otherwise every path that is not excluded is.
+
+        """
+        included = getattr(settings, "SPLANGO_INCLUDE_PATHS", None)
+        self.paths = PrefixTrie(
+            [(prefix, True) for prefix in included or ()] +
+            [(prefix, False) for prefix in get_excluded_paths()])
+        self.include_by_default = included is None
+        self.first_visit_goal = getattr(settings, "SPLANGO_FIRST_VISIT_GOAL",
+                                        None)
+
     def process_request(self, request):
         """Assign the Experiment Manager to the request."""
-        request.experiments_manager = RequestExperimentManager(request)
+        if (not self.paths.longest_match(request.path,
+                                         self.include_by_default) or
+                is_bot(request)):
+            request.experiments_manager = NullExperimentManager(request)
+        else:
+            # built on first use only: most requests never touch it
+            request.experiments_manager = SimpleLazyObject(
+                lambda: RequestExperimentManager(request))
         return None
 
+    def log_first_visit(self, request, response):
+        """Log ``settings.SPLANGO_FIRST_VISIT_GOAL`` if ``request`` is the
+        visitor's first (see :func:`splango.utils.is_first_visit`).
+
+        Only the successful HTML pages got by visitors without a session
+        are checked: API calls, health checks and the like cost nothing.
+        The first page of a verified visitor (see
+        :meth:`RequestExperimentManager.is_verified`) flags its session,
+        which sets the session cookie, so the visitor's later requests are
+        skipped without loading the session. Other visitors get the goal
+        held in the page, as any other, until they run the beacon.
+
+        """
+        if request.method != "GET" or response.status_code != 200:
+            return
+        content_type = response.get("Content-Type", "").split(";")[0]
+        if content_type not in _HTML_TYPES:
+            return
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return
+        if request.session.get(SPLANGO_VISITED):
+            return
+        manager = request.experiments_manager
+        if manager.is_verified():
+            request.session[SPLANGO_VISITED] = True
+        if is_first_visit(request):
+            manager.log_goal(self.first_visit_goal)
+
     def process_response(self, request, response):
         """Retrieve the Experiment Manager from the request and assign it to
         the response."""
-        if getattr(request, "experiments_manager", None):
-            request.experiments_manager.finish(response)
+        manager = getattr(request, "experiments_manager", None)
+        if manager is None:
+            return response
+        if self.first_visit_goal and isinstance(manager, SimpleLazyObject):
+            # a tracked request: the others get a NullExperimentManager
+            self.log_first_visit(request, response)
+        if isinstance(manager, SimpleLazyObject) and manager._wrapped is empty:
+            # never used during the request: nothing to do
+            return response
+        manager.finish(response)
         return response
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Merging the enrollment buckets duplicated by concurrent writes, as
+        # the unique constraint let NULL goals through
+        if not db.dry_run:
+            rollups = orm['splango.ConversionRollup'].objects.filter(
+                goal__isnull=True)
+            duplicates = (rollups.values('experiment', 'variant', 'period', 'start')
+                          .annotate(rows=models.Count('id'),
+                                    total=models.Sum('count'),
+                                    first=models.Min('id'))
+                          .filter(rows__gt=1))
+            for bucket in duplicates:
+                rollups.filter(
+                    experiment=bucket['experiment'], variant=bucket['variant'],
+                    period=bucket['period'], start=bucket['start']).exclude(
+                    pk=bucket['first']).delete()
+                rollups.filter(pk=bucket['first']).update(count=bucket['total'])
+            rollups.update(goal='')
+
+        # Changing field 'ConversionRollup.goal'
+        db.alter_column('splango_conversionrollup', 'goal_id', self.gf('django.db.models.fields.CharField')(default='', max_length=30, db_column='goal_id'))
+
+
+    def backwards(self, orm):
+        # Changing field 'ConversionRollup.goal'
+        db.alter_column('splango_conversionrollup', 'goal_id', self.gf('django.db.models.fields.CharField')(max_length=30, null=True, db_column='goal_id'))
+        if not db.dry_run:
+            orm['splango.ConversionRollup'].objects.filter(goal='').update(
+                goal=None)
+        db.alter_column('splango_conversionrollup', 'goal_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['splango.Goal'], null=True))
+
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'splango.conversionrollup': {
+            'Meta': {'unique_together': "(('experiment', 'variant', 'goal', 'period', 'start'),)", 'object_name': 'ConversionRollup'},
+            'count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'experiment': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['splango.Experiment']"}),
+            'goal': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '30', 'db_column': "'goal_id'", 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'period': ('django.db.models.fields.CharField', [], {'max_length': '4'}),
+            'start': ('django.db.models.fields.DateTimeField', [], {}),
+            'variant': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['splango.Variant']"})
+        },
+        'splango.enrollment': {
+            'Meta': {'unique_together': "(('subject', 'experiment'),)", 'object_name': 'Enrollment'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'experiment': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['splango.Experiment']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'subject': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['splango.Subject']"}),
+            'variant': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['splango.Variant']"})
+        },
+        'splango.experiment': {
+            'Meta': {'object_name': 'Experiment'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'primary_key': 'True'}),
+            'state': ('django.db.models.fields.CharField', [], {'default': "'running'", 'max_length': '10'}),
+            'winner': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'+'", 'null': 'True', 'to': "orm['splango.Variant']"})
+        },
+        'splango.experimentarchive': {
+            'Meta': {'object_name': 'ExperimentArchive'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'enrollments': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'experiment': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'archive'", 'unique': 'True', 'primary_key': 'True', 'to': "orm['splango.Experiment']"}),
+            'goal_records': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'location': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'summary': ('django.db.models.fields.TextField', [], {})
+        },
+        'splango.experimentreport': {
+            'Meta': {'object_name': 'ExperimentReport'},
+            'experiment': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['splango.Experiment']"}),
+            'funnel': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '100', 'blank': 'True'})
+        },
+        'splango.goal': {
+            'Meta': {'object_name': 'Goal'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'primary_key': 'True'})
+        },
+        'splango.goalrecord': {
+            'Meta': {'unique_together': "(('subject', 'goal'),)", 'object_name': 'GoalRecord'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'extra': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'goal': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['splango.Goal']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'req_HTTP_REFERER': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'req_REMOTE_ADDR': ('django.db.models.fields.IPAddressField', [], {'max_length': '15', 'blank': 'True'}),
+            'req_path': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'subject': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['splango.Subject']"})
+        },
+        'splango.subject': {
+            'Meta': {'object_name': 'Subject'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'goals': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['splango.Goal']", 'through': "orm['splango.GoalRecord']", 'symmetrical': 'False'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'registered_as': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']", 'unique': 'True', 'null': 'True'})
+        },
+        'splango.variant': {
+            'Meta': {'object_name': 'Variant'},
+            'experiment': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'variants'", 'to': "orm['splango.Experiment']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['splango']
\ No newline at end of file
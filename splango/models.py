@@ -1,9 +1,23 @@
+import collections
+import hashlib
+import json
 import logging
 import random
-import caching.base
-
-from django.db import models
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.signals import post_delete, post_save
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .cache import assignment_cache, experiment_cache
+from .metrics import timed
+from .utils import bulk_insert, chunked
 
 
 logger = logging.getLogger(__name__)
@@ -66,6 +80,76 @@ class Goal(models.Model):
         return gr_per_variant
 
 
+class GoalNameCache(object):
+
+    """The names of the goals known to exist, so that logging a goal does
+    not have to make sure its :class:`Goal` exists first.
+
+    The cache is warmed with one query on first use. It keeps at most
+    ``settings.SPLANGO_GOAL_CACHE_SIZE`` names (1000 by default), dropping
+    the least recently used ones, so that mistyped goal names cannot make it
+    grow without limit.
+
+    A deleted goal is discarded from the cache of the process that deletes
+    it; the other processes check again that a name exists once it has
+    been cached for ``settings.SPLANGO_GOAL_CACHE_TTL`` seconds (300 by
+    default), and :meth:`GoalRecord.record` creates the goal again if the
+    insert of a record fails meanwhile.
+
+    """
+
+    def __init__(self, size=None, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._names = None
+
+    def get_size(self):
+        if self.size is not None:
+            return self.size
+        return getattr(settings, "SPLANGO_GOAL_CACHE_SIZE", 1000)
+
+    def get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return getattr(settings, "SPLANGO_GOAL_CACHE_TTL", 300)
+
+    def clear(self):
+        self._names = None
+
+    def warm(self):
+        size = self.get_size()
+        names = Goal.objects.order_by("-created").values_list(
+            "name", flat=True)
+        expires = time.time() + self.get_ttl()
+        self._names = collections.OrderedDict(
+            (name, expires) for name in reversed(list(names[:size])))
+
+    def discard(self, name):
+        with self._lock:
+            if self._names is not None:
+                self._names.pop(name, None)
+
+    def ensure(self, name):
+        """Make sure the goal ``name`` exists, creating it if needed."""
+        with self._lock:
+            if self._names is None:
+                self.warm()
+            expires = self._names.pop(name, None)
+            if expires is not None and expires > time.time():
+                self._names[name] = expires
+                return
+
+        Goal.objects.get_or_create(name=name)
+        with self._lock:
+            self._names[name] = time.time() + self.get_ttl()
+            while len(self._names) > self.get_size():
+                self._names.popitem(last=False)
+
+
+goal_name_cache = GoalNameCache()
+
+
 class Subject(models.Model):
 
     """An experimental subject, possibly also a registered user (at creation
@@ -77,19 +161,107 @@ class Subject(models.Model):
     goals = models.ManyToManyField(Goal, through='GoalRecord')
 
     def __unicode__(self):
-        if self.registered_as:
+        if self.registered_as_id:
             prefix = "registered"
         else:
             prefix = "anonymous"
 
         return u"%s subject #%d" % (prefix, self.id)
 
+    def save(self, *args, **kwargs):
+        super(Subject, self).save(*args, **kwargs)
+        if self.registered_as_id:
+            cache.set(self._user_cache_key(self.registered_as_id), self.pk,
+                      self._get_user_cache_timeout())
+
+    def delete(self, *args, **kwargs):
+        if self.registered_as_id:
+            cache.delete(self._user_cache_key(self.registered_as_id))
+        super(Subject, self).delete(*args, **kwargs)
+
+    @staticmethod
+    def _user_cache_key(user_id):
+        return "splango:user-subject:%d" % user_id
+
+    @staticmethod
+    def _merged_cache_key(subject_id):
+        return "splango:merged-subject:%d" % subject_id
+
+    @staticmethod
+    def _get_user_cache_timeout():
+        return getattr(settings, "SPLANGO_USER_SUBJECT_CACHE_TIMEOUT",
+                       24 * 60 * 60)
+
+    @classmethod
+    def get_id_for_user(cls, user_id):
+        """Return the id of the subject registered as the user ``user_id``,
+        or None.
+
+        The mapping is cached, and kept up to date by :meth:`save` and
+        :meth:`delete` (hence by :meth:`merge_into`).
+
+        """
+        key = cls._user_cache_key(user_id)
+        subject_id = cache.get(key)
+        if subject_id is None:
+            subject_id = (cls.objects.filter(registered_as=user_id)
+                          .values_list("id", flat=True)[:1])
+            subject_id = subject_id[0] if subject_id else None
+            if subject_id is not None:
+                cache.set(key, subject_id, cls._get_user_cache_timeout())
+        return subject_id
+
+    @classmethod
+    def resolve(cls, subject):
+        """Return ``subject`` or, if it was merged into another subject
+        since (see :meth:`merge_into`), that subject.
+
+        Only the ``id`` of a merged into subject is set. Merges are
+        remembered in the cache for as long as the user subject mappings.
+
+        """
+        while not cls.objects.filter(pk=subject.pk).exists():
+            merged_id = cache.get(cls._merged_cache_key(subject.pk))
+            if merged_id is None:
+                logger.warning("subject %s was deleted" % subject.pk)
+                break
+            subject = cls(id=merged_id)
+        return subject
+
+    @classmethod
+    def get_or_create_for_user(cls, user):
+        """Return the subject registered as ``user``, creating it if needed.
+
+        A known subject is returned without any query: only its ``id`` and
+        ``registered_as_id`` are set.
+
+        """
+        subject_id = cls.get_id_for_user(user.pk)
+        if subject_id is not None:
+            return cls(id=subject_id, registered_as_id=user.pk)
+        subject, created = cls.objects.get_or_create(registered_as=user)
+        cache.set(cls._user_cache_key(user.pk), subject.pk,
+                  cls._get_user_cache_timeout())
+        return subject
+
     def merge_into(self, other_subject):
         """Move the enrollments and goal records associated with this subject
         into ``other_subject``, preserving ``other_subject``'s
         enrollments in case of conflict.
 
         """
+        with timed("splango_merge_into"):
+            self._merge_into(other_subject)
+
+    def _merge_into(self, other_subject):
+        # for the writes queued for this subject, in any process
+        cache.set(self._merged_cache_key(self.pk), other_subject.pk,
+                  self._get_user_cache_timeout())
+        rollups = ConversionRollup.is_enabled()
+        if rollups:
+            counted = (ConversionRollup.count_subject(self.pk) +
+                       ConversionRollup.count_subject(other_subject.pk))
+
         other_goals = dict(((g.name, 1) for g in other_subject.goals.all()))
 
         for goal_record in self.goalrecord_set.all().select_related("goal"):
@@ -110,6 +282,9 @@ class Subject(models.Model):
                 e.delete()
 
         self.delete()
+        if rollups:
+            ConversionRollup.adjust(
+                counted, ConversionRollup.count_subject(other_subject.pk))
 
     def is_registered_user(self):
         """Is this subject associated to a registered user?
@@ -119,7 +294,7 @@ class Subject(models.Model):
         :rtype: bool
 
         """
-        return self.registered_as is not None
+        return self.registered_as_id is not None
     is_registered_user.boolean = True
 
     def get_variants(self):
@@ -137,6 +312,20 @@ class Subject(models.Model):
         """
         return Enrollment.objects.filter(subject=self).values('variant')
 
+    def get_assignments(self):
+        """Return the ids of the variants of this subject, by experiment
+        name, from the cache if they are there.
+
+        :rtype: dict
+
+        """
+        assignments, version = assignment_cache.get(self.pk)
+        if assignments is None:
+            assignments = dict(Enrollment.objects.filter(subject=self.pk)
+                               .values_list("experiment_id", "variant_id"))
+            assignment_cache.set(self.pk, assignments, version)
+        return assignments
+
 
 class GoalRecord(models.Model):
 
@@ -167,9 +356,22 @@ class GoalRecord(models.Model):
     def record(cls, subject, goal_name, request_info, extra=None):
         logger.warn("goal_record %r" %
                     [subject, goal_name, request_info, extra])
-        goal, created = Goal.objects.get_or_create(name=goal_name)
-        goal_record, created = cls.objects.get_or_create(
-            subject=subject, goal=goal, defaults=request_info)
+        goal_name_cache.ensure(goal_name)
+        try:
+            goal_record, created = cls.objects.get_or_create(
+                subject=subject, goal=Goal(name=goal_name),
+                defaults=request_info)
+        except IntegrityError:
+            # the goal was deleted, maybe by another process, since it was
+            # cached
+            goal_name_cache.discard(goal_name)
+            goal_name_cache.ensure(goal_name)
+            goal_record, created = cls.objects.get_or_create(
+                subject=subject, goal=Goal(name=goal_name),
+                defaults=request_info)
+
+        if created and ConversionRollup.is_enabled():
+            ConversionRollup.record_goal(goal_record)
 
         if not created and not goal_record.extra and extra:
             # add my extra info to the existing goal record
@@ -180,14 +382,72 @@ class GoalRecord(models.Model):
 
     @classmethod
     def record_user_goal(cls, user, goal_name):
-        subject, created = Subject.objects.get_or_create(registered_as=user)
-        cls.record(subject, goal_name, {})
+        subject = Subject.get_or_create_for_user(user)
+        # no request: the address must still not be NULL
+        cls.record(subject, goal_name, {"req_REMOTE_ADDR": ""})
+
+    @classmethod
+    def record_user_goals(cls, records, batch_size=500):
+        """Record, in bulk, goals reached by registered users outside of
+        requests (payments, email clicks, ...).
+
+        The missing subjects are created, and the goal records inserted,
+        ``batch_size`` rows per query. As with :meth:`record`, a user
+        reaches a goal once: the earliest record is kept, and goals the user
+        already reached are skipped. Unknown users are skipped too.
+
+        :param records: ``(user id, goal name, datetime)`` tuples
+        :return: the number of goal records created
+        :rtype: int
+
+        """
+        first = {}
+        for user_id, goal_name, created in records:
+            key = (user_id, goal_name)
+            if key not in first or created < first[key]:
+                first[key] = created
+
+        user_ids = set()
+        for chunk in chunked(list(set(k[0] for k in first)), batch_size):
+            user_ids.update(User.objects.filter(pk__in=chunk)
+                            .values_list("pk", flat=True))
+
+        subject_of = {}
+        for chunk in chunked(list(user_ids), batch_size):
+            subject_of.update(Subject.objects.filter(registered_as__in=chunk)
+                              .values_list("registered_as", "id"))
+        missing = user_ids.difference(subject_of)
+        now = timezone.now()
+        bulk_insert(Subject, [Subject(registered_as_id=user_id, created=now)
+                              for user_id in missing], batch_size)
+        for chunk in chunked(list(missing), batch_size):
+            subject_of.update(Subject.objects.filter(registered_as__in=chunk)
+                              .values_list("registered_as", "id"))
+
+        for goal_name in set(k[1] for k in first):
+            goal_name_cache.ensure(goal_name)
+
+        existing = set()
+        for chunk in chunked(list(subject_of.values()), batch_size):
+            existing.update(cls.objects.filter(subject__in=chunk)
+                            .values_list("subject_id", "goal_id"))
+
+        new_goal_records = [
+            cls(subject_id=subject_of[user_id], goal_id=goal_name,
+                req_REMOTE_ADDR="", created=created)
+            for (user_id, goal_name), created in first.items()
+            if user_id in subject_of and
+            (subject_of[user_id], goal_name) not in existing]
+        bulk_insert(cls, new_goal_records, batch_size)
+        if ConversionRollup.is_enabled():
+            ConversionRollup.record_goals(new_goal_records, batch_size)
+        return len(new_goal_records)
 
     def __unicode__(self):
-        return u"%s by subject #%d" % (self.goal, self.subject_id)
+        return u"%s by subject #%d" % (self.goal_id, self.subject_id)
 
 
-class Enrollment(caching.base.CachingMixin, models.Model):
+class Enrollment(models.Model):
 
     """Identifies which variant a subject is assigned to in a given
     experiment."""
@@ -202,29 +462,46 @@ class Enrollment(caching.base.CachingMixin, models.Model):
     created = models.DateTimeField(auto_now_add=True, db_index=True)
     variant = models.ForeignKey('splango.Variant')
 
-    objects = caching.base.CachingManager()
-
     class Meta:
         unique_together = (('subject', 'experiment'),)
 
     def __unicode__(self):
         return (u"experiment '%s' subject #%d -- variant %s" %
-                (self.experiment.name, self.subject_id, self.variant))
+                (self.experiment_id, self.subject_id, self.variant))
 
 
-class Experiment(caching.base.CachingMixin, models.Model):
+class Experiment(models.Model):
 
     """A named experiment.
 
     An experiment has a lot of variants, and a variant belongs to only one
     experiment.
 
+    Only running experiments enroll subjects. A draft or paused experiment
+    shows its first variant to everybody, and a concluded one its
+    :attr:`winner` (or its first variant if there is no winner).
+
     """
 
+    DRAFT = "draft"
+    RUNNING = "running"
+    PAUSED = "paused"
+    CONCLUDED = "concluded"
+    STATE_CHOICES = (
+        (DRAFT, "Draft"),
+        (RUNNING, "Running"),
+        (PAUSED, "Paused"),
+        (CONCLUDED, "Concluded"),
+    )
+
     name = models.CharField(max_length=_NAME_LENGTH, primary_key=True)
     created = models.DateTimeField(auto_now_add=True, db_index=True)
-
-    objects = caching.base.CachingManager()
+    state = models.CharField(max_length=10, choices=STATE_CHOICES,
+                             default=RUNNING)
+    winner = models.ForeignKey('splango.Variant', null=True, blank=True,
+                               related_name="+",
+                               help_text="The variant shown to everybody "
+                                         "once the experiment is concluded.")
 
     # moved to variant, variant has the experiment
     # subjects = models.ManyToManyField(Subject, through=Enrollment)
@@ -232,12 +509,60 @@ class Experiment(caching.base.CachingMixin, models.Model):
     def __unicode__(self):
         return self.name
 
+    def clean(self):
+        if self.winner_id and self.winner.experiment_id != self.name:
+            raise ValidationError(
+                "The winner must be one of the experiment's variants.")
+
+    def save(self, *args, **kwargs):
+        super(Experiment, self).save(*args, **kwargs)
+        # avoid a circular import
+        from .registry import registry
+        registry.clear()
+
+    def is_running(self):
+        return self.state == self.RUNNING
+
+    def get_fixed_variant(self, variants=None):
+        """Return the variant shown to everybody when the experiment is not
+        running, or None if it has no variants.
+
+        :param variants: the experiment's variants, if already fetched
+        :rtype: :class:`Variant`
+
+        """
+        if self.state == self.CONCLUDED and self.winner_id:
+            return self.winner
+        if variants is None:
+            variants = self.get_variants()
+        variants = sorted(variants, key=lambda v: v.pk)
+        return variants[0] if variants else None
+
     # def set_variants(self, variant_list):
     #     self.variants = "\n".join(variant_list)
 
     def get_variants(self):
+        # experiments from the cache come with their variants
+        if hasattr(self, "_variants"):
+            return self._variants
         return self.variants.all()
 
+    def get_assigned_variant(self, subject):
+        """Return the variant ``subject`` is enrolled in, or None.
+
+        Both the subject's enrollments and the experiment's variants come
+        from the cache when they are there.
+
+        """
+        return self._get_variant(subject.get_assignments().get(self.name))
+
+    def _get_variant(self, variant_id):
+        if variant_id is not None:
+            for variant in self.get_variants():
+                if variant.pk == variant_id:
+                    return variant
+        return None
+
     def get_random_variant(self):
         """Return one of the object's variants chosen in a random way.
 
@@ -259,6 +584,60 @@ class Experiment(caching.base.CachingMixin, models.Model):
         generator = random.Random()
         return generator.choice(self.get_variants())
 
+    def get_stable_variant(self, subject):
+        """Return the variant of ``subject``, chosen by hashing its id.
+
+        Unlike :meth:`get_random_variant`, the same subject always gets the
+        same variant, without having to look its enrollment up.
+
+        :rtype: :class:`Variant`
+
+        """
+        variants = sorted(self.get_variants(), key=lambda v: v.pk)
+        digest = hashlib.md5(
+            (u"%s:%s" % (self.name, subject.pk)).encode("utf-8")).hexdigest()
+        return variants[int(digest, 16) % len(variants)]
+
+    @staticmethod
+    def count_conversions(names):
+        """Count the subjects enrolled in each of the experiments ``names``,
+        and those of them who reached each goal.
+
+        The counts are read from the daily :class:`ConversionRollup`
+        buckets, or, if rollups are disabled, from the enrollments and, for
+        the archived experiments, whose enrollments were moved out, from
+        their :class:`ExperimentArchive`; either way in at most three
+        queries.
+
+        :return: the counts of each experiment, by goal name, with None
+          standing for the enrollments
+        :rtype: dict
+
+        """
+        counts = dict((name, {}) for name in names)
+        if not names:
+            return counts
+        if ConversionRollup.is_enabled():
+            rows = (ConversionRollup.objects
+                    .filter(experiment__in=names, period=ConversionRollup.DAY)
+                    .values_list("experiment", "goal")
+                    .annotate(Sum("count")))
+        else:
+            for archive in ExperimentArchive.objects.filter(
+                    experiment__in=names):
+                counts[archive.experiment_id] = archive.count_conversions()
+            names = [name for name in names if not counts[name]]
+            enrollments = Enrollment.objects.filter(experiment__in=names)
+            rows = [(name, None, count) for name, count in
+                    enrollments.values_list("experiment")
+                    .annotate(Count("id"))]
+            rows.extend(enrollments.filter(subject__goals__isnull=False)
+                        .values_list("experiment", "subject__goals")
+                        .annotate(Count("id")))
+        for name, goal_id, count in rows:
+            counts[name][goal_id or None] = count
+        return counts
+
     def variants_commasep(self):
         variants = self.get_variants()
         variants_names = [v.name for v in variants]
@@ -276,10 +655,17 @@ class Experiment(caching.base.CachingMixin, models.Model):
             if None, a random variant will be used
             created, this will be the value for :attr:`Enrollment.variant`
         :type variant: str or None
-        :return: the enrollment for ``subject``
+        :return: the enrollment for ``subject``, unsaved if it was found
+            in the cache
         :rtype: :class:`Enrollment`
 
         """
+        assignments = subject.get_assignments()
+        assigned = self._get_variant(assignments.get(self.name))
+        if assigned is not None:
+            return Enrollment(subject=subject, experiment=self,
+                              variant=assigned)
+
         if variant is None:
             variant = self.get_random_variant()
         enrollment, created = Enrollment.objects.get_or_create(
@@ -287,6 +673,16 @@ class Experiment(caching.base.CachingMixin, models.Model):
             experiment=self,
             defaults={"variant": variant}
         )
+        if created:
+            if ConversionRollup.is_enabled():
+                ConversionRollup.record_enrollment(enrollment)
+            # saving bumped the version: cache the assignments as of now
+            assignments[self.name] = enrollment.variant_id
+            assignment_cache.set(subject.pk, assignments,
+                                 assignment_cache.get_version(subject.pk))
+        else:
+            # the cached assignments missed it
+            assignment_cache.bump(subject.pk)
         return enrollment
 
     @classmethod
@@ -294,11 +690,26 @@ class Experiment(caching.base.CachingMixin, models.Model):
         """create or update an experiment and its variants (variant names
         given).
 
+        Once declared, the experiment and its variants come from the cache,
+        until either changes.
+
         """
+        obj, version = experiment_cache.get(name)
+        if obj is not None and set(variants_names).issubset(
+                v.name for v in obj.get_variants()):
+            return obj
+
         obj, created = cls.objects.get_or_create(name=name)
 
         for v in variants_names:
-            Variant.objects.get_or_create(name=v, experiment=obj)
+            variant, variant_created = Variant.objects.get_or_create(
+                name=v, experiment=obj)
+            created = created or variant_created
+        if created:
+            # saving bumped the version
+            version = experiment_cache.get_version(name)
+        obj._variants = list(Variant.objects.filter(experiment=obj))
+        experiment_cache.set(name, obj, version)
         return obj
 
 
@@ -330,20 +741,55 @@ class ExperimentReport(models.Model):
           to each goal
 
         """
-        result = []
+        with timed("splango_report", experiment=self.experiment_id):
+            return self._generate()
+
+    def _generate(self):
         exp = self.experiment
-        variants = self.experiment.get_variants()
-        goals = self.get_funnel_goals()
+        goals = []
+        for goal in self.get_funnel_goals():
+            try:
+                goals.append(Goal.objects.get(name=goal))
+            except Goal.DoesNotExist:
+                logger.warn("No such goal <<%s>>." % goal)
+                goals.append(None)
+
+        try:
+            archive = ExperimentArchive.objects.get(experiment=exp)
+        except ExperimentArchive.DoesNotExist:
+            pass
+        else:
+            return self.build_rows(exp.get_variants(), goals,
+                                   archive.count_enrolled,
+                                   archive.count_reached)
+
+        return self.build_rows(
+            exp.get_variants(), goals,
+            lambda v: Enrollment.objects.filter(
+                experiment=exp, variant=v).count(),
+            lambda v, goal: Enrollment.objects.filter(
+                experiment=exp, variant=v, subject__goals=goal).count())
+
+    def build_rows(self, variants, goals, count_enrolled, count_reached):
+        """Build the report rows out of the enrollment and goal counts.
+
+        :param variants: the variants of the experiment
+        :param goals: the funnel goals, in order; None for unknown goals
+        :param count_enrolled: callable returning the number of subjects
+          enrolled in a variant
+        :param count_reached: callable returning the number of subjects of a
+          variant that reached a goal
+        :rtype: list
+
+        """
+        result = []
 
         # count initial participation
         variant_counts = []
 
         for v in variants:
-            # variant_counts.append(exp.subjectvariant_set.filter(variant=v).\
-            #     aggregate(ct=Count("variant")).get("ct",0))
-            val = Enrollment.objects.filter(experiment=exp, variant=v).count()
             variant_counts.append(dict(
-                val=val,
+                val=count_enrolled(v),
                 variant_name=v,
                 pct=None,
                 pct_cumulative=1,
@@ -354,18 +800,11 @@ class ExperimentReport(models.Model):
                        "variant_counts": variant_counts})
 
         for previ, goal in enumerate(goals):
-            try:
-                goal = Goal.objects.get(name=goal)
-            except Goal.DoesNotExist:
-                logger.warn("No such goal <<%s>>." % goal)
-                goal = None
-
             variant_counts = []
 
             for vi, v in enumerate(variants):
                 if goal:
-                    vcount = Enrollment.objects.filter(
-                        experiment=exp, variant=v, subject__goals=goal).count()
+                    vcount = count_reached(v, goal)
                     prev_count = result[previ]["variant_counts"][vi]["val"]
 
                     if prev_count == 0:
@@ -393,7 +832,7 @@ class ExperimentReport(models.Model):
         return result
 
 
-class Variant(caching.base.CachingMixin, models.Model):
+class Variant(models.Model):
 
     """An Experiment Variant, with optional weight
 
@@ -405,7 +844,6 @@ class Variant(caching.base.CachingMixin, models.Model):
                                    related_name="variants")
 
     name = models.CharField(max_length=_NAME_LENGTH, blank=True)
-    objects = caching.base.CachingManager()
     # weight = models.IntegerField(null=True, blank=True,
     #                              help_text="The priority of the variant")
 
@@ -443,3 +881,311 @@ class Variant(caching.base.CachingMixin, models.Model):
         """
         subjects = self.get_subjects()
         return GoalRecord.objects.filter(goal=goal, subject__in=subjects)
+
+
+class ConversionRollup(models.Model):
+
+    """Number of enrollments (if ``goal`` is :attr:`ENROLLMENTS`) or goal
+    records of an experiment variant within an hourly or daily time bucket.
+
+    Rollups are incremented as enrollments and goal records are created, so
+    that trends are read from a few rows per bucket instead of scanning the
+    :class:`Enrollment` and :class:`GoalRecord` tables. A goal counts for an
+    enrollment whether it was reached before or after the enrollment, as in
+    :meth:`ExperimentReport.generate`.
+
+    """
+
+    HOUR = "hour"
+    DAY = "day"
+    PERIOD_CHOICES = ((HOUR, "Hourly"), (DAY, "Daily"))
+    # not NULL, which would let the unique constraint through
+    ENROLLMENTS = ""
+
+    experiment = models.ForeignKey(Experiment)
+    variant = models.ForeignKey(Variant)
+    goal = models.CharField(max_length=_NAME_LENGTH, blank=True,
+                            default=ENROLLMENTS, db_column="goal_id")
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (
+            ('experiment', 'variant', 'goal', 'period', 'start'),)
+
+    def __unicode__(self):
+        return u"%s/%s/%s %s %s: %d" % (
+            self.experiment_id, self.variant_id, self.goal, self.period,
+            self.start, self.count)
+
+    @staticmethod
+    def is_enabled():
+        return getattr(settings, "SPLANGO_ROLLUPS", False)
+
+    @classmethod
+    def truncate(cls, value, period):
+        """Return the start of the ``period`` bucket that holds ``value``."""
+        value = value.replace(minute=0, second=0, microsecond=0)
+        if period == cls.DAY:
+            value = value.replace(hour=0)
+        return value
+
+    @classmethod
+    def increment(cls, experiment_id, variant_id, goal_id, when, by=1):
+        """Add ``by`` to the hourly and daily buckets that hold ``when``.
+
+        :param goal_id: the goal name, or None to count enrollments
+
+        """
+        if goal_id is None:
+            goal_id = cls.ENROLLMENTS
+        for period, _ in cls.PERIOD_CHOICES:
+            cls._add(experiment_id, variant_id, goal_id, period,
+                     cls.truncate(when, period), by)
+
+    @classmethod
+    def _add(cls, experiment_id, variant_id, goal, period, start, by):
+        bucket = cls.objects.filter(
+            experiment=experiment_id, variant=variant_id, goal=goal,
+            period=period, start=start)
+        if bucket.update(count=F("count") + by):
+            return
+        # the first write to the bucket: another one may insert it first
+        sid = transaction.savepoint()
+        try:
+            cls.objects.create(
+                experiment_id=experiment_id, variant_id=variant_id,
+                goal=goal, period=period, start=start, count=by)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            bucket.update(count=F("count") + by)
+        else:
+            transaction.savepoint_commit(sid)
+
+    @classmethod
+    def record_enrollment(cls, enrollment):
+        """Count ``enrollment``, and the goals its subject already reached."""
+        cls.increment(enrollment.experiment_id, enrollment.variant_id, None,
+                      enrollment.created)
+        goal_ids = GoalRecord.objects.filter(
+            subject=enrollment.subject_id).values_list("goal_id", flat=True)
+        for goal_id in goal_ids:
+            cls.increment(enrollment.experiment_id, enrollment.variant_id,
+                          goal_id, enrollment.created)
+
+    @classmethod
+    def record_goal(cls, goal_record):
+        """Count ``goal_record`` for every enrollment of its subject."""
+        enrollments = Enrollment.objects.filter(
+            subject=goal_record.subject_id).values_list(
+            "experiment_id", "variant_id")
+        for experiment_id, variant_id in enrollments:
+            cls.increment(experiment_id, variant_id, goal_record.goal_id,
+                          goal_record.created)
+
+    @classmethod
+    def record_goals(cls, goal_records, batch_size=500):
+        """Count ``goal_records`` as :meth:`record_goal` does, looking the
+        enrollments up ``batch_size`` subjects at a time and updating each
+        bucket once.
+
+        """
+        records_of = collections.defaultdict(list)
+        for goal_record in goal_records:
+            records_of[goal_record.subject_id].append(goal_record)
+
+        counts = collections.Counter()
+        for subject_ids in chunked(list(records_of), batch_size):
+            enrollments = Enrollment.objects.filter(
+                subject__in=subject_ids).values_list(
+                "subject_id", "experiment_id", "variant_id")
+            for subject_id, experiment_id, variant_id in enrollments:
+                for goal_record in records_of[subject_id]:
+                    for period, _ in cls.PERIOD_CHOICES:
+                        start = cls.truncate(goal_record.created, period)
+                        counts[(experiment_id, variant_id,
+                                goal_record.goal_id, period, start)] += 1
+
+        for key, count in counts.items():
+            cls._add(*key, by=count)
+
+    @classmethod
+    def count_subject(cls, subject_id):
+        """Return what the enrollments and goal records of a subject add
+        to the rollups, by bucket.
+
+        A goal is counted in the bucket of its record or, if it was reached
+        before the enrollment, of the enrollment, as :meth:`record_goal` and
+        :meth:`record_enrollment` count it.
+
+        :rtype: :class:`collections.Counter`
+
+        """
+        goal_records = list(GoalRecord.objects.filter(subject=subject_id)
+                            .values_list("goal_id", "created"))
+        counts = collections.Counter()
+        for experiment_id, variant_id, created in Enrollment.objects.filter(
+                subject=subject_id).values_list(
+                "experiment_id", "variant_id", "created"):
+            reached = [(goal_id, max(created, goal_created))
+                       for goal_id, goal_created in goal_records]
+            for goal_id, when in [(cls.ENROLLMENTS, created)] + reached:
+                for period, _ in cls.PERIOD_CHOICES:
+                    counts[(experiment_id, variant_id, goal_id, period,
+                            cls.truncate(when, period))] += 1
+        return counts
+
+    @classmethod
+    def adjust(cls, before, after):
+        """Update the buckets from the counts of :meth:`count_subject`
+        ``before`` to the ones ``after``, e.g. when subjects are merged."""
+        for key in set(before) | set(after):
+            by = after[key] - before[key]
+            if by > 0:
+                cls._add(*key, by=by)
+            elif by < 0:
+                experiment_id, variant_id, goal, period, start = key
+                cls.objects.filter(
+                    experiment=experiment_id, variant=variant_id, goal=goal,
+                    period=period, start=start).update(count=F("count") + by)
+
+    @classmethod
+    def cumulative_trend(cls, experiment, period, since):
+        """Return the cumulative conversion rate of each goal and variant of
+        ``experiment``, for every ``period`` bucket from ``since`` on.
+
+        Everything before ``since`` is summed up in a single query, so only
+        the rollups of the buckets shown are fetched one by one.
+
+        :return: the bucket starts, and for each goal a dict with the goal
+          name and one series per variant, holding the conversion
+          percentages at the end of each bucket
+        :rtype: tuple
+
+        """
+        variants = list(experiment.get_variants())
+        rollups = cls.objects.filter(experiment=experiment, period=period)
+
+        totals = dict(
+            ((r["variant"], r["goal"]), r["total"])
+            for r in rollups.filter(start__lt=since)
+            .values("variant", "goal").annotate(total=Sum("count")))
+        counts = {}
+        for variant_id, goal_id, start, count in rollups.filter(
+                start__gte=since).values_list(
+                "variant_id", "goal", "start", "count"):
+            counts[(variant_id, goal_id, start)] = count
+
+        buckets = sorted(set(key[2] for key in counts))
+        goal_ids = (set(key[1] for key in totals) |
+                    set(key[1] for key in counts))
+        goal_ids.discard(cls.ENROLLMENTS)
+
+        trends = []
+        for goal_id in sorted(goal_ids):
+            series = []
+            for v in variants:
+                enrolled = totals.get((v.pk, cls.ENROLLMENTS), 0)
+                reached = totals.get((v.pk, goal_id), 0)
+                points = []
+                for start in buckets:
+                    enrolled += counts.get((v.pk, cls.ENROLLMENTS, start), 0)
+                    reached += counts.get((v.pk, goal_id, start), 0)
+                    if enrolled:
+                        points.append(100.0 * reached / enrolled)
+                    else:
+                        points.append(0.0)
+                series.append({"variant": v, "points": points})
+            trends.append({"goal": goal_id, "series": series})
+
+        return buckets, trends
+
+
+class ExperimentArchive(models.Model):
+
+    """The frozen results of an experiment whose enrollments were moved out
+    of the live tables, optionally along with the goal records of the
+    subjects that were not enrolled in any other experiment.
+
+    :attr:`summary` holds, as JSON, the number of subjects enrolled in each
+    variant and how many of them reached each goal, so that the reports of
+    the experiment can still be generated.
+
+    """
+
+    experiment = models.OneToOneField(Experiment, primary_key=True,
+                                      related_name="archive")
+    created = models.DateTimeField(auto_now_add=True)
+    location = models.CharField(max_length=255, blank=True,
+                                help_text="Where the raw rows were moved.")
+    enrollments = models.PositiveIntegerField(default=0)
+    goal_records = models.PositiveIntegerField(default=0)
+    summary = models.TextField()
+
+    def __unicode__(self):
+        return self.experiment_id
+
+    @staticmethod
+    def summarize(experiment):
+        """Count the enrollments of each variant of ``experiment``, and
+        those of subjects that reached each goal.
+
+        :rtype: dict
+
+        """
+        enrollments = Enrollment.objects.filter(experiment=experiment)
+        enrolled = dict(
+            (r["variant__name"], r["n"]) for r in
+            enrollments.values("variant__name").annotate(n=Count("id")))
+        reached = {}
+        for r in (enrollments.filter(subject__goals__isnull=False)
+                  .values("variant__name", "subject__goals")
+                  .annotate(n=Count("id"))):
+            reached.setdefault(r["variant__name"], {})[
+                r["subject__goals"]] = r["n"]
+        return {"enrolled": enrolled, "reached": reached}
+
+    def get_summary(self):
+        if not hasattr(self, "_summary"):
+            self._summary = json.loads(self.summary)
+        return self._summary
+
+    def count_enrolled(self, variant):
+        return self.get_summary()["enrolled"].get(variant.name, 0)
+
+    def count_reached(self, variant, goal):
+        reached = self.get_summary()["reached"].get(variant.name, {})
+        return reached.get(goal.name, 0)
+
+    def count_conversions(self):
+        """Return the counts of the experiment, all variants together, as
+        :meth:`Experiment.count_conversions` does."""
+        summary = self.get_summary()
+        counts = {None: sum(summary["enrolled"].values())}
+        for reached in summary["reached"].values():
+            for goal_id, count in reached.items():
+                counts[goal_id] = counts.get(goal_id, 0) + count
+        return counts
+
+
+def _invalidate_experiment(sender, instance, **kwargs):
+    if sender is Experiment:
+        experiment_cache.bump(instance.pk)
+    else:
+        experiment_cache.bump(instance.experiment_id)
+
+
+def _invalidate_assignments(sender, instance, **kwargs):
+    assignment_cache.bump(instance.subject_id)
+
+
+def _discard_goal_name(sender, instance, **kwargs):
+    goal_name_cache.discard(instance.name)
+
+
+post_delete.connect(_discard_goal_name, sender=Goal)
+for signal in (post_save, post_delete):
+    signal.connect(_invalidate_experiment, sender=Experiment)
+    signal.connect(_invalidate_experiment, sender=Variant)
+    signal.connect(_invalidate_assignments, sender=Enrollment)
@@ -0,0 +1,74 @@
+"""Process-wide registry of the experiments that are not running.
+
+Draft, paused and concluded experiments show the same variant to
+everybody, so :class:`splango.RequestExperimentManager` returns it from this
+registry, without looking the subject up or touching the database.
+
+The registry is loaded with two queries on first use, and again every
+``settings.SPLANGO_REGISTRY_TTL`` seconds (60 by default) so that state
+changes made by other processes are picked up. Saving an
+:class:`Experiment` clears the registry of the current process.
+
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from .models import Experiment, Variant
+
+
+class ExperimentRegistry(object):
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._fixed_variants = None
+        self._loaded_at = 0
+
+    def get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return getattr(settings, "SPLANGO_REGISTRY_TTL", 60)
+
+    def clear(self):
+        self._fixed_variants = None
+
+    def load(self):
+        experiments = list(Experiment.objects.exclude(
+            state=Experiment.RUNNING).select_related("winner"))
+        variants = {}
+        for v in Variant.objects.filter(
+                experiment__in=[e.name for e in experiments]):
+            variants.setdefault(v.experiment_id, []).append(v)
+
+        fixed_variants = {}
+        for exp in experiments:
+            variant = exp.get_fixed_variant(variants.get(exp.name, []))
+            if variant is not None:
+                fixed_variants[exp.name] = variant
+        return fixed_variants
+
+    def get_fixed_variant(self, exp_name):
+        """Return the variant of ``exp_name`` if the experiment is not
+        running, or None.
+
+        :rtype: :class:`Variant`
+
+        """
+        fixed_variants = self._fixed_variants
+        if self._is_stale(fixed_variants):
+            with self._lock:
+                # another thread may have loaded it while this one waited
+                fixed_variants = self._fixed_variants
+                if self._is_stale(fixed_variants):
+                    fixed_variants = self._fixed_variants = self.load()
+                    self._loaded_at = time.time()
+        return fixed_variants.get(exp_name)
+
+    def _is_stale(self, fixed_variants):
+        return (fixed_variants is None or
+                time.time() - self._loaded_at > self.get_ttl())
+
+
+registry = ExperimentRegistry()
@@ -0,0 +1,186 @@
+"""Columnar snapshots of experiments, for offline analysis.
+
+A snapshot holds one row per enrollment and one row per goal record of an
+enrolled subject, stored as four columns:
+
+* ``subject_id``: the subject's id
+* ``variant``: the index of the subject's variant in :attr:`Snapshot.variants`
+* ``goal``: the index of the goal in :attr:`Snapshot.goals`, or ``-1`` for
+  the enrollment row
+* ``timestamp``: POSIX timestamp of the enrollment or the goal record
+
+The file starts with a JSON header (the name dictionary and the columns'
+layout) followed by the raw little-endian column data, so that
+:func:`load_snapshot` can memory-map the columns as NumPy arrays without
+copying or parsing them.
+
+"""
+import array
+import json
+import struct
+import sys
+
+from .models import Enrollment, GoalRecord
+from .utils import to_timestamp
+
+
+MAGIC = b"SPLANGO-SNAPSHOT-1\n"
+_HEADER_SIZE = struct.Struct("<I")
+
+# 64 bits integers: there is no wider typecode, though ``l`` is only 4
+# bytes wide on some platforms (see :func:`build_columns`)
+_INT64 = "l"
+
+#: column name, array typecode and NumPy dtype
+COLUMNS = (
+    ("subject_id", _INT64, "<i8"),
+    ("variant", _INT64, "<i8"),
+    ("goal", _INT64, "<i8"),
+    ("timestamp", "d", "<f8"),
+)
+
+NO_GOAL = -1
+
+
+def build_columns(experiment):
+    """Read the enrollments and goal records of ``experiment`` into arrays.
+
+    The goal records of subjects whose enrollment was committed after the
+    enrollments were read are left out.
+
+    :return: the variant names, the goal names and the columns
+    :rtype: tuple
+    :raises: :class:`RuntimeError` if the platform has no 64 bits arrays
+
+    """
+    itemsize = array.array(_INT64).itemsize
+    if itemsize != 8:
+        raise RuntimeError("Splango snapshots need 64 bits integers: C longs "
+                           "are %d bytes wide on this platform." % itemsize)
+    variants = sorted(experiment.get_variants(), key=lambda v: v.pk)
+    variant_index = dict((v.pk, i) for i, v in enumerate(variants))
+    goal_index = {}
+    columns = dict((name, array.array(typecode))
+                   for name, typecode, _ in COLUMNS)
+    variant_of = {}
+
+    enrollments = (Enrollment.objects.filter(experiment=experiment)
+                   .order_by()
+                   .values_list("subject_id", "variant_id", "created"))
+    for subject_id, variant_id, created in enrollments.iterator():
+        variant_of[subject_id] = variant_index[variant_id]
+        columns["subject_id"].append(subject_id)
+        columns["variant"].append(variant_of[subject_id])
+        columns["goal"].append(NO_GOAL)
+        columns["timestamp"].append(to_timestamp(created))
+
+    goal_records = (GoalRecord.objects
+                    .filter(subject__enrollment__experiment=experiment)
+                    .order_by()
+                    .values_list("subject_id", "goal_id", "created"))
+    for subject_id, goal_name, created in goal_records.iterator():
+        if subject_id not in variant_of:
+            continue
+        columns["subject_id"].append(subject_id)
+        columns["variant"].append(variant_of[subject_id])
+        columns["goal"].append(
+            goal_index.setdefault(goal_name, len(goal_index)))
+        columns["timestamp"].append(to_timestamp(created))
+
+    goals = sorted(goal_index, key=goal_index.get)
+    return [v.name for v in variants], goals, columns
+
+
+def write_snapshot(experiment, path):
+    """Write the snapshot of ``experiment`` to ``path``.
+
+    :return: the number of rows written
+    :rtype: int
+
+    """
+    variants, goals, columns = build_columns(experiment)
+    rows = len(columns["subject_id"])
+
+    header = {
+        "experiment": experiment.name,
+        "variants": variants,
+        "goals": goals,
+        "rows": rows,
+        "columns": [name for name, _, _ in COLUMNS],
+    }
+    header = json.dumps(header).encode("utf-8")
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_SIZE.pack(len(header)))
+        f.write(header)
+        # align the columns on 8 bytes so they can be mapped as arrays
+        f.write(b"\0" * (-f.tell() % 8))
+        for name, _, _ in COLUMNS:
+            column = columns[name]
+            if sys.byteorder == "big":
+                column.byteswap()
+            column.tofile(f)
+    return rows
+
+
+def read_header(f):
+    """Read the header of the snapshot file ``f``.
+
+    :return: the header, and the offset of the first column
+    :rtype: tuple
+    :raises: :class:`ValueError` if ``f`` is not a snapshot
+
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a splango snapshot: %r" % f.name)
+    size, = _HEADER_SIZE.unpack(f.read(_HEADER_SIZE.size))
+    header = json.loads(f.read(size).decode("utf-8"))
+    offset = f.tell()
+    return header, offset + (-offset % 8)
+
+
+class Snapshot(object):
+
+    """A loaded snapshot; see the module documentation for its columns."""
+
+    def __init__(self, experiment, variants, goals, columns):
+        self.experiment = experiment
+        self.variants = variants
+        self.goals = goals
+        self.subject_id = columns["subject_id"]
+        self.variant = columns["variant"]
+        self.goal = columns["goal"]
+        self.timestamp = columns["timestamp"]
+
+    def __len__(self):
+        return len(self.subject_id)
+
+
+def load_snapshot(path):
+    """Load the snapshot at ``path``, mapping its columns as NumPy arrays.
+
+    :rtype: :class:`Snapshot`
+    :raises: :class:`ImportError` if NumPy is not installed
+
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("Loading splango snapshots requires NumPy.")
+
+    with open(path, "rb") as f:
+        header, offset = read_header(f)
+
+    rows = header["rows"]
+    columns = {}
+    for name, _, dtype in COLUMNS:
+        if rows:
+            columns[name] = numpy.memmap(path, dtype=dtype, mode="r",
+                                         offset=offset, shape=(rows,))
+        else:
+            columns[name] = numpy.zeros(0, dtype=dtype)
+        offset += rows * numpy.dtype(dtype).itemsize
+
+    return Snapshot(header["experiment"], header["variants"],
+                    header["goals"], columns)
@@ -0,0 +1,174 @@
+"""Generation of synthetic traffic, to load test splango or benchmark its
+reports at production scale.
+
+Subjects are enrolled in an experiment and walk down a funnel of goals:
+the first goal is reached with the conversion rate of the subject's
+variant, and each of the next ones unless the subject drops off. Rows are
+written with bulk inserts, a chunk of subjects per transaction, and the
+conversion rollups are counted in memory and written once at the end. The
+database assigns the ids of the subjects and users, so that generators can
+run concurrently with each other and with live traffic.
+
+"""
+import collections
+import datetime
+import random
+import uuid
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import (ConversionRollup, Enrollment, Experiment, GoalRecord,
+                     Subject, goal_name_cache)
+from .utils import bulk_insert, bulk_insert_with_ids, chunked
+
+
+class TrafficGenerator(object):
+
+    """Generates the subjects, enrollments and goal records of an
+    experiment.
+
+    :param exp_name: the experiment, declared if needed
+    :param conversion_rates: the rate at which the subjects of each variant
+      reach the first goal, by variant name
+    :param funnel: the names of the goals, in order
+    :param drop_off: the share of the subjects that stop before each goal
+      after the first one: a number, or a list with one per goal
+    :param days: how many days before ``now`` subjects are spread over
+    :param registered: the share of subjects registered as users, who are
+      created as well
+    :param seed: seed of the random generator, for reproducible data
+
+    """
+
+    def __init__(self, exp_name, conversion_rates, funnel, drop_off=0.5,
+                 days=30, registered=0.0, now=None, seed=None):
+        self.exp_name = exp_name
+        self.conversion_rates = conversion_rates
+        self.funnel = funnel
+        if isinstance(drop_off, (int, float)):
+            drop_off = [drop_off] * (len(funnel) - 1)
+        if len(drop_off) != len(funnel) - 1:
+            raise ValueError("Give one drop off rate per goal after the "
+                             "first one.")
+        self.drop_off = drop_off
+        self.days = days
+        self.registered = registered
+        self.now = now or timezone.now()
+        self.random = random.Random(seed)
+
+    def generate(self, count, batch_size=1000):
+        """Create ``count`` subjects, with their enrollments and goal
+        records, and update the conversion rollups.
+
+        :return: the number of subjects, registered subjects, enrollments
+          and goal records created
+        :rtype: dict
+
+        """
+        exp = Experiment.declare(self.exp_name, list(self.conversion_rates))
+        # the experiment may have other variants: leave them out
+        variants = [v for v in exp.get_variants()
+                    if v.name in self.conversion_rates]
+        for goal in self.funnel:
+            goal_name_cache.ensure(goal)
+
+        self.rollups = collections.Counter()
+        self.counts = collections.Counter(subjects=0, registered=0,
+                                          enrollments=0, goal_records=0)
+
+        done = 0
+        while done < count:
+            size = min(batch_size, count - done)
+            with transaction.commit_on_success():
+                self._generate_chunk(variants, size, batch_size)
+            done += size
+
+        if ConversionRollup.is_enabled():
+            with transaction.commit_on_success():
+                self._write_rollups(batch_size)
+        return dict(self.counts)
+
+    def _write_rollups(self, batch_size):
+        existing = dict(
+            ((variant_id, goal_id, period, start), pk)
+            for pk, variant_id, goal_id, period, start in
+            ConversionRollup.objects.filter(experiment=self.exp_name)
+            .values_list("pk", "variant_id", "goal", "period", "start"))
+        new_rollups = []
+        for key, by in self.rollups.items():
+            pk = existing.get(key[1:])
+            if pk is None:
+                new_rollups.append(ConversionRollup(
+                    experiment_id=key[0], variant_id=key[1], goal=key[2],
+                    period=key[3], start=key[4], count=by))
+            else:
+                ConversionRollup.objects.filter(pk=pk).update(
+                    count=F("count") + by)
+        for chunk in chunked(new_rollups, batch_size):
+            ConversionRollup.objects.bulk_create(chunk)
+
+    def _generate_chunk(self, variants, size, batch_size):
+        rng = self.random
+        spread = self.days * 24 * 60 * 60
+        # marks the users of the chunk, to read their ids back
+        prefix = "synthetic%s-" % uuid.uuid4().hex[:12]
+        users, subjects, enrollments, goal_records = [], [], [], []
+        for i in xrange(size):
+            created = self.now - datetime.timedelta(
+                seconds=rng.uniform(0, spread))
+
+            subject = Subject(created=created)
+            if rng.random() < self.registered:
+                users.append((subject, User(
+                    username="%s%d" % (prefix, i),
+                    password="!", date_joined=created, last_login=created)))
+            subjects.append(subject)
+
+            variant = variants[rng.randrange(len(variants))]
+            enrollments.append(Enrollment(
+                subject=subject, experiment_id=self.exp_name,
+                variant_id=variant.pk, created=created))
+            self._count(variant, ConversionRollup.ENROLLMENTS, created)
+
+            rates = [self.conversion_rates[variant.name]]
+            rates.extend(1 - rate for rate in self.drop_off)
+            reached = created
+            for goal, rate in zip(self.funnel, rates):
+                if rng.random() >= rate:
+                    break
+                reached += datetime.timedelta(
+                    seconds=rng.expovariate(1.0 / 3600))
+                goal_records.append(GoalRecord(
+                    subject=subject, goal_id=goal, created=reached,
+                    req_REMOTE_ADDR=""))
+                self._count(variant, goal, reached)
+
+        self._insert_users(users, prefix)
+        bulk_insert_with_ids(Subject, subjects, batch_size)
+        for row in enrollments + goal_records:
+            row.subject_id = row.subject.pk
+        bulk_insert(Enrollment, enrollments, batch_size)
+        bulk_insert(GoalRecord, goal_records, batch_size)
+
+        self.counts["subjects"] += len(subjects)
+        self.counts["registered"] += len(users)
+        self.counts["enrollments"] += len(enrollments)
+        self.counts["goal_records"] += len(goal_records)
+
+    @staticmethod
+    def _insert_users(users, prefix):
+        """Bulk insert the users of ``(subject, user)`` pairs, whose names
+        start with ``prefix``, and register the subjects as the users."""
+        User.objects.bulk_create([user for subject, user in users])
+        ids = dict(User.objects.filter(username__startswith=prefix)
+                   .values_list("username", "pk"))
+        for subject, user in users:
+            subject.registered_as_id = ids[user.username]
+
+    def _count(self, variant, goal_id, when):
+        for period, _ in ConversionRollup.PERIOD_CHOICES:
+            self.rollups[(self.exp_name, variant.pk, goal_id, period,
+                          ConversionRollup.truncate(when, period))] += 1
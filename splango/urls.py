@@ -5,12 +5,21 @@ from splango import views
 
 urlpatterns = patterns(
     '',
+    url(r'^confirm/$',
+        views.confirm,
+        name="splango_confirm"),
+    url(r'^metrics/$',
+        views.metrics_text,
+        name="splango_metrics"),
     url(r'^admin/$',
         views.experiments_overview,
         name="splango_admin"),
     url(r'^admin/exp/(?P<exp_name>[^/]+)/$',
         views.experiment_detail,
         name="splango_experiment_detail"),
+    url(r'^admin/exp/(?P<exp_name>[^/]+)/trend/$',
+        views.experiment_trend,
+        name="splango_experiment_trend"),
     url(r'^admin/exp/report/(?P<report_id>\d+)/$',
         views.experiment_report,
         name="splango_experiment_report"),
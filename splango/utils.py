@@ -1,6 +1,14 @@
 """Utilities for project Splango.
 
 """
+import calendar
+import datetime
+import itertools
+import time
+
+from django.conf import settings
+from django.db import connections, models, router, transaction
+from django.utils import timezone
 
 
 def replace_insensitive(string, target, replacement):
@@ -18,6 +26,48 @@ def replace_insensitive(string, target, replacement):
         return string
 
 
+def insert_before_last(content, target, insertion, window=4096):
+    """Insert ``insertion`` before the last occurrence of ``target`` (case
+    insensitive) in ``content``.
+
+    Unlike :func:`replace_insensitive`, only the last ``window`` characters
+    of ``content`` are searched and case-folded, so large pages are not
+    copied just to find their closing tag.
+
+    :return: ``content``, unchanged if ``target`` was not found
+    :rtype: basestring
+
+    """
+    start = max(len(content) - window, 0)
+    index = content[start:].lower().rfind(target.lower())
+    if index < 0:
+        return content
+    index += start
+    return content[:index] + insertion + content[index:]
+
+
+def insert_into_chunks(chunks, target, insertion, window=4096):
+    """Wrap the iterable ``chunks`` of a streamed response so that
+    ``insertion`` is inserted before the last ``target`` of the content, as
+    :func:`insert_before_last` does.
+
+    Only the last ``window`` characters are held back: they are yielded,
+    with the insertion, as the final chunk.
+
+    """
+    tail = None
+    for chunk in chunks:
+        if tail is None:
+            tail = chunk
+        else:
+            tail += chunk
+        if len(tail) > 2 * window:
+            yield tail[:-window]
+            tail = tail[-window:]
+    if tail is not None:
+        yield insert_before_last(tail, target, insertion, window)
+
+
 def is_first_visit(request):
     """Tell whether it is the first visit by ``request``'s visitor.
 
@@ -47,3 +97,187 @@ def is_first_visit(request):
         referer = referer[8:]
 
     return not(referer.startswith(request.get_host()))
+
+
+class PrefixTrie(object):
+
+    """Map string prefixes to values, looked up by longest matching prefix.
+
+    A lookup walks the trie once, one character at a time, however many
+    prefixes there are.
+
+    """
+
+    def __init__(self, items=()):
+        self.root = {}
+        for prefix, value in items:
+            self.add(prefix, value)
+
+    def add(self, prefix, value):
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        # None never collides with a character
+        node[None] = value
+
+    def longest_match(self, string, default=None):
+        """Return the value of the longest prefix of ``string``, or
+        ``default`` if no prefix matches."""
+        node = self.root
+        value = node.get(None, default)
+        for char in string:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                value = node[None]
+        return value
+
+
+def chunked(iterable, size):
+    """Yield lists of at most ``size`` items taken from ``iterable``."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_insert(model, objects, batch_size=500):
+    """Insert ``objects`` in chunks of ``batch_size``, like ``bulk_create``
+    but keeping the ``created`` field of the objects as is, even though it
+    is declared with ``auto_now_add``.
+
+    The field values of the objects are inserted without calling
+    ``pre_save``, as when loading fixtures, rather than by changing the
+    field that concurrent threads are saving objects with.
+
+    :param model: the model class of ``objects``
+    :param objects: unsaved instances of ``model``
+    :param batch_size: how many rows to insert per query, at most: less
+      when the database limits the parameters of a query, as SQLite does
+
+    """
+    using = router.db_for_write(model)
+    ops = connections[using].ops
+    fields = model._meta.local_fields
+    with_pk = [obj for obj in objects if obj.pk is not None]
+    without_pk = [obj for obj in objects if obj.pk is None]
+    for objs, insert_fields in (
+            (with_pk, fields),
+            (without_pk, [f for f in fields
+                          if not isinstance(f, models.AutoField)])):
+        if not objs:
+            continue
+        size = min(batch_size,
+                   max(ops.bulk_batch_size(insert_fields, objs), 1))
+        for chunk in chunked(objs, size):
+            model._base_manager._insert(chunk, fields=insert_fields,
+                                        using=using, raw=True)
+    transaction.commit_unless_managed(using=using)
+
+
+def bulk_insert_with_ids(model, objects, batch_size=500):
+    """Insert ``objects`` with :func:`bulk_insert`, letting the database
+    assign their primary keys, and set them on ``objects``.
+
+    On PostgreSQL, a block of values of the table's sequence is reserved
+    first. SQLite writes one transaction at a time and gives new rows the
+    largest ids, so the ids are read back after the insert: call it in a
+    transaction. Other databases insert the objects one at a time.
+
+    """
+    if not objects:
+        return
+    using = router.db_for_write(model)
+    connection = connections[using]
+    opts = model._meta
+    if connection.vendor == "postgresql":
+        cursor = connection.cursor()
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, %s)) "
+                       "FROM generate_series(1, %s)",
+                       [opts.db_table, opts.pk.column, len(objects)])
+        for obj, (pk,) in zip(objects, cursor.fetchall()):
+            obj.pk = pk
+        bulk_insert(model, objects, batch_size)
+    elif connection.vendor == "sqlite":
+        bulk_insert(model, objects, batch_size)
+        pks = list(model._base_manager.using(using).order_by("-pk")
+                   .values_list("pk", flat=True)[:len(objects)])
+        for obj, pk in zip(objects, reversed(pks)):
+            obj.pk = pk
+    else:
+        for obj in objects:
+            insert(obj)
+
+
+def insert(obj):
+    """Insert ``obj`` like ``bulk_insert`` does, letting the database assign
+    its primary key, and set it on ``obj``.
+
+    """
+    model = type(obj)
+    using = router.db_for_write(model)
+    fields = [f for f in model._meta.local_fields
+              if not isinstance(f, models.AutoField)]
+    obj.pk = model._base_manager._insert([obj], fields=fields, using=using,
+                                         return_id=True, raw=True)
+    obj._state.adding = False
+    obj._state.db = using
+    transaction.commit_unless_managed(using=using)
+    return obj
+
+
+def from_timestamp(timestamp):
+    """Return the datetime for the POSIX ``timestamp``, aware if
+    ``settings.USE_TZ`` is set.
+
+    """
+    if getattr(settings, "USE_TZ", False):
+        return datetime.datetime.fromtimestamp(timestamp, timezone.utc)
+    return datetime.datetime.fromtimestamp(timestamp)
+
+
+def to_timestamp(value):
+    """Return the POSIX timestamp of the datetime ``value``.
+
+    Naive datetimes are taken as local time, as Django stores them when
+    ``settings.USE_TZ`` is not set.
+
+    """
+    if timezone.is_aware(value):
+        seconds = calendar.timegm(value.utctimetuple())
+    else:
+        seconds = time.mktime(value.timetuple())
+    return seconds + value.microsecond / 1000000.0
+
+
+def estimate_count(model, using=None):
+    """Return the number of rows of the table of ``model`` estimated from
+    the database statistics, or ``None`` if they are unavailable.
+
+    Estimates are read from ``pg_class`` on PostgreSQL and
+    ``information_schema`` on MySQL; they are only as fresh as the last
+    ``ANALYZE``, but take no time on tables too large to count.
+
+    :param model: a model class
+    :param using: the alias of the database to query
+
+    """
+    connection = connections[using or router.db_for_read(model)]
+    vendor = connection.vendor
+    if vendor == "postgresql":
+        sql = "SELECT reltuples FROM pg_class WHERE relname = %s"
+    elif vendor == "mysql":
+        sql = ("SELECT table_rows FROM information_schema.tables "
+               "WHERE table_schema = DATABASE() AND table_name = %s")
+    else:
+        return None
+    cursor = connection.cursor()
+    cursor.execute(sql, [model._meta.db_table])
+    row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        # never analyzed
+        return None
+    return int(row[0])
@@ -1,29 +1,114 @@
 # coding: utf-8
+import datetime
+
+from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.http import Http404, HttpResponse
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from . import (NullExperimentManager, RequestExperimentManager, eventlog,
+               metrics)
+from .models import (ConversionRollup, Enrollment, Experiment,
+                     ExperimentReport, Goal, GoalRecord, Variant)
+
+
+@csrf_exempt
+@require_POST
+def confirm(request):
+    """Beacon posted by the javascript injected in HTML responses.
+
+    Verifies the client as a human and queues the actions held in the
+    posted tokens; the middleware then processes them as usual. The tokens
+    are signed, hence the CSRF exemption.
 
-from .models import Enrollment, Experiment, ExperimentReport, Goal, GoalRecord, Variant
+    The actions are processed here if the middleware does not track this
+    request (because of its path or user agent): they were queued on pages
+    that it tracked.
+
+    """
+    tokens = request.POST.getlist("t")
+    response = HttpResponse(status=204)
+    manager = getattr(request, "experiments_manager", None)
+    if manager is None or isinstance(manager, NullExperimentManager):
+        manager = RequestExperimentManager(request)
+        manager.confirm_human(tokens)
+        return manager.finish(response)
+    manager.confirm_human(tokens)
+    return response
+
+
+def metrics_text(request):
+    """The metrics of this process (see :mod:`splango.metrics`), in the
+    Prometheus text format, for staff members and ``INTERNAL_IPS``."""
+    if not metrics.is_enabled():
+        raise Http404
+    if (not request.user.is_staff and
+            request.META.get("REMOTE_ADDR") not in settings.INTERNAL_IPS):
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.collector.render(),
+                        content_type="text/plain; version=0.0.4")
 
 
 @staff_member_required
 def experiments_overview(request):
-    """Show experiments list."""
-    experiments = Experiment.objects.all()
-    reports = ExperimentReport.objects.all()
-    reports_by_id = dict()
+    """Show the experiments, a page at a time, with their enrollment and goal
+    counts (see :meth:`Experiment.count_conversions`).
 
-    goals = Goal.objects.all()
+    The ``q`` (part of the name) and ``state`` GET parameters filter the
+    experiments. The page takes the same number of queries whatever the
+    number of experiments and goals.
 
-    for r in reports:
-        reports_by_id.setdefault(r.experiment_id, []).append(r)
-    for e in experiments:
-        e.reports = reports_by_id.get(e.name, [])
+    """
+    experiments = Experiment.objects.order_by("-created", "name")
+    query = request.GET.get("q", "").strip()
+    if query:
+        experiments = experiments.filter(name__icontains=query)
+    state = request.GET.get("state", "")
+    if state in dict(Experiment.STATE_CHOICES):
+        experiments = experiments.filter(state=state)
+
+    paginator = Paginator(experiments,
+                          getattr(settings, "SPLANGO_OVERVIEW_PAGE_SIZE", 50))
+    try:
+        page = paginator.page(request.GET.get("page", 1))
+    except (EmptyPage, PageNotAnInteger):
+        raise Http404
+
+    experiments = list(page.object_list)
+    names = [e.name for e in experiments]
+    reports_by_name = {}
+    for r in ExperimentReport.objects.filter(experiment__in=names):
+        reports_by_name.setdefault(r.experiment_id, []).append(r)
+    variants_by_name = {}
+    for v in Variant.objects.filter(experiment__in=names):
+        variants_by_name.setdefault(v.experiment_id, []).append(v)
+    counts = Experiment.count_conversions(names)
 
+    for e in experiments:
+        e.reports = reports_by_name.get(e.name, [])
+        # as with cached experiments, get_variants() makes no query
+        e._variants = variants_by_name.get(e.name, [])
+        goal_counts = counts[e.name]
+        e.enrolled = goal_counts.pop(None, 0)
+        e.goal_counts = [
+            (goal_id, count, count * 100.0 / e.enrolled if e.enrolled else 0)
+            for goal_id, count in sorted(goal_counts.items())]
+
+    params = request.GET.copy()
+    params.pop("page", None)
     context = {
         "title": "Experiments",
         "experiments": experiments,
-        "goals": goals,
+        "page": page,
+        "query": query,
+        "state": state,
+        "states": Experiment.STATE_CHOICES,
+        "params": params.urlencode(),
     }
 
     return render_to_response(
@@ -51,7 +136,10 @@ def experiment_report(request, report_id):
     # has an experiment as a field.
 
     report = get_object_or_404(ExperimentReport, id=report_id)
-    report_rows = report.generate()
+    if eventlog.is_enabled():
+        report_rows = eventlog.EventLogReader().generate(report)
+    else:
+        report_rows = report.generate()
 
     dictionary = {"title": report.title, "exp": report.experiment,
                   "report": report, "report_rows": report_rows, }
@@ -59,6 +147,45 @@ def experiment_report(request, report_id):
                               RequestContext(request))
 
 
+@staff_member_required
+def experiment_trend(request, exp_name):
+    """Show the cumulative conversion of each variant over time, read from
+    the experiment's :class:`ConversionRollup` buckets.
+
+    The ``period`` (``"day"`` or ``"hour"``) and ``days`` GET parameters
+    choose the buckets and how far back to go.
+
+    """
+    exp = get_object_or_404(Experiment, name=exp_name)
+
+    period = request.GET.get("period", ConversionRollup.DAY)
+    if period not in dict(ConversionRollup.PERIOD_CHOICES):
+        raise Http404
+    try:
+        days = int(request.GET.get("days", 90))
+    except ValueError:
+        raise Http404
+
+    since = ConversionRollup.truncate(
+        timezone.now() - datetime.timedelta(days=days), period)
+    buckets, trends = ConversionRollup.cumulative_trend(exp, period, since)
+
+    for trend in trends:
+        trend["chart_data"] = "|".join(
+            ",".join("%0.2f" % p for p in s["points"])
+            for s in trend["series"])
+        trend["rows"] = [
+            (start, ["%0.2f" % s["points"][i] for s in trend["series"]])
+            for i, start in enumerate(buckets)]
+
+    dictionary = {"title": "Trend: %s" % exp.name, "exp": exp,
+                  "variants": exp.get_variants(), "period": period,
+                  "days": days, "trends": trends,
+                  "rollups_enabled": ConversionRollup.is_enabled()}
+    return render_to_response("splango/experiment_trend.html", dictionary,
+                              RequestContext(request))
+
+
 @staff_member_required
 def experiment_log(request, exp_name, variant, goal):
     """Show an enrollment, that dentifies which variant a subject is assigned
@@ -0,0 +1,115 @@
+import re
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+from mock import patch
+
+from splango.models import Enrollment, GoalRecord, goal_name_cache
+from splango.synthetic import TrafficGenerator
+from splango.utils import estimate_count
+
+
+CHANGELIST = '/admin/splango/enrollment/'
+
+
+class CursorChangeListTest(TestCase):
+
+    urls = 'tests.urls'
+
+    def setUp(self):
+        cache.clear()
+        goal_name_cache.clear()
+        User.objects.create_superuser("staff", "staff@example.com", "pw")
+        self.client.login(username="staff", password="pw")
+        TrafficGenerator("admin_exp", {"a": 0.5, "b": 0.5}, ["signup"],
+                         seed=0).generate(250)
+
+    def _get_num_queries(self, path):
+        connection.use_debug_cursor = True
+        try:
+            # the queries are reset when the request starts
+            response = self.client.get(path)
+            return response, len(connection.queries)
+        finally:
+            connection.use_debug_cursor = None
+
+    def _get_next_page(self, response):
+        match = re.search(r'href="(\?[^"]*)" class="next"', response.content)
+        return match and CHANGELIST + match.group(1).replace("&amp;", "&")
+
+    def test_pages(self):
+        pks = []
+        path = CHANGELIST
+        while path:
+            response = self.client.get(path)
+            self.assertEqual(200, response.status_code)
+            pks.extend(e.pk for e in response.context["cl"].result_list)
+            path = self._get_next_page(response)
+
+        self.assertEqual(
+            list(Enrollment.objects.order_by("-pk")
+                 .values_list("pk", flat=True)),
+            pks)
+        self.assertContains(response, "250 enrollments")
+        self.assertContains(response, "newest")
+
+    def test_filtered_pages(self):
+        variant = Enrollment.objects.all()[0].variant
+        path = CHANGELIST + "?variant__id__exact=%d" % variant.pk
+        response = self.client.get(path)
+        next_page = self._get_next_page(response)
+
+        self.assertIn("variant__id__exact=%d" % variant.pk, next_page)
+        response = self.client.get(next_page)
+        self.assertTrue(all(e.variant_id == variant.pk
+                            for e in response.context["cl"].result_list))
+        self.assertEqual(variant.enrollment_set.count(),
+                         response.context["cl"].result_count)
+
+    def test_num_queries(self):
+        response, first = self._get_num_queries(CHANGELIST)
+        response, other = self._get_num_queries(
+            self._get_next_page(response))
+
+        TrafficGenerator("admin_exp", {"a": 0.5, "b": 0.5}, ["signup"],
+                         seed=1).generate(250)
+        response, more = self._get_num_queries(
+            self._get_next_page(response))
+
+        self.assertEqual(first, other)
+        self.assertEqual(first, more)
+
+    @override_settings(SPLANGO_ADMIN_EXACT_COUNT_LIMIT=100)
+    def test_estimated_count(self):
+        variant = Enrollment.objects.all()[0].variant
+        with patch("splango.admin.estimate_count", return_value=12000000):
+            response = self.client.get(CHANGELIST)
+            filtered = self.client.get(
+                CHANGELIST + "?variant__id__exact=%d" % variant.pk)
+
+        self.assertContains(response, "about 12000000 enrollments")
+        self.assertEqual(100, len(response.context["cl"].result_list))
+        self.assertEqual(200, filtered.status_code)
+        self.assertEqual(None, filtered.context["cl"].result_count)
+        self.assertNotContains(filtered, "about")
+
+    def test_goal_records(self):
+        response = self.client.get('/admin/splango/goalrecord/')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            min(100, GoalRecord.objects.count()),
+            len(response.context["cl"].result_list))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(CHANGELIST + "?before=x")
+
+        # the admin redirects invalid lookups to an error page
+        self.assertEqual(302, response.status_code)
+
+    def test_estimate_count_unavailable(self):
+        # SQLite keeps no row count statistics
+        self.assertEqual(None, estimate_count(Enrollment))
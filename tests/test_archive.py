@@ -0,0 +1,83 @@
+import gzip
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from splango.archive import archive_experiment, get_archive_paths
+from splango.models import Enrollment, ExperimentArchive, GoalRecord
+from splango.tests import (
+    create_enrollment, create_experiment, create_experiment_report,
+    create_goal, create_goal_record, create_subject, create_variant)
+
+
+class ArchiveTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        self.exp = create_experiment()
+        self.other_exp = create_experiment(name='Other experiment')
+        self.variant1 = create_variant(name='variant1', experiment=self.exp)
+        self.variant2 = create_variant(name='variant2', experiment=self.exp)
+        self.other_variant = create_variant(experiment=self.other_exp)
+        self.report = create_experiment_report(experiment=self.exp,
+                                               funnel="signup")
+        goal = create_goal(name='signup')
+
+        self.subjects = [create_subject() for _ in range(3)]
+        for subject, variant in zip(self.subjects, [self.variant1,
+                                                    self.variant1,
+                                                    self.variant2]):
+            create_enrollment(subject=subject, variant=variant,
+                              experiment=self.exp)
+            create_goal_record(subject=subject, goal=goal)
+        # the last subject is also part of another experiment
+        create_enrollment(subject=self.subjects[2],
+                          variant=self.other_variant,
+                          experiment=self.other_exp)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_archive_experiment(self):
+        def counts(rows):
+            return [[c["val"] for c in row["variant_counts"]] for row in rows]
+        before = counts(self.report.generate())
+
+        archive = archive_experiment(self.exp, self.directory, batch_size=2)
+
+        self.assertEqual(3, archive.enrollments)
+        self.assertEqual(0, archive.goal_records)
+        self.assertFalse(Enrollment.objects.filter(experiment=self.exp))
+        self.assertEqual(3, GoalRecord.objects.count())
+        self.assertEqual(1, Enrollment.objects.count())
+
+        enrollments_path, goal_records_path = get_archive_paths(
+            self.directory, self.exp)
+        with gzip.open(enrollments_path) as f:
+            self.assertEqual(3, len(f.readlines()))
+
+        # the reports are generated from the frozen numbers
+        self.assertEqual([[2, 1], [2, 1]], before)
+        self.assertEqual(before, counts(self.report.generate()))
+
+    def test_move_goal_records(self):
+        archive = archive_experiment(self.exp, self.directory, batch_size=2,
+                                     move_goal_records=True)
+
+        self.assertEqual(2, archive.goal_records)
+        # the last subject is still enrolled in another experiment
+        self.assertEqual(self.subjects[2], GoalRecord.objects.get().subject)
+
+        enrollments_path, goal_records_path = get_archive_paths(
+            self.directory, self.exp)
+        with gzip.open(goal_records_path) as f:
+            self.assertEqual(2, len(f.readlines()))
+
+    def test_resume(self):
+        archive_experiment(self.exp, self.directory)
+        archive = archive_experiment(self.exp, self.directory)
+
+        self.assertEqual(3, archive.enrollments)
+        self.assertEqual(1, ExperimentArchive.objects.count())
@@ -0,0 +1,157 @@
+import threading
+import time
+from unittest import TestCase as SimpleTestCase
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from mock import MagicMock, patch
+
+from splango import SPLANGO_GOALS, RequestExperimentManager
+from splango.background import BackgroundWriter
+from splango.models import Enrollment, GoalRecord, Subject, goal_name_cache
+from splango.tests import create_experiment, create_subject, create_variant
+
+
+class BackgroundWriterTest(SimpleTestCase):
+
+    def test_jobs_run_in_order(self):
+        writer = BackgroundWriter()
+        done = []
+        jobs = [writer.submit(done.append, i) for i in range(10)]
+        writer.join()
+
+        self.assertEqual(range(10), done)
+        self.assertTrue(all(job.done() for job in jobs))
+
+    def test_failed_job(self):
+        writer = BackgroundWriter()
+        job = writer.submit(int, "not a number")
+
+        self.assertTrue(job.wait(5))
+        self.assertIsInstance(job.exception, ValueError)
+
+    def test_full_queue_runs_synchronously(self):
+        writer = BackgroundWriter(queue_size=1)
+        writer._ensure_thread = MagicMock()  # nothing takes the jobs
+        done = []
+
+        queued = writer.submit(done.append, 1)
+        job = writer.submit(done.append, 2)
+
+        self.assertFalse(queued.done())
+        self.assertTrue(job.done())
+        self.assertEqual([2], done)
+
+    def test_wait_pending(self):
+        writer = BackgroundWriter()
+        done = []
+        writer.submit(lambda: time.sleep(0.1) or done.append(1))
+
+        self.assertTrue(writer.wait_pending())
+        self.assertEqual([1], done)
+
+    def test_wait_pending_timeout(self):
+        writer = BackgroundWriter()
+        release = threading.Event()
+        writer.submit(release.wait)
+
+        self.assertFalse(writer.wait_pending(0.05))
+        release.set()
+        self.assertTrue(writer.wait_pending(5))
+
+
+@override_settings(SPLANGO_BACKGROUND_WRITES=True)
+class BackgroundWritesTest(TestCase):
+
+    def setUp(self):
+        # the assignments of subjects of previous tests are cached
+        cache.clear()
+        goal_name_cache.clear()
+        self.experiment = create_experiment(name="background")
+        create_variant(name=u"variant 1", experiment=self.experiment)
+        create_variant(name=u"variant 2", experiment=self.experiment)
+        self.subject = create_subject()
+
+    def test_flush_is_deferred(self):
+        request = RequestFactory().get('/')
+        request.session = {}
+        exp_man = RequestExperimentManager(request)
+        exp_man.get_subject = MagicMock(return_value=self.subject)
+        writer = MagicMock()
+
+        with patch("splango.background.get_writer", return_value=writer):
+            variant = exp_man.declare_and_enroll(
+                self.experiment.name, [u"variant 1", u"variant 2"])
+            exp_man.log_goal("background.goal")
+            exp_man.flush()
+
+        self.assertEqual(self.experiment.get_stable_variant(self.subject),
+                         variant)
+        self.assertFalse(Enrollment.objects.exists())
+        self.assertFalse(exp_man.queued_actions)
+
+        # run the job the writer was given
+        func, subject, actions = writer.submit.call_args[0]
+        func(subject, actions)
+        self.assertEqual(variant, Enrollment.objects.get().variant)
+        self.assertEqual(1, GoalRecord.objects.count())
+
+    def test_goals_remembered_once_written(self):
+        request = RequestFactory().get('/')
+        request.session = {}
+        exp_man = RequestExperimentManager(request)
+        exp_man.get_subject = MagicMock(return_value=self.subject)
+        writer = MagicMock()
+
+        with patch("splango.background.get_writer", return_value=writer):
+            exp_man.log_goal("background.goal")
+            exp_man.flush()
+            exp_man.log_goal("background.goal")
+            exp_man.flush()
+
+        # the first write may fail: the goal is queued again
+        self.assertEqual(2, writer.submit.call_count)
+        self.assertNotIn(SPLANGO_GOALS, request.session)
+
+    def test_login_waits_for_pending_writes(self):
+        user = User.objects.create(username="background")
+        Subject.objects.create(registered_as=user)
+        request = RequestFactory().get('/')
+        request.session = {}
+        exp_man = RequestExperimentManager(request)
+        writer = MagicMock()
+        # the queued writes of the anonymous subject run before the merge
+        writer.wait_pending.side_effect = lambda: self.assertTrue(
+            Subject.objects.filter(pk=self.subject.pk).exists())
+
+        with patch("splango.background.get_writer", return_value=writer):
+            exp_man.register_subject(user, self.subject)
+
+        self.assertTrue(writer.wait_pending.called)
+        self.assertFalse(Subject.objects.filter(pk=self.subject.pk).exists())
+
+    def test_write_after_merge_elsewhere(self):
+        request = RequestFactory().get('/')
+        request.session = {}
+        exp_man = RequestExperimentManager(request)
+        exp_man.get_subject = MagicMock(return_value=self.subject)
+        writer = MagicMock()
+
+        with patch("splango.background.get_writer", return_value=writer):
+            exp_man.declare_and_enroll(
+                self.experiment.name, [u"variant 1", u"variant 2"])
+            exp_man.log_goal("background.goal")
+            exp_man.flush()
+        # a login served by another process merges the subject
+        user = User.objects.create(username="background")
+        merged_into = Subject.objects.create(registered_as=user)
+        Subject.objects.get(pk=self.subject.pk).merge_into(merged_into)
+
+        func, subject, actions = writer.submit.call_args[0]
+        func(subject, actions)
+
+        self.assertEqual(merged_into.pk, Enrollment.objects.get().subject_id)
+        self.assertEqual(merged_into.pk, GoalRecord.objects.get().subject_id)
@@ -0,0 +1,50 @@
+from django.db import connection
+from django.test.utils import override_settings
+from mock import patch
+
+from splango.budget import QueryBudget, QueryBudgetExceeded
+from splango.models import Subject
+
+from .test_middleware import MiddlewareTestCase
+
+
+class QueryBudgetTest(MiddlewareTestCase):
+
+    def test_attribution(self):
+        budget = QueryBudget(10)
+        with budget.track("outer"):
+            Subject.objects.count()
+            with budget.track("inner"):
+                Subject.objects.count()
+                Subject.objects.count()
+
+        self.assertEqual({"outer": 1, "inner": 2}, budget.counts)
+        self.assertEqual(3, budget.get_total())
+        self.assertEqual(None, connection.use_debug_cursor)
+
+    def test_disabled(self):
+        budget = QueryBudget(None)
+        with budget.track("outer"):
+            Subject.objects.count()
+
+        self.assertEqual({}, budget.counts)
+
+    @override_settings(SPLANGO_QUERY_BUDGET=100)
+    def test_within_budget(self):
+        with patch("splango.budget.logger") as logger:
+            self.client.get('/many/')
+
+        self.assertFalse(logger.warning.called)
+
+    @override_settings(SPLANGO_QUERY_BUDGET=3)
+    def test_warn(self):
+        with patch("splango.budget.logger") as logger:
+            self.client.get('/many/')
+
+        msg = logger.warning.call_args[0][0]
+        self.assertIn("during GET /many/", msg)
+        self.assertIn("experiment:item_exp_4=", msg)
+
+    @override_settings(SPLANGO_QUERY_BUDGET=3, SPLANGO_QUERY_BUDGET_RAISE=True)
+    def test_raise(self):
+        self.assertRaises(QueryBudgetExceeded, self.client.get, '/many/')
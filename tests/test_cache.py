@@ -0,0 +1,102 @@
+import warnings
+
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.test import TestCase
+
+from splango.cache import VersionedCache
+from splango.models import Experiment
+from splango.tests import create_subject
+
+
+class VersionedCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.cache = VersionedCache("test")
+
+    def test_get_set(self):
+        value, version = self.cache.get("key")
+        self.assertIsNone(value)
+        self.cache.set("key", "value", version)
+
+        self.assertEqual("value", self.cache.get("key")[0])
+        self.assertEqual(0.5, self.cache.get_hit_ratio())
+
+    def test_bump(self):
+        value, version = self.cache.get("key")
+        self.cache.set("key", "value", version)
+        self.cache.bump("key")
+
+        self.assertIsNone(self.cache.get("key")[0])
+
+    def test_stale_set_is_discarded(self):
+        self.cache.set("key", "old", self.cache.get("key")[1])
+        value, version = self.cache.get("key")
+        self.cache.bump("key")  # changed while the value was computed
+        self.cache.set("key", "stale", version)
+
+        self.assertIsNone(self.cache.get("key")[0])
+
+    def test_bump_before_first_set(self):
+        value, version = self.cache.get("key")
+        self.cache.bump("key")
+        self.cache.set("key", "stale", version)
+
+        self.assertIsNone(self.cache.get("key")[0])
+
+    def test_memcached_safe_keys(self):
+        name = u"caf\xe9 " * 60
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", CacheKeyWarning)
+            self.cache.set(name, "value", self.cache.get(name)[1])
+            self.cache.bump(name)
+
+        self.assertIsNone(self.cache.get(name)[0])
+
+
+class ModelCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_declare(self):
+        Experiment.declare("cached", ["a", "b"])
+
+        with self.assertNumQueries(0):
+            exp = Experiment.declare("cached", ["a", "b"])
+        self.assertEqual(["a", "b"], [v.name for v in exp.get_variants()])
+
+    def test_declare_name_with_space(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", CacheKeyWarning)
+            Experiment.declare("Signup button", ["a", "b"])
+
+            with self.assertNumQueries(0):
+                Experiment.declare("Signup button", ["a", "b"])
+
+    def test_declare_new_variant(self):
+        Experiment.declare("cached", ["a", "b"])
+        exp = Experiment.declare("cached", ["a", "b", "c"])
+
+        self.assertEqual(["a", "b", "c"],
+                         [v.name for v in exp.get_variants()])
+
+    def test_enrollment(self):
+        exp = Experiment.declare("cached", ["a", "b"])
+        subject = create_subject()
+        variant = exp.get_or_create_enrollment(subject).variant
+
+        with self.assertNumQueries(0):
+            enrollment = exp.get_or_create_enrollment(subject)
+        self.assertEqual(variant, enrollment.variant)
+
+    def test_enrollments_invalidated_on_merge(self):
+        exp = Experiment.declare("cached", ["a", "b"])
+        subject, other = create_subject(), create_subject()
+        variant = exp.get_or_create_enrollment(subject).variant
+        self.assertEqual({}, other.get_assignments())
+
+        subject.merge_into(other)
+
+        self.assertEqual({"cached": variant.pk}, other.get_assignments())
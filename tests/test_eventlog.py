@@ -0,0 +1,199 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from splango import eventlog
+from splango.models import Enrollment, GoalRecord
+from splango.tests import (
+    create_enrollment, create_experiment, create_experiment_report,
+    create_goal, create_goal_record, create_subject, create_variant)
+
+
+class EventLogTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.writer = eventlog.EventLogWriter(self.directory)
+
+        self.exp = create_experiment()
+        self.variant1 = create_variant(name='variant1', experiment=self.exp)
+        self.variant2 = create_variant(name='variant2', experiment=self.exp)
+        self.report = create_experiment_report(experiment=self.exp,
+                                               funnel="signup\npaid\n")
+        self.subjects = [create_subject() for _ in range(4)]
+        self.goals = dict((name, create_goal(name=name))
+                          for name in ('signup', 'paid'))
+
+    def tearDown(self):
+        self.writer.close()
+        shutil.rmtree(self.directory)
+
+    def test_records_roundtrip(self):
+        subject = self.subjects[0]
+        self.writer.append_enrollment(subject.pk, self.exp.name,
+                                      self.variant1.pk, timestamp=10.0)
+        self.writer.append_goal(subject.pk, u'sign\xfcp', timestamp=20.0)
+        self.writer.close()
+
+        paths = eventlog.get_segment_paths(self.directory)
+        self.assertEqual(1, len(paths))
+        self.assertTrue(paths[0].endswith(eventlog.SEGMENT_SUFFIX))
+        self.assertEqual(
+            [(eventlog.KIND_ENROLLMENT, 10.0, subject.pk, self.exp.name,
+              self.variant1.pk),
+             (eventlog.KIND_GOAL, 20.0, subject.pk, u'sign\xfcp', 0)],
+            list(eventlog.iter_records(paths[0])))
+
+    def test_rotation(self):
+        writer = eventlog.EventLogWriter(self.directory,
+                                         segment_size=eventlog.RECORD.size)
+        writer.append_goal(self.subjects[0].pk, 'signup')
+        writer.flush()
+        writer.append_goal(self.subjects[1].pk, 'signup')
+        writer.flush()
+
+        self.assertEqual(2, len(eventlog.get_segment_paths(
+            self.directory, include_open=False)))
+
+    def test_rotation_by_age(self):
+        writer = eventlog.EventLogWriter(self.directory, segment_age=0.1)
+        writer.append_goal(self.subjects[0].pk, 'signup')
+        timer = writer._timer
+        writer.flush()
+        timer.join()
+
+        path, = eventlog.get_segment_paths(self.directory)
+        self.assertTrue(path.endswith(eventlog.SEGMENT_SUFFIX))
+        # the next event opens a new segment
+        writer.append_goal(self.subjects[1].pk, 'signup')
+        writer.close()
+        self.assertEqual(2, len(eventlog.get_segment_paths(
+            self.directory, include_open=False)))
+
+    def test_close_orphaned_segments(self):
+        self.writer.append_goal(self.subjects[0].pk, 'signup')
+        self.writer.flush()
+        # a segment of a process that died
+        dead = os.path.join(self.directory, "0000000000001-9999999-00001" +
+                            eventlog.OPEN_SUFFIX)
+        shutil.copy(self.writer._file.name, dead)
+
+        closed = eventlog.close_orphaned_segments(self.directory)
+
+        self.assertEqual([dead[:-len(eventlog.OPEN_SUFFIX)] +
+                          eventlog.SEGMENT_SUFFIX], closed)
+        # this process' segment is left open
+        self.assertEqual(closed, eventlog.get_segment_paths(
+            self.directory, include_open=False))
+
+    def _log_and_record(self, subject, variant, goals):
+        self.writer.append_enrollment(subject.pk, self.exp.name, variant.pk)
+        create_enrollment(subject=subject, variant=variant,
+                          experiment=self.exp)
+        for goal_name in goals:
+            self.writer.append_goal(subject.pk, goal_name)
+            create_goal_record(subject=subject, goal=self.goals[goal_name])
+
+    def test_generate_matches_database_report(self):
+        s1, s2, s3, s4 = self.subjects
+        self._log_and_record(s1, self.variant1, ['signup', 'paid'])
+        self._log_and_record(s2, self.variant1, ['signup'])
+        self._log_and_record(s3, self.variant2, [])
+        self._log_and_record(s4, self.variant2, ['signup'])
+        # a second enrollment of the same subject does not count
+        self.writer.append_enrollment(s1.pk, self.exp.name, self.variant2.pk)
+        self.writer.flush()
+
+        def counts(rows):
+            return [[c["val"] for c in row["variant_counts"]] for row in rows]
+
+        from_log = eventlog.EventLogReader(self.directory).generate(
+            self.report)
+        self.assertEqual(counts(self.report.generate()), counts(from_log))
+        self.assertEqual([[2, 2], [2, 1], [1, 0]], counts(from_log))
+
+    def test_load_segment(self):
+        s1, s2, s3, _ = self.subjects
+        create_enrollment(subject=s1, variant=self.variant2,
+                          experiment=self.exp)
+        self.writer.append_enrollment(s1.pk, self.exp.name, self.variant1.pk,
+                                      timestamp=1000000000.0)
+        self.writer.append_enrollment(s2.pk, self.exp.name, self.variant1.pk,
+                                      timestamp=1000000000.0)
+        self.writer.append_goal(s2.pk, 'signup', timestamp=1000000000.0)
+        self.writer.append_goal(s2.pk, 'signup', timestamp=1000000001.0)
+        s3_pk = s3.pk
+        s3.delete()
+        self.writer.append_goal(s3_pk, 'signup')
+        self.writer.close()
+
+        path = eventlog.get_segment_paths(self.directory)[0]
+        self.assertEqual((1, 1), eventlog.load_segment(path))
+
+        # the existing enrollment was kept
+        self.assertEqual(self.variant2, Enrollment.objects.get(
+            subject=s1, experiment=self.exp).variant)
+        enrollment = Enrollment.objects.get(subject=s2, experiment=self.exp)
+        self.assertEqual(self.variant1, enrollment.variant)
+        self.assertEqual(2001, enrollment.created.year)
+        self.assertEqual(1, GoalRecord.objects.filter(
+            subject=s2, goal__name='signup').count())
+
+    def test_load_segment_merged_subjects(self):
+        s1, s2, s3, s4 = self.subjects
+        create_enrollment(subject=s1, variant=self.variant2,
+                          experiment=self.exp)
+        # s3 and s4 were anonymous, and logged in as s2 and s1
+        for subject in (s3, s4):
+            self.writer.append_enrollment(subject.pk, self.exp.name,
+                                          self.variant1.pk)
+            self.writer.append_goal(subject.pk, 'signup')
+        self.writer.append_merge(s3.pk, s2.pk)
+        self.writer.append_merge(s4.pk, s1.pk)
+        merged = {s3.pk: s2.pk, s4.pk: s1.pk}
+        s3.delete()
+        s4.delete()
+        self.writer.close()
+
+        path, = eventlog.get_segment_paths(self.directory)
+        merged_into = eventlog.get_merges(self.directory)
+        self.assertEqual(merged, merged_into)
+        self.assertEqual((1, 2), eventlog.load_segment(
+            path, merged_into=merged_into))
+
+        self.assertEqual(self.variant1, Enrollment.objects.get(
+            subject=s2, experiment=self.exp).variant)
+        # the enrollment of the registered subject was kept
+        self.assertEqual(self.variant2, Enrollment.objects.get(
+            subject=s1, experiment=self.exp).variant)
+        self.assertEqual(2, GoalRecord.objects.filter(
+            subject__in=[s1, s2], goal__name='signup').count())
+
+    def test_generate_merged_subjects(self):
+        s1, s2, _, _ = self.subjects
+        self.writer.append_enrollment(s2.pk, self.exp.name, self.variant1.pk)
+        self.writer.append_goal(s2.pk, 'signup')
+        self.writer.append_enrollment(s1.pk, self.exp.name, self.variant2.pk)
+        self.writer.append_merge(s2.pk, s1.pk)
+        self.writer.flush()
+
+        variant_of, goals_of = eventlog.EventLogReader(
+            self.directory).collect(self.exp.name, ['signup'])
+
+        self.assertEqual({s1.pk: self.variant2.pk}, variant_of)
+        self.assertEqual({s1.pk: set(['signup'])}, dict(goals_of))
+
+    def test_keep_merges(self):
+        self.writer.append_goal(self.subjects[0].pk, 'signup')
+        self.writer.append_merge(self.subjects[0].pk, self.subjects[1].pk)
+        self.writer.close()
+        os.makedirs(os.path.join(self.directory, eventlog.COMPACTED_DIR))
+
+        path, = eventlog.get_segment_paths(self.directory)
+        eventlog.keep_merges(path, self.directory)
+        os.remove(path)
+
+        self.assertEqual({self.subjects[0].pk: self.subjects[1].pk},
+                         eventlog.get_merges(self.directory))
@@ -1,10 +1,14 @@
 # coding: utf-8
+import threading
+import time
 from unittest import TestCase
 
+from django.test import TestCase as DjangoTestCase
 from mock import MagicMock
 
-from splango import RequestExperimentManager
-from splango.models import (Variant, Subject)
+from splango import SPLANGO_SUBJECT, RequestExperimentManager
+from splango.models import Enrollment, Experiment, Variant, Subject
+from splango.registry import ExperimentRegistry, registry
 from splango.tests import create_experiment, create_subject, create_variant
 
 
@@ -27,7 +31,7 @@ class ExperimentManagerTest(TestCase):
 
         # RequestExperimentManager needs a request as a param.
         # Lets do a mock for the request.
-        request = MagicMock()
+        request = MagicMock(session={})
 
         # Lets instanciate :class:``splango.RequestExperimentManager`` now.
         exp_man = RequestExperimentManager(request)
@@ -50,3 +54,101 @@ class ExperimentManagerTest(TestCase):
         variant = exp_man.declare_and_enroll(self.experiment.name,
                                              self.variant_names, )
         self.assertIsInstance(variant, Variant)
+
+
+class ExperimentStateTest(DjangoTestCase):
+
+    def setUp(self):
+        self.experiment = create_experiment(name="states")
+        self.variant1 = create_variant(name=u"variant 1",
+                                       experiment=self.experiment)
+        self.variant2 = create_variant(name=u"variant 2",
+                                       experiment=self.experiment)
+        self.variant_names = [self.variant1.name, self.variant2.name]
+
+    def tearDown(self):
+        registry.clear()
+
+    def _declare_and_enroll(self, subject=None):
+        exp_man = RequestExperimentManager(MagicMock(session={}))
+        exp_man.get_subject = MagicMock(name="Subject")
+        exp_man.get_subject.return_value = subject or create_subject()
+        return exp_man.declare_and_enroll(self.experiment.name,
+                                          self.variant_names)
+
+    def test_concluded_without_db_access(self):
+        self.experiment.state = Experiment.CONCLUDED
+        self.experiment.winner = self.variant2
+        self.experiment.save()
+        subject = create_subject()
+        # load the registry
+        self._declare_and_enroll(subject)
+
+        with self.assertNumQueries(0):
+            variant = self._declare_and_enroll(subject)
+        self.assertEqual(self.variant2, variant)
+        self.assertFalse(Enrollment.objects.exists())
+
+    def test_paused(self):
+        self.experiment.state = Experiment.PAUSED
+        self.experiment.save()
+
+        self.assertEqual(self.variant1, self._declare_and_enroll())
+        self.assertFalse(Enrollment.objects.exists())
+
+    def test_running(self):
+        self._declare_and_enroll()
+
+        self.assertEqual(1, Enrollment.objects.count())
+
+
+class ExperimentRegistryTest(TestCase):
+
+    def test_loaded_once_when_stale(self):
+        experiments = ExperimentRegistry(ttl=60)
+        experiments.load = MagicMock(return_value={})
+        threads = [threading.Thread(target=experiments.get_fixed_variant,
+                                    args=("states",)) for i in range(5)]
+
+        # every thread sees the registry stale, then waits for the lock
+        with experiments._lock:
+            for thread in threads:
+                thread.start()
+            time.sleep(0.1)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, experiments.load.call_count)
+
+
+class EnrollmentMapTest(DjangoTestCase):
+
+    def setUp(self):
+        self.experiment = create_experiment(name="mapped")
+        create_variant(name=u"variant 1", experiment=self.experiment)
+        create_variant(name=u"variant 2", experiment=self.experiment)
+        self.variant_names = [u"variant 1", u"variant 2"]
+        self.session = {}
+
+    def tearDown(self):
+        registry.clear()
+
+    def _declare_and_enroll(self):
+        request = MagicMock(session=self.session)
+        exp_man = RequestExperimentManager(request)
+        return exp_man.declare_and_enroll(self.experiment.name,
+                                          self.variant_names)
+
+    def test_returning_visitor_runs_no_query(self):
+        variant = self._declare_and_enroll()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(variant, self._declare_and_enroll())
+        self.assertEqual(variant.name, self._declare_and_enroll().name)
+
+    def test_new_subject_forgets_enrollments(self):
+        self._declare_and_enroll()
+        del self.session[SPLANGO_SUBJECT]
+        self._declare_and_enroll()
+
+        self.assertEqual(2, Enrollment.objects.count())
@@ -0,0 +1,66 @@
+from django.core.cache import cache
+from django.http import Http404
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from splango import metrics, views
+from splango.models import goal_name_cache
+
+
+@override_settings(SPLANGO_METRICS=True, INTERNAL_IPS=['127.0.0.1'])
+class MetricsTest(TestCase):
+
+    urls = 'tests.urls'
+
+    def setUp(self):
+        cache.clear()
+        goal_name_cache.clear()
+        metrics.collector.reset()
+        metrics._sinks = None
+
+    def tearDown(self):
+        metrics._sinks = None
+
+    def test_render(self):
+        self.client.get('/experiment/')
+        response = self.client.get('/splango/metrics/')
+
+        self.assertContains(
+            response,
+            'splango_declare_and_enroll_seconds_count'
+            '{experiment="page_exp"} 1')
+        self.assertContains(response, 'splango_finish_seconds_count 1')
+        self.assertContains(
+            response,
+            'splango_process_action_seconds_count{action="log_goal"} 1')
+        self.assertContains(response,
+                            'splango_queued_actions_bucket{le="1"} 1')
+
+    @override_settings(SPLANGO_METRICS=False)
+    def test_disabled(self):
+        self.client.get('/experiment/')
+
+        self.assertEqual({}, metrics.collector.histograms)
+        request = RequestFactory().get('/splango/metrics/')
+        self.assertRaises(Http404, views.metrics_text, request)
+
+    def test_forbidden(self):
+        response = self.client.get('/splango/metrics/',
+                                   REMOTE_ADDR='10.0.0.1')
+
+        self.assertEqual(403, response.status_code)
+
+    @override_settings(SPLANGO_METRICS_SINKS=['splango.metrics.signal_sink'])
+    def test_signal_sink(self):
+        received = []
+
+        def receiver(sender, **kwargs):
+            received.append((kwargs['kind'], kwargs['name']))
+        metrics.metric_recorded.connect(receiver)
+        try:
+            self.client.get('/experiment/')
+        finally:
+            metrics.metric_recorded.disconnect(receiver)
+
+        self.assertIn(('histogram', 'splango_finish_seconds'), received)
@@ -0,0 +1,302 @@
+import re
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase as SimpleTestCase
+
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from mock import MagicMock, patch
+
+from splango import (SPLANGO_GOALS, SPLANGO_SUBJECT, RequestExperimentManager,
+                     eventlog)
+from splango.bots import BotClassifier
+from splango.models import (Enrollment, Experiment, GoalRecord, Subject,
+                            goal_name_cache)
+from splango.tests import create_subject
+
+GOOGLEBOT = ('Mozilla/5.0 (compatible; Googlebot/2.1; '
+             '+http://www.google.com/bot.html)')
+FIREFOX = ('Mozilla/5.0 (X11; Linux x86_64; rv:20.0) Gecko/20100101 '
+           'Firefox/20.0')
+
+
+class MiddlewareTestCase(TestCase):
+
+    urls = 'tests.urls'
+
+    def setUp(self):
+        # the versioned caches would return enrollments of previous tests,
+        # and the goal name cache their goals
+        cache.clear()
+        goal_name_cache.clear()
+
+
+@override_settings(SPLANGO_VERIFY_HUMANS=True)
+class HumanVerificationTest(MiddlewareTestCase):
+
+    def _get_token(self, response):
+        match = re.search(r'pending.push\("([^"]+)"\)', response.content)
+        self.assertTrue(match)
+        return match.group(1)
+
+    def test_unverified_client_writes_nothing(self):
+        response = self.client.get('/experiment/')
+
+        self.assertContains(response, 'splango.pending')
+        self.assertTrue(response.content.endswith('</script></BODY></html>'))
+        self.assertFalse(Subject.objects.exists())
+        self.assertFalse(Enrollment.objects.exists())
+        self.assertFalse(GoalRecord.objects.exists())
+        self.assertFalse(Session.objects.exists())
+
+    def test_streamed_response(self):
+        # the content of an iterator response can only be read once
+        content = self.client.get('/streamed/').content
+
+        self.assertTrue(content.startswith('<html><body>'))
+        self.assertTrue(content.endswith('</script></body></html>'))
+
+    def test_no_beacon_without_pending_actions(self):
+        response = self.client.get('/plain/')
+
+        self.assertNotContains(response, 'splango.pending')
+
+    def test_confirm(self):
+        token1 = self._get_token(self.client.get('/experiment/'))
+        token2 = self._get_token(self.client.get('/experiment/'))
+
+        response = self.client.post('/splango/confirm/',
+                                    {'t': [token1, token2, 'forged']})
+
+        self.assertEqual(204, response.status_code)
+        self.assertEqual(1, Subject.objects.count())
+        self.assertEqual(1, Enrollment.objects.count())
+        self.assertEqual(1, GoalRecord.objects.count())
+
+        # verified clients are tracked right away
+        response = self.client.get('/experiment/')
+        self.assertNotContains(response, 'splango.pending')
+        self.assertEqual(1, Enrollment.objects.count())
+
+    def test_variant_kept_until_confirmed(self):
+        Experiment.declare('page_exp', ['a', 'b'])
+        tokens, variants = [], set()
+        for i in range(10):
+            response = self.client.get('/experiment/')
+            tokens.append(self._get_token(response))
+            variants.add(re.search(r'<body>(\w+)', response.content).group(1))
+
+        self.client.post('/splango/confirm/', {'t': tokens})
+
+        self.assertEqual(1, len(variants))
+        self.assertEqual(variants.pop(), Enrollment.objects.get().variant.name)
+
+    @override_settings(SPLANGO_EXCLUDE_PATHS=['/splango/'])
+    def test_confirm_on_untracked_path(self):
+        token = self._get_token(self.client.get('/experiment/'))
+
+        response = self.client.post('/splango/confirm/', {'t': [token]})
+
+        self.assertEqual(204, response.status_code)
+        self.assertEqual(1, Enrollment.objects.count())
+        self.assertEqual(1, GoalRecord.objects.count())
+
+    def test_confirm_from_bot_user_agent(self):
+        token = self._get_token(self.client.get('/experiment/'))
+
+        self.client.post('/splango/confirm/', {'t': [token]},
+                         HTTP_USER_AGENT=GOOGLEBOT)
+
+        self.assertEqual(1, Enrollment.objects.count())
+
+
+class BotClassifierTest(SimpleTestCase):
+
+    def test_is_bot(self):
+        classifier = BotClassifier()
+
+        self.assertTrue(classifier.is_bot(GOOGLEBOT))
+        self.assertTrue(classifier.is_bot('curl/7.29.0'))
+        self.assertFalse(classifier.is_bot(FIREFOX))
+        self.assertFalse(classifier.is_bot(''))
+
+    def test_cache_is_bounded(self):
+        classifier = BotClassifier(patterns=['bot'], cache_size=2)
+        for user_agent in ['a', 'b', 'bot', 'a']:
+            classifier.is_bot(user_agent)
+
+        self.assertEqual(['bot', 'a'], list(classifier._cache))
+
+
+class BotDetectionTest(MiddlewareTestCase):
+
+    def test_bot_gets_control_variant(self):
+        response = self.client.get('/experiment/', HTTP_USER_AGENT=GOOGLEBOT)
+
+        self.assertContains(response, '<body>a</BODY>')
+        self.assertFalse(Subject.objects.exists())
+        self.assertFalse(GoalRecord.objects.exists())
+
+    def test_browser_is_tracked(self):
+        self.client.get('/experiment/', HTTP_USER_AGENT=FIREFOX)
+
+        self.assertEqual(1, Enrollment.objects.count())
+        self.assertEqual(1, GoalRecord.objects.count())
+
+
+class PathExclusionTest(MiddlewareTestCase):
+
+    @override_settings(SPLANGO_EXCLUDE_PATHS=['/exp'])
+    def test_excluded(self):
+        response = self.client.get('/experiment/')
+
+        self.assertContains(response, '<body>a</BODY>')
+        self.assertFalse(Subject.objects.exists())
+
+    @override_settings(SPLANGO_INCLUDE_PATHS=['/plain/'])
+    def test_not_included(self):
+        self.client.get('/experiment/')
+
+        self.assertFalse(Subject.objects.exists())
+
+    @override_settings(SPLANGO_INCLUDE_PATHS=['/', '/experiment/'],
+                       SPLANGO_EXCLUDE_PATHS=['/e'])
+    def test_longest_prefix_wins(self):
+        self.client.get('/experiment/')
+
+        self.assertEqual(1, Enrollment.objects.count())
+
+
+class LazyManagerTest(MiddlewareTestCase):
+
+    def test_untouched_manager_runs_no_query(self):
+        with self.assertNumQueries(0):
+            self.client.get('/plain/')
+
+        self.assertFalse(Subject.objects.exists())
+
+    def test_subject_registered_when_manager_is_used(self):
+        user = User.objects.create_user('john', 'john@example.com', 'pass')
+        self.client.login(username='john', password='pass')
+        self.client.get('/plain/')
+        self.assertFalse(Subject.objects.exists())
+
+        self.client.get('/experiment/')
+        self.client.get('/experiment/')
+
+        subject = Subject.objects.get()
+        self.assertEqual(user, subject.registered_as)
+        self.assertEqual(1, Enrollment.objects.count())
+
+
+class EventLogLoginTest(MiddlewareTestCase):
+
+    def setUp(self):
+        super(EventLogLoginTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        eventlog._writer = None
+
+    def tearDown(self):
+        if eventlog._writer is not None:
+            eventlog._writer.close()
+            eventlog._writer = None
+        shutil.rmtree(self.directory)
+
+    def test_events_of_merged_subject_are_compacted(self):
+        user = User.objects.create_user('john', 'john@example.com', 'pass')
+        registered = Subject.get_or_create_for_user(user)
+        with override_settings(SPLANGO_STORAGE="eventlog",
+                               SPLANGO_EVENTLOG_DIR=self.directory):
+            self.client.get('/experiment/')
+            anonymous_id = self.client.session[SPLANGO_SUBJECT].pk
+            self.client.login(username='john', password='pass')
+            # a page that neither enrolls in page_exp nor logs page.seen
+            self.client.get('/many/')
+
+            self.assertEqual({anonymous_id: registered.pk},
+                             eventlog.get_merges(self.directory))
+            eventlog.get_writer().close()
+            call_command('splango_compact_eventlog', stdout=StringIO())
+
+        self.assertFalse(Subject.objects.filter(pk=anonymous_id).exists())
+        self.assertEqual(1, registered.enrollment_set.filter(
+            experiment='page_exp').count())
+        self.assertEqual(['page.seen'], [
+            r.goal_id for r in registered.goalrecord_set.all()])
+
+
+@override_settings(SPLANGO_FIRST_VISIT_GOAL='firstvisit')
+class FirstVisitTest(MiddlewareTestCase):
+
+    def test_first_visit(self):
+        self.client.get('/plain/')
+
+        self.assertEqual('firstvisit', GoalRecord.objects.get().goal_id)
+
+    def test_repeat_visit_runs_no_query(self):
+        self.client.get('/plain/')
+
+        with self.assertNumQueries(0):
+            self.client.get('/plain/')
+        self.assertEqual(1, GoalRecord.objects.count())
+
+    def test_internal_referer(self):
+        self.client.get('/plain/', HTTP_REFERER='http://testserver/')
+
+        self.assertFalse(GoalRecord.objects.exists())
+
+    def test_not_a_page(self):
+        self.client.get('/plain/json/')
+        self.client.post('/plain/')
+
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(GoalRecord.objects.exists())
+
+    @override_settings(SPLANGO_VERIFY_HUMANS=True)
+    def test_unverified_client_writes_nothing(self):
+        response = self.client.get('/plain/')
+
+        self.assertContains(response, 'splango.pending')
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(GoalRecord.objects.exists())
+
+
+class RecordedGoalsTest(MiddlewareTestCase):
+
+    def test_goal_is_recorded_once(self):
+        self.client.get('/experiment/')
+
+        with patch.object(GoalRecord, 'record') as record:
+            self.client.get('/experiment/')
+        self.assertFalse(record.called)
+        self.assertEqual(1, GoalRecord.objects.count())
+
+    def test_failed_write_is_not_remembered(self):
+        request = RequestFactory().get('/')
+        request.session = {}
+        exp_man = RequestExperimentManager(request)
+        exp_man.get_subject = MagicMock(return_value=create_subject())
+        exp_man.log_goal('signup')
+
+        with patch.object(GoalRecord, 'record', side_effect=DatabaseError):
+            self.assertRaises(DatabaseError, exp_man.flush)
+
+        self.assertNotIn(SPLANGO_GOALS, request.session)
+        exp_man.log_goal('signup')
+        exp_man.flush()
+        self.assertEqual(1, GoalRecord.objects.count())
+        self.assertEqual({'signup'}, request.session[SPLANGO_GOALS][1])
+
+    def test_new_subject_records_again(self):
+        self.client.get('/experiment/')
+        self.client.cookies.clear()
+        self.client.get('/experiment/')
+
+        self.assertEqual(2, GoalRecord.objects.count())
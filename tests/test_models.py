@@ -1,7 +1,22 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.query import QuerySet
 from django.db.utils import IntegrityError
 from django.test import TestCase
+from django.test.utils import override_settings
 
-from splango.models import Experiment, Subject, GoalRecord
+import datetime
+import tempfile
+import time
+from StringIO import StringIO
+
+from mock import patch
+
+from splango.models import (
+    ConversionRollup, Experiment, Goal, GoalNameCache, GoalRecord, Subject,
+    goal_name_cache)
 from splango.tests import (
     create_goal, create_goal_record, create_subject, create_enrollment,
     create_experiment, create_experiment_report, create_variant)
@@ -122,7 +137,31 @@ class GoalTest(TestCase):
 
 class SubjectTest(TestCase):
 
-    pass
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('jane', 'jane@example.com')
+
+    def test_user_mapping_is_cached(self):
+        subject = Subject.get_or_create_for_user(self.user)
+
+        with self.assertNumQueries(0):
+            cached = Subject.get_or_create_for_user(self.user)
+        self.assertEqual(subject.pk, cached.pk)
+
+    def test_user_mapping_invalidated_on_merge(self):
+        subject = Subject.get_or_create_for_user(self.user)
+        other = create_subject()
+        Subject.objects.get(pk=subject.pk).merge_into(other)
+
+        self.assertIsNone(Subject.get_id_for_user(self.user.pk))
+
+    def test_record_user_goal(self):
+        GoalRecord.record_user_goal(self.user, "paid")
+        GoalRecord.record_user_goal(self.user, "renewed")
+
+        subject = Subject.objects.get()
+        self.assertEqual(self.user, subject.registered_as)
+        self.assertEqual(2, subject.goalrecord_set.count())
 
 
 class GoalRecordTest(TestCase):
@@ -135,6 +174,132 @@ class GoalRecordTest(TestCase):
         self.assertRaises(
             IntegrityError, create_goal_record, goal=goal, subject=subject)
 
+    @override_settings(SPLANGO_ROLLUPS=True)
+    def test_record_user_goals(self):
+        goal_name_cache.clear()
+        known = User.objects.create_user('known', 'known@example.com')
+        new = User.objects.create_user('new', 'new@example.com')
+        subject = Subject.get_or_create_for_user(known)
+        create_goal_record(goal=create_goal(name='paid'), subject=subject)
+        exp = create_experiment()
+        variant = create_variant(name='variant1', experiment=exp)
+        create_enrollment(subject=subject, experiment=exp, variant=variant)
+        early = datetime.datetime(2013, 1, 1, 10)
+        late = datetime.datetime(2013, 1, 2, 10)
+
+        created = GoalRecord.record_user_goals([
+            (known.pk, 'paid', late),  # already reached
+            (known.pk, 'renewed', late),
+            (new.pk, 'paid', late),
+            (new.pk, 'paid', early),
+            (9999, 'paid', early),  # no such user
+        ])
+
+        self.assertEqual(2, created)
+        new_subject = Subject.objects.get(registered_as=new)
+        self.assertEqual(early, new_subject.goalrecord_set.get().created)
+        self.assertEqual(2, subject.goalrecord_set.count())
+        rollup = ConversionRollup.objects.get(goal='renewed', period='day')
+        self.assertEqual((variant.pk, 1), (rollup.variant_id, rollup.count))
+
+    def test_record_goals_command(self):
+        user = User.objects.create_user('jane', 'jane@example.com')
+        f = tempfile.NamedTemporaryFile(suffix='.csv')
+        f.write('%d,paid,1357034400\n%d,renewed,\n' % (user.pk, user.pk))
+        f.flush()
+
+        call_command('splango_record_goals', f.name, stdout=StringIO())
+
+        self.assertEqual(2, GoalRecord.objects.filter(
+            subject__registered_as=user).count())
+
+
+class GoalNameCacheTest(TestCase):
+
+    def setUp(self):
+        goal_name_cache.clear()
+
+    def tearDown(self):
+        goal_name_cache.clear()
+
+    def test_ensure(self):
+        names = GoalNameCache(size=2)
+        names.ensure("signup")
+
+        self.assertTrue(Goal.objects.filter(name="signup").exists())
+        with self.assertNumQueries(0):
+            names.ensure("signup")
+
+    def test_warm(self):
+        create_goal(name="existing")
+        names = GoalNameCache(size=2)
+        names.ensure("signup")
+
+        with self.assertNumQueries(0):
+            names.ensure("existing")
+
+    def test_bounded(self):
+        names = GoalNameCache(size=2)
+        for name in ("a", "b", "c"):
+            names.ensure(name)
+
+        self.assertEqual(["b", "c"], list(names._names))
+
+    def test_discarded_on_delete(self):
+        goal_name_cache.ensure("signup")
+        Goal.objects.get(name="signup").delete()
+        goal_name_cache.ensure("signup")
+
+        self.assertTrue(Goal.objects.filter(name="signup").exists())
+
+    def test_discarded_on_queryset_delete(self):
+        goal_name_cache.ensure("signup")
+        # as the admin's delete action does
+        Goal.objects.filter(name="signup").delete()
+
+        self.assertNotIn("signup", goal_name_cache._names)
+
+    def test_expires(self):
+        names = GoalNameCache(ttl=60)
+        names.ensure("signup")
+        # deleted by another process
+        Goal.objects.filter(name="signup").delete()
+
+        with patch("splango.models.time.time",
+                   return_value=time.time() + 61):
+            names.ensure("signup")
+
+        self.assertTrue(Goal.objects.filter(name="signup").exists())
+
+    def test_record_creates_deleted_goal(self):
+        subject = create_subject()
+        goal_name_cache.ensure("signup")
+        get_or_create = GoalRecord.objects.get_or_create
+        calls = []
+
+        def deleted_goal(**kwargs):
+            # another process deleted the goal after this one cached it
+            calls.append(kwargs)
+            if len(calls) == 1:
+                connection.cursor().execute("DELETE FROM splango_goal")
+                raise IntegrityError("foreign key constraint failed")
+            return get_or_create(**kwargs)
+
+        with patch.object(GoalRecord.objects, "get_or_create", deleted_goal):
+            GoalRecord.record(subject, "signup", {"req_REMOTE_ADDR": ""})
+
+        self.assertEqual(2, len(calls))
+        self.assertTrue(Goal.objects.filter(name="signup").exists())
+        self.assertEqual(1, GoalRecord.objects.count())
+
+    @override_settings(SPLANGO_ROLLUPS=False)
+    def test_record_does_not_query_goals(self):
+        subject = create_subject()
+        goal_name_cache.ensure("signup")
+
+        with self.assertNumQueries(2):  # look the record up, insert it
+            GoalRecord.record(subject, "signup", {"req_REMOTE_ADDR": ""})
+
 
 class EnrollmentTest(TestCase):
 
@@ -185,3 +350,121 @@ class ExperimentReportTest(TestCase):
 class VariantTest(TestCase):
 
     pass
+
+
+@override_settings(SPLANGO_ROLLUPS=True)
+class ConversionRollupTest(TestCase):
+
+    def setUp(self):
+        # django-cache-machine would return enrollments of previous tests
+        cache.clear()
+        self.exp = create_experiment()
+        self.variant1 = create_variant(name='variant1', experiment=self.exp)
+        self.variant2 = create_variant(name='variant2', experiment=self.exp)
+
+    def _count(self, variant, goal, period):
+        return sum(ConversionRollup.objects.filter(
+            experiment=self.exp, variant=variant, goal=goal,
+            period=period).values_list('count', flat=True))
+
+    def test_truncate(self):
+        value = datetime.datetime(2013, 3, 12, 15, 42, 7, 12)
+        self.assertEqual(
+            datetime.datetime(2013, 3, 12, 15),
+            ConversionRollup.truncate(value, ConversionRollup.HOUR))
+        self.assertEqual(
+            datetime.datetime(2013, 3, 12),
+            ConversionRollup.truncate(value, ConversionRollup.DAY))
+
+    def test_incremented_on_create(self):
+        subject1 = create_subject()
+        subject2 = create_subject()
+        # a goal reached before the enrollment counts too
+        GoalRecord.record(subject1, 'signup', {'req_REMOTE_ADDR': ''})
+        self.exp.get_or_create_enrollment(subject1, self.variant1)
+        self.exp.get_or_create_enrollment(subject1, self.variant2)
+        self.exp.get_or_create_enrollment(subject2, self.variant1)
+        GoalRecord.record(subject2, 'signup', {'req_REMOTE_ADDR': ''})
+        GoalRecord.record(subject2, 'signup', {'req_REMOTE_ADDR': ''})
+
+        enrolled = ConversionRollup.ENROLLMENTS
+        for period in (ConversionRollup.HOUR, ConversionRollup.DAY):
+            self.assertEqual(2, self._count(self.variant1, enrolled, period))
+            self.assertEqual(2, self._count(self.variant1, 'signup', period))
+            self.assertEqual(0, self._count(self.variant2, enrolled, period))
+
+    def test_merge(self):
+        kept, merged, moved = [create_subject() for i in range(3)]
+        self.exp.get_or_create_enrollment(kept, self.variant1)
+        GoalRecord.record(kept, 'signup', {'req_REMOTE_ADDR': ''})
+        for subject in (merged, moved):
+            self.exp.get_or_create_enrollment(subject, self.variant2)
+            GoalRecord.record(subject, 'signup', {'req_REMOTE_ADDR': ''})
+        other_exp = create_experiment(name='other')
+        other_variant = create_variant(name='other', experiment=other_exp)
+        other_exp.get_or_create_enrollment(moved, other_variant)
+
+        # the enrollments and goal records of merged are dropped
+        merged.merge_into(kept)
+        # the enrollment in other is moved, and counts the goal of kept
+        moved.merge_into(Subject.objects.get(pk=kept.pk))
+
+        enrolled = ConversionRollup.ENROLLMENTS
+        for period in (ConversionRollup.HOUR, ConversionRollup.DAY):
+            self.assertEqual(1, self._count(self.variant1, enrolled, period))
+            self.assertEqual(1, self._count(self.variant1, 'signup', period))
+            self.assertEqual(0, self._count(self.variant2, enrolled, period))
+            self.assertEqual(0, self._count(self.variant2, 'signup', period))
+        self.assertEqual(
+            {self.exp.name: {None: 1, 'signup': 1},
+             'other': {None: 1, 'signup': 1}},
+            Experiment.count_conversions([self.exp.name, 'other']))
+
+    def test_first_writes_race(self):
+        when = datetime.datetime(2013, 3, 12, 10)
+        ConversionRollup.increment(self.exp.pk, self.variant1.pk, None, when)
+        update = QuerySet.update
+        calls = []
+
+        def racing_update(queryset, **kwargs):
+            # the first update of each bucket misses the row another
+            # process inserts right after
+            calls.append(kwargs)
+            if len(calls) % 2:
+                return 0
+            return update(queryset, **kwargs)
+
+        with patch.object(QuerySet, 'update', racing_update):
+            ConversionRollup.increment(self.exp.pk, self.variant1.pk, None,
+                                       when)
+
+        self.assertEqual(4, len(calls))
+        for period in (ConversionRollup.HOUR, ConversionRollup.DAY):
+            self.assertEqual(1, ConversionRollup.objects.filter(
+                period=period).count())
+            self.assertEqual(2, self._count(
+                self.variant1, ConversionRollup.ENROLLMENTS, period))
+
+    def test_cumulative_trend(self):
+        day1 = datetime.datetime(2013, 3, 11, 10)
+        day2 = datetime.datetime(2013, 3, 12, 10)
+        day3 = datetime.datetime(2013, 3, 13, 10)
+        create_goal(name='signup')
+        for variant, goal, when, count in [
+                (self.variant1, None, day1, 4),
+                (self.variant1, 'signup', day1, 1),
+                (self.variant1, None, day2, 4),
+                (self.variant1, 'signup', day3, 3),
+                (self.variant2, None, day3, 2)]:
+            ConversionRollup.increment(self.exp.pk, variant.pk, goal, when,
+                                       count)
+
+        buckets, trends = ConversionRollup.cumulative_trend(
+            self.exp, ConversionRollup.DAY, datetime.datetime(2013, 3, 12))
+
+        self.assertEqual([datetime.datetime(2013, 3, 12),
+                          datetime.datetime(2013, 3, 13)], buckets)
+        self.assertEqual(1, len(trends))
+        self.assertEqual('signup', trends[0]['goal'])
+        self.assertEqual([12.5, 50.0], trends[0]['series'][0]['points'])
+        self.assertEqual([0.0, 0.0], trends[0]['series'][1]['points'])
@@ -0,0 +1,94 @@
+import os
+import tempfile
+from unittest import skipIf
+
+from django.test import TestCase
+from mock import patch
+
+from splango import snapshot
+from splango.models import Enrollment
+from splango.tests import (
+    create_enrollment, create_experiment, create_goal, create_goal_record,
+    create_subject, create_variant)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class SnapshotTest(TestCase):
+
+    def setUp(self):
+        self.exp = create_experiment()
+        self.variant1 = create_variant(name='variant1', experiment=self.exp)
+        self.variant2 = create_variant(name='variant2', experiment=self.exp)
+        self.goal = create_goal(name='signup')
+
+        self.subject1 = create_subject()
+        self.subject2 = create_subject()
+        create_enrollment(subject=self.subject1, variant=self.variant1,
+                          experiment=self.exp)
+        create_enrollment(subject=self.subject2, variant=self.variant2,
+                          experiment=self.exp)
+        create_goal_record(subject=self.subject2, goal=self.goal)
+        # goals of subjects not enrolled in the experiment are left out
+        create_goal_record(goal=self.goal)
+
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_build_columns(self):
+        variants, goals, columns = snapshot.build_columns(self.exp)
+
+        self.assertEqual(['variant1', 'variant2'], variants)
+        self.assertEqual(['signup'], goals)
+        self.assertEqual(
+            [self.subject1.pk, self.subject2.pk, self.subject2.pk],
+            list(columns['subject_id']))
+        self.assertEqual([0, 1, 1], list(columns['variant']))
+        self.assertEqual([-1, -1, 0], list(columns['goal']))
+
+    def test_enrolled_meanwhile(self):
+        late = create_subject()
+        create_enrollment(subject=late, variant=self.variant1,
+                          experiment=self.exp)
+        create_goal_record(subject=late, goal=self.goal)
+        filter_enrollments = Enrollment.objects.filter
+
+        def before_late(**kwargs):
+            # the enrollment of late is committed after this query
+            return filter_enrollments(**kwargs).exclude(subject=late)
+
+        with patch.object(Enrollment.objects, 'filter', before_late):
+            variants, goals, columns = snapshot.build_columns(self.exp)
+
+        self.assertNotIn(late.pk, columns['subject_id'])
+        self.assertEqual(3, len(columns['subject_id']))
+
+    def test_narrow_longs(self):
+        with patch('splango.snapshot._INT64', 'i'):
+            self.assertRaises(RuntimeError, snapshot.build_columns, self.exp)
+
+    def test_write_header(self):
+        self.assertEqual(3, snapshot.write_snapshot(self.exp, self.path))
+
+        with open(self.path, 'rb') as f:
+            header, offset = snapshot.read_header(f)
+        self.assertEqual(self.exp.name, header['experiment'])
+        self.assertEqual(3, header['rows'])
+        self.assertEqual(0, offset % 8)
+        self.assertEqual(offset + 4 * 3 * 8, os.path.getsize(self.path))
+
+    @skipIf(numpy is None, "NumPy is not installed")
+    def test_load_snapshot(self):
+        snapshot.write_snapshot(self.exp, self.path)
+        loaded = snapshot.load_snapshot(self.path)
+
+        self.assertEqual(3, len(loaded))
+        self.assertEqual(['signup'], loaded.goals)
+        self.assertEqual([1], list(loaded.variant[loaded.goal == 0]))
+        self.assertEqual(numpy.dtype('<f8'), loaded.timestamp.dtype)
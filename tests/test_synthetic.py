@@ -0,0 +1,122 @@
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+from mock import patch
+
+from splango.management.commands.splango_generate_traffic import \
+    parse_rates
+from splango.models import (ConversionRollup, Enrollment, GoalRecord,
+                            Subject, goal_name_cache)
+from splango.synthetic import TrafficGenerator
+
+
+class TrafficGeneratorTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        goal_name_cache.clear()
+
+    @override_settings(SPLANGO_ROLLUPS=True)
+    def test_generate(self):
+        generator = TrafficGenerator("synth", {"a": 0.5, "b": 1.0},
+                                     ["signup", "purchase"], drop_off=0,
+                                     registered=0.5, seed=1)
+        counts = generator.generate(200, batch_size=30)
+
+        self.assertEqual(200, counts["subjects"])
+        self.assertEqual(200, Subject.objects.count())
+        self.assertEqual(200, Enrollment.objects.filter(
+            experiment="synth").count())
+        self.assertEqual(counts["registered"], Subject.objects.filter(
+            registered_as__isnull=False).count())
+        self.assertTrue(60 < counts["registered"] < 140)
+
+        # nobody drops off: every signup leads to a purchase
+        signups = GoalRecord.objects.filter(goal="signup").count()
+        self.assertEqual(signups, GoalRecord.objects.filter(
+            goal="purchase").count())
+        self.assertEqual(2 * signups, counts["goal_records"])
+        # every subject of b signs up
+        self.assertEqual(0, Enrollment.objects.filter(variant__name="b")
+                         .exclude(subject__goals="signup").count())
+
+        enrolled = sum(ConversionRollup.objects.filter(
+            period=ConversionRollup.DAY,
+            goal=ConversionRollup.ENROLLMENTS).values_list(
+            "count", flat=True))
+        self.assertEqual(200, enrolled)
+
+    @override_settings(SPLANGO_ROLLUPS=True)
+    def test_existing_rollups(self):
+        for seed in (1, 2):
+            TrafficGenerator("synth", {"a": 0.5}, ["signup"], days=1,
+                             seed=seed).generate(20)
+
+        enrolled = sum(ConversionRollup.objects.filter(
+            period=ConversionRollup.DAY,
+            goal=ConversionRollup.ENROLLMENTS).values_list(
+            "count", flat=True))
+        self.assertEqual(40, enrolled)
+        self.assertEqual(40, Subject.objects.count())
+
+    def test_concurrent_writers(self):
+        generator = TrafficGenerator("synth", {"a": 0.5}, ["signup"],
+                                     registered=1.0, seed=1)
+        generate_chunk = generator._generate_chunk
+
+        def _generate_chunk(*args):
+            generate_chunk(*args)
+            # another process creating subjects and users meanwhile
+            user = User.objects.create(
+                username="live%d" % User.objects.count())
+            Subject.objects.create(registered_as=user)
+
+        with patch.object(generator, "_generate_chunk", _generate_chunk):
+            counts = generator.generate(30, batch_size=10)
+
+        self.assertEqual(30, counts["subjects"])
+        self.assertEqual(33, Subject.objects.count())
+        self.assertEqual(33, User.objects.count())
+        self.assertEqual(30, Enrollment.objects.values("subject").distinct()
+                         .count())
+
+    def test_bulk_inserts(self):
+        connection.use_debug_cursor = True
+        try:
+            TrafficGenerator("synth", {"a": 0.5}, ["signup"], registered=0.5,
+                             seed=1).generate(200, batch_size=100)
+            inserts = [q["sql"].split('"')[1] for q in connection.queries
+                       if q["sql"].startswith("INSERT")]
+        finally:
+            connection.use_debug_cursor = None
+
+        # one query per chunk
+        self.assertEqual(2, inserts.count("splango_subject"))
+        self.assertEqual(2, inserts.count("auth_user"))
+        self.assertEqual(200, Subject.objects.count())
+
+    def test_invalid_drop_off(self):
+        self.assertRaises(ValueError, TrafficGenerator, "synth", {"a": 0.1},
+                          ["signup", "purchase", "renewal"], drop_off=[0.5])
+
+    def test_command(self):
+        out = StringIO()
+        call_command("splango_generate_traffic", "synth", subjects=50,
+                     variants="a:0.2,b:0.3", funnel="visit,signup",
+                     drop_off="0.4", seed=3, stdout=out)
+
+        self.assertTrue(
+            out.getvalue().startswith("50 subjects (0 registered)"))
+        self.assertEqual(50, Enrollment.objects.count())
+
+    def test_parse_rates(self):
+        self.assertEqual([("a", 0.2), ("b", 0.25)],
+                         parse_rates("a:0.2, b:.25").items())
+        self.assertRaises(CommandError, parse_rates, "a:2")
+        self.assertRaises(CommandError, parse_rates, "a")
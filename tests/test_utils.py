@@ -0,0 +1,102 @@
+import datetime
+from unittest import TestCase
+
+from django.db import transaction
+from django.test import TestCase as DjangoTestCase
+from mock import patch
+
+from splango.models import Subject
+from splango.utils import (PrefixTrie, bulk_insert, bulk_insert_with_ids,
+                           insert_before_last, insert_into_chunks)
+
+
+class InsertBeforeLastTest(TestCase):
+
+    def test_insert(self):
+        self.assertEqual(
+            '<body></body><p>x</p>--></BODY>',
+            insert_before_last('<body></body><p>x</p></BODY>', '</body>',
+                               '-->'))
+
+    def test_outside_window(self):
+        content = '<body></body>' + 'x' * 100
+        self.assertEqual(
+            content, insert_before_last(content, '</body>', '-->', window=50))
+
+
+class InsertIntoChunksTest(TestCase):
+
+    def test_insert(self):
+        chunks = ['<html><bo', 'dy>'] + ['x' * 10] * 10 + ['</bo', 'dy>']
+        result = list(insert_into_chunks(iter(chunks), '</body>', '-->',
+                                         window=16))
+
+        self.assertTrue(len(result) > 1)
+        self.assertEqual(''.join(chunks).replace('</body>', '--></body>'),
+                         ''.join(result))
+
+    def test_empty(self):
+        self.assertEqual([], list(insert_into_chunks([], '</body>', '-->')))
+
+
+class PrefixTrieTest(TestCase):
+
+    def test_longest_match(self):
+        trie = PrefixTrie([('/api/', False), ('/api/public/', True),
+                           ('/static/', False)])
+
+        self.assertEqual(False, trie.longest_match('/api/users/'))
+        self.assertEqual(True, trie.longest_match('/api/public/page/'))
+        self.assertEqual(False, trie.longest_match('/static/'))
+        self.assertEqual('x', trie.longest_match('/stat', 'x'))
+        self.assertEqual('x', trie.longest_match('/', 'x'))
+
+
+class BulkInsertTest(DjangoTestCase):
+
+    def test_created_kept(self):
+        created = datetime.datetime(2013, 1, 1, 10)
+        bulk_insert(Subject, [Subject(created=created),
+                              Subject(id=1000, created=created)], 1)
+
+        self.assertEqual([created, created], [
+            s.created for s in Subject.objects.all()])
+        self.assertTrue(Subject.objects.filter(pk=1000).exists())
+
+    def test_field_untouched(self):
+        field = Subject._meta.get_field("created")
+        insert = Subject._base_manager._insert
+
+        def checked_insert(*args, **kwargs):
+            if kwargs.get("raw"):
+                self.assertTrue(field.auto_now_add)
+                # a concurrent thread saving a subject gets a creation date
+                self.assertIsNotNone(Subject.objects.create().created)
+            return insert(*args, **kwargs)
+
+        with patch.object(Subject._base_manager, "_insert", checked_insert):
+            bulk_insert(Subject, [Subject(created=datetime.datetime.now())])
+
+        self.assertEqual(2, Subject.objects.count())
+
+    def test_large_batches(self):
+        created = datetime.datetime(2013, 1, 1, 10)
+        # more rows than SQLite takes in one query
+        bulk_insert(Subject, [Subject(created=created) for i in range(600)] +
+                    [Subject(id=i, created=created)
+                     for i in range(5000, 5600)], 1000)
+
+        self.assertEqual(1200, Subject.objects.filter(created=created)
+                         .count())
+
+    def test_with_ids(self):
+        Subject.objects.create()
+        subjects = [Subject(created=datetime.datetime(2013, 1, i))
+                    for i in range(1, 4)]
+
+        with transaction.commit_on_success():
+            bulk_insert_with_ids(Subject, subjects)
+
+        self.assertEqual(
+            [s.created for s in subjects],
+            [Subject.objects.get(pk=s.pk).created for s in subjects])
@@ -0,0 +1,118 @@
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.http import Http404
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from splango import views
+from splango.archive import archive_experiment
+from splango.models import Experiment, goal_name_cache
+from splango.synthetic import TrafficGenerator
+from splango.tests import create_experiment, create_experiment_report
+
+
+class ExperimentsOverviewTest(TestCase):
+
+    urls = 'tests.urls'
+
+    def setUp(self):
+        cache.clear()
+        goal_name_cache.clear()
+        User.objects.create_superuser("staff", "staff@example.com", "pw")
+        self.client.login(username="staff", password="pw")
+
+    def _generate(self, exp_name):
+        return TrafficGenerator(exp_name, {"a": 0.5, "b": 1.0},
+                                ["signup", "purchase"], drop_off=0,
+                                seed=0).generate(20)
+
+    def _get_num_queries(self, path):
+        connection.use_debug_cursor = True
+        try:
+            # the queries are reset when the request starts
+            response = self.client.get(path)
+            return response, len(connection.queries)
+        finally:
+            connection.use_debug_cursor = None
+
+    @override_settings(SPLANGO_ROLLUPS=True)
+    def test_counts(self):
+        counts = self._generate("overview_exp")
+        create_experiment_report(experiment=Experiment(name="overview_exp"),
+                                 title="Funnel")
+
+        response = self.client.get('/splango/admin/')
+
+        self.assertEqual(200, response.status_code)
+        exp, = response.context["experiments"]
+        self.assertEqual(20, exp.enrolled)
+        signup = [c for c in exp.goal_counts if c[0] == "signup"][0]
+        self.assertEqual(counts["goal_records"] / 2, signup[1])
+        self.assertEqual(["Funnel"], [r.title for r in exp.reports])
+        self.assertContains(response, "a,b")
+
+    @override_settings(SPLANGO_ROLLUPS=False)
+    def test_counts_without_rollups(self):
+        counts = self._generate("overview_exp")
+
+        reached = counts["goal_records"] / 2
+        self.assertEqual(
+            {"overview_exp": {None: 20, "signup": reached,
+                              "purchase": reached}},
+            Experiment.count_conversions(["overview_exp"]))
+
+    @override_settings(SPLANGO_ROLLUPS=False)
+    def test_counts_of_archived(self):
+        self._generate("overview_exp")
+        self._generate("live_exp")
+        before = Experiment.count_conversions(["overview_exp", "live_exp"])
+        directory = tempfile.mkdtemp()
+        try:
+            archive_experiment(Experiment.objects.get(name="overview_exp"),
+                               directory)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(before, Experiment.count_conversions(
+            ["overview_exp", "live_exp"]))
+
+    def test_constant_queries(self):
+        self._generate("overview_0")
+        response, few = self._get_num_queries('/splango/admin/')
+
+        for i in range(1, 6):
+            self._generate("overview_%d" % i)
+            create_experiment_report(
+                experiment=Experiment(name="overview_%d" % i))
+        response, many = self._get_num_queries('/splango/admin/')
+
+        self.assertEqual(6, len(response.context["experiments"]))
+        self.assertEqual(few, many)
+
+    @override_settings(SPLANGO_OVERVIEW_PAGE_SIZE=2)
+    def test_filter_and_pages(self):
+        for name in ("blue_1", "blue_2", "blue_3", "red_1"):
+            create_experiment(name=name)
+        Experiment.objects.filter(name="blue_3").update(
+            state=Experiment.PAUSED)
+
+        response = self.client.get('/splango/admin/', {"q": "blue"})
+        self.assertEqual(2, len(response.context["experiments"]))
+        self.assertContains(response, "q=blue&amp;page=2")
+
+        response = self.client.get('/splango/admin/',
+                                   {"q": "blue", "page": 2})
+        self.assertEqual(1, len(response.context["experiments"]))
+
+        response = self.client.get('/splango/admin/', {"state": "paused"})
+        self.assertEqual(["blue_3"], [e.name for e in
+                                      response.context["experiments"]])
+
+        request = RequestFactory().get('/splango/admin/', {"page": 9})
+        request.user = User.objects.get(username="staff")
+        self.assertRaises(Http404, views.experiments_overview, request)
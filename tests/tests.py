@@ -1,3 +1,15 @@
 from .test_init import *
 from .test_models import *
 from .test_templatetags import *
+from .test_eventlog import *
+from .test_snapshot import *
+from .test_archive import *
+from .test_middleware import *
+from .test_utils import *
+from .test_background import *
+from .test_cache import *
+from .test_metrics import *
+from .test_budget import *
+from .test_synthetic import *
+from .test_views import *
+from .test_admin import *
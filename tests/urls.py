@@ -0,0 +1,55 @@
+from django.conf.urls import patterns, include, url
+from django.contrib import admin
+from django.http import HttpResponse
+
+
+admin.autodiscover()
+
+
+def experiment_page(request):
+    """Declare an experiment and log a goal, rendering a tiny HTML page."""
+    exp_manager = request.experiments_manager
+    variant = exp_manager.declare_and_enroll("page_exp", ["a", "b"])
+    exp_manager.log_goal("page.seen")
+    return HttpResponse("<html><body>%s</BODY></html>" % variant)
+
+
+def streamed_page(request):
+    exp_manager = request.experiments_manager
+    exp_manager.declare_and_enroll("page_exp", ["a", "b"])
+
+    def chunks():
+        yield "<html><body>"
+        for i in range(1000):
+            yield u"<p>%d</p>" % i
+        yield "</body></html>"
+    return HttpResponse(chunks())
+
+
+def many_experiments_page(request):
+    """Declare an experiment per item, like a tag used in a loop would."""
+    exp_manager = request.experiments_manager
+    variants = [exp_manager.declare_and_enroll("item_exp_%d" % i, ["a", "b"])
+                for i in range(5)]
+    return HttpResponse("<html><body>%s</body></html>" % variants)
+
+
+def plain_page(request):
+    return HttpResponse("<html><body>nothing to see</body></html>")
+
+
+def plain_json(request):
+    return HttpResponse("{}", content_type="application/json")
+
+
+urlpatterns = patterns(
+    '',
+    url(r'^experiment/$', experiment_page),
+    url(r'^streamed/$', streamed_page),
+    url(r'^many/$', many_experiments_page),
+    url(r'^plain/$', plain_page),
+    url(r'^plain/json/$', plain_json),
+    url(r'^splango/', include('splango.urls')),
+    # the admin templates of the splango views link to the admin
+    url(r'^admin/', include(admin.site.urls)),
+)